@@ -2,143 +2,630 @@ import traceback
 import logging
 import subprocess
 import tempfile
+import threading
+import itertools
+import time
+from datetime import datetime,date
+import collections
 import re
 import os
+import json
 
 import psycopg2
+import psycopg2.extensions
 
-from utils import parse_db_connection_string,classproperty,gdal
+from utils import parse_db_connection_string,classproperty,gdal,JSONEncoder
+
+from .pool import ConnectionPool
+from . import settings
 
 
 
 logger = logging.getLogger(__name__)
 
+#the supported COPY framings
+COPY_CSV = "csv"
+COPY_BINARY = "binary"
+
+#the count modes
+COUNT_EXISTS = "exists"
+COUNT_ESTIMATE = "estimate"
+COUNT_EXACT = "exact"
+
+def _csv_value(value):
+    """
+    Encode a python value as a postgresql csv field; None is encoded as a unquoted empty field which is null in postgresql
+    The dict and list values are encoded as json text for the json/jsonb columns
+    """
+    if value is None:
+        return ""
+    elif isinstance(value,bool):
+        return "t" if value else "f"
+    elif isinstance(value,(int,float)):
+        return str(value)
+    elif isinstance(value,(bytes,bytearray,memoryview)):
+        return "\\x{}".format(bytes(value).hex())
+    elif isinstance(value,(datetime,date)):
+        return value.isoformat()
+    elif isinstance(value,(dict,list)):
+        return "\"{}\"".format(json.dumps(value,cls=JSONEncoder).replace("\"","\"\""))
+    else:
+        return "\"{}\"".format(str(value).replace("\"","\"\""))
+
+class _CopyInStream(object):
+    """
+    A file like object to feed the rows to 'COPY FROM STDIN' lazily
+    rows: a iterable of row tuples if csv framing; a iterable of bytes chunks which are already encoded with postgresql binary copy format if binary framing
+    """
+    def __init__(self,rows,copy_format=COPY_CSV):
+        self._rows = iter(rows)
+        self._format = copy_format
+        self._buffer = bytearray()
+        self.rows = 0
+        self.bytes = 0
+
+    def _next_chunk(self):
+        row = next(self._rows)
+        if self._format == COPY_BINARY:
+            return bytes(row)
+        self.rows += 1
+        return ("{}\n".format(",".join(_csv_value(v) for v in row))).encode()
+
+    def read(self,size=-1):
+        try:
+            while size is None or size < 0 or len(self._buffer) < size:
+                self._buffer += self._next_chunk()
+        except StopIteration:
+            pass
+        if size is None or size < 0 or size >= len(self._buffer):
+            data = bytes(self._buffer)
+            self._buffer = bytearray()
+        else:
+            data = bytes(self._buffer[:size])
+            del self._buffer[:size]
+        self.bytes += len(data)
+        return data
+
+    readline = read
+
+class _CopyOutStream(object):
+    """
+    A file like object to count the bytes written by 'COPY TO STDOUT'
+    """
+    def __init__(self,f):
+        self._f = f
+        self.bytes = 0
+
+    def write(self,data):
+        self.bytes += len(data)
+        return self._f.write(data)
+
+#the sql to get the row estimate of a plain table, return -1 if the table was never analyzed
+reltuples_sql = "SELECT CASE WHEN relkind = 'r' AND relpages > 0 THEN reltuples ELSE -1 END FROM pg_class WHERE oid = to_regclass(%s)"
+#the sql to get the partition strategy of a partitioned table
+partition_strategy_sql = "SELECT partstrat FROM pg_partitioned_table WHERE partrelid = to_regclass(%s)"
+#the sql to get the range partitions of a partitioned table, the bound literals are casted by the server to avoid parsing the timestamp format
+range_partitions_sql = r"""SELECT name,bounds[1]::timestamptz,bounds[2]::timestamptz FROM (
+    SELECT c.relname AS name,regexp_match(pg_get_expr(c.relpartbound,c.oid),'FROM \(''(.+?)''\) TO \(''(.+?)''\)') AS bounds
+    FROM pg_inherits i JOIN pg_class c ON i.inhrelid = c.oid
+    WHERE i.inhparent = to_regclass(%s)
+) p WHERE bounds IS NOT NULL ORDER BY 2"""
+
+#the sql to check whether the replica is in recovery and has replayed a wal location of the primary
+replica_status_sql = "SELECT pg_is_in_recovery(),pg_last_wal_replay_lsn() >= %s::pg_lsn"
+
+def _quote_identifier(name):
+    return ".".join("\"{}\"".format(n.strip("\"")) for n in name.split("."))
+
+def _copy_stats(action,rows,nbytes,seconds):
+    stats = {
+        "rows":rows,
+        "bytes":nbytes,
+        "seconds":seconds,
+        "rows_per_second":(rows / seconds) if seconds > 0 else None,
+        "bytes_per_second":(nbytes / seconds) if seconds > 0 else None
+    }
+    logger.debug("{} {} rows({} bytes) in {:.3f} seconds, {:.0f} rows/s, {:.0f} bytes/s".format(action,rows,nbytes,seconds,stats["rows_per_second"] or 0,stats["bytes_per_second"] or 0))
+    return stats
+
 
 class PostgreSQL(object):
+    """
+    A postgresql database client backed by a thread safe connection pool.
+    Each method borrows a pooled connection if it is not called in a 'with db.connection()' block;
+    all the methods called in the same thread in a 'with db.connection()' block share one pooled connection.
+    """
     non_char = re.compile("[^a-zA-Z0-9\_]+")
     head_or_tail_non_char = re.compile("^[^a-zA-Z0-9]+|[^a-zA-Z0-9]+$")
-    def __init__(self,db_url):
+    def __init__(self,db_url,pool_maxsize=None,pool_idle_timeout=None,replica_url=None):
+        """
+        replica_url: the url of an optional read-only streaming replica, which is returned by 'reader' to offload the heavy reads from the primary
+        """
         self._params = parse_db_connection_string(db_url)
-        self._connection = None
-        self._cursor = None
+        self._pool = ConnectionPool(
+            self._params,
+            maxsize=settings.DB_POOL_MAXSIZE if pool_maxsize is None else pool_maxsize,
+            idle_timeout=settings.DB_POOL_IDLE_TIMEOUT if pool_idle_timeout is None else pool_idle_timeout,
+            health_check_interval=settings.DB_POOL_HEALTH_CHECK_INTERVAL,
+            acquire_timeout=settings.DB_POOL_ACQUIRE_TIMEOUT
+        )
+        #the connection, cursor and nested depth of the 'with' block are per thread
+        self._local = threading.local()
+        self._cursor_seq = itertools.count(1)
+        #the registered prepared statements and their execution statistics
+        self._statements = {}
+        self._statement_stats = {}
+        self._stats_lock = threading.Lock()
+        self.replica = PostgreSQL(replica_url,pool_maxsize=pool_maxsize,pool_idle_timeout=pool_idle_timeout) if replica_url else None
+
+    def _replica_caught_up(self,lsn):
+        """
+        Return True if the replica has replayed the primary's wal location lsn
+        """
+        in_recovery,replayed = self.replica.get(replica_status_sql,params=(lsn,))
+        #not in recovery means the replica was promoted
+        return not in_recovery or bool(replayed)
 
-    def __enter__(self):
-        self._connection = psycopg2.connect(host=self._params["host"],port=self._params["port"],dbname=self._params["dbname"],user=self._params["user"],password=self._params["password"])
-        self._cursor = self._connection.cursor()
+    def reader(self,until=None):
+        """
+        Return the database to run the heavy reads.
+        Return the replica if the replica is configured and has replayed all the changes committed in the primary before calling this method;
+        otherwise return the primary.
+        until: only used for logging; the data before until is complete in the replica because the replica has replayed the primary's current wal location
+        Wait at most DB_REPLICA_MAX_WAIT seconds for the replica to catch up
+        """
+        if not self.replica:
+            return self
+        try:
+            lsn = self.get("SELECT pg_current_wal_lsn()")[0]
+            deadline = time.monotonic() + settings.DB_REPLICA_MAX_WAIT
+            while True:
+                if self._replica_caught_up(lsn):
+                    logger.debug("The replica({}) has replayed the wal location {}, read the data before {} from replica".format(self.replica._params["host"],lsn,until))
+                    return self.replica
+                if time.monotonic() >= deadline:
+                    break
+                time.sleep(settings.DB_REPLICA_POLL_INTERVAL)
+            logger.warning("The replica({}) hasn't replayed the wal location {} in {} seconds, read from primary".format(self.replica._params["host"],lsn,settings.DB_REPLICA_MAX_WAIT))
+        except:
+            logger.error("Failed to check the replay status of the replica({}), read from primary. {}".format(self.replica._params["host"],traceback.format_exc()))
         return self
 
-    def __exit__ (self, type, value, tb):
-        if self._cursor:
+    @property
+    def _connection(self):
+        return getattr(self._local,"connection",None)
+
+    @property
+    def _cursor(self):
+        return getattr(self._local,"cursor",None)
+
+    def connection(self):
+        """
+        Return a context manager to share one pooled connection in the with block.
+        Can be nested, the connection is returned to the pool when the outermost block exits.
+        """
+        return self
+
+    def __enter__(self):
+        depth = getattr(self._local,"depth",0)
+        if depth == 0:
+            connection = self._pool.acquire()
             try:
-                self._cursor.close()
+                self._local.cursor = connection.cursor()
             except:
-                logger.error(traceback.format_exc())
-            finally:
-                self._cursor = None
-        if self._connection:
+                self._pool.release(connection,discard=True)
+                raise
+            self._local.connection = connection
+        self._local.depth = depth + 1
+        return self
+
+    def __exit__ (self, type, value, tb):
+        self._local.depth -= 1
+        if self._local.depth > 0:
+            return
+        connection = self._local.connection
+        cursor = self._local.cursor
+        self._local.connection = None
+        self._local.cursor = None
+        if cursor:
             try:
-                self._connection.close()
+                cursor.close()
             except:
                 logger.error(traceback.format_exc())
-            finally:
-                self._connection = None
+        if connection:
+            #discard the connection if it is broken
+            self._pool.release(connection,discard=isinstance(value,(psycopg2.OperationalError,psycopg2.InterfaceError)))
 
-    def query(self,sql,columns=None):
+    def commit(self):
+        """
+        Commit the transaction of the connection shared in the 'with db.connection()' block
+        """
+        if not self._connection:
+            raise Exception("Can only commit in a 'with db.connection()' block")
+        self._connection.commit()
+
+    def rollback(self):
+        """
+        Rollback the transaction of the connection shared in the 'with db.connection()' block
+        """
+        if not self._connection:
+            raise Exception("Can only rollback in a 'with db.connection()' block")
+        self._connection.rollback()
+
+    def _end_read_transaction(self,in_transaction):
+        """
+        End the transaction implicitly started by a read statement, to avoid keeping a idle transaction in a long 'with' block
+        """
+        if not in_transaction and not self._connection.autocommit:
+            self._connection.rollback()
+
+    def _in_transaction(self):
+        return self._connection.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+    def query(self,sql,columns=None,params=None):
         """
         Execute select sql and return a list of tuple or a list of dict if columns is not None
+        params: the parameters bound to the sql
         """
         if self._cursor:
-            return self._query(sql,columns=columns)
+            return self._query(sql,columns=columns,params=params)
         else:
             with self as db:
-                return db._query(sql,columns=columns)
+                return db._query(sql,columns=columns,params=params)
                 
-    def _query(self,sql,columns=None):
-        self._cursor.execute(sql)
-        if columns:
-            return [dict(zip(columns,row)) for row in self._cursor.fetchall()]
-        else:
-            return self._cursor.fetchall()
+    def _query(self,sql,columns=None,params=None):
+        in_transaction = self._in_transaction()
+        try:
+            self._cursor.execute(sql,params)
+            if columns:
+                return [dict(zip(columns,row)) for row in self._cursor.fetchall()]
+            else:
+                return self._cursor.fetchall()
+        finally:
+            self._end_read_transaction(in_transaction)
 
-        
-    def get(self,sql,columns=None):
+    def query_iter(self,sql,params=None,batch_size=None,columns=None):
+        """
+        Execute select sql with a server side cursor, and return a generator which yields the rows one by one.
+        The rows are fetched batch by batch, so the memory is bounded by batch_size.
+        The generator uses its own pooled connection, which is returned to the pool when the generator is exhausted or closed.
+        params: the parameters bound to the sql
+        batch_size: the number of rows fetched from server each time
+        columns: if not None, yield named tuples with the columns as field names; otherwise yield tuples
+        """
+        batch_size = batch_size or settings.DB_FETCH_SIZE
+        row_class = collections.namedtuple("Row",columns,rename=True) if columns else None
+        connection = self._pool.acquire()
+        discard = False
+        try:
+            cursor = connection.cursor(name="query_iter_{}".format(next(self._cursor_seq)))
+            cursor.itersize = batch_size
+            try:
+                cursor.execute(sql,params)
+                while True:
+                    rows = cursor.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    if row_class:
+                        for row in rows:
+                            yield row_class._make(row)
+                    else:
+                        for row in rows:
+                            yield row
+            finally:
+                try:
+                    cursor.close()
+                except:
+                    logger.debug("Failed to close the server side cursor.{}".format(traceback.format_exc()))
+        except (psycopg2.OperationalError,psycopg2.InterfaceError):
+            discard = True
+            raise
+        finally:
+            self._pool.release(connection,discard=discard)
+
+    def get(self,sql,columns=None,params=None):
         """
         Execute select sql and return a list of data or a dict if columns is not None
+        params: the parameters bound to the sql
         """
         if self._cursor:
-            return self._get(sql,columns=columns)
+            return self._get(sql,columns=columns,params=params)
         else:
             with self as db:
-                return db._get(sql,columns=columns)
+                return db._get(sql,columns=columns,params=params)
                 
-    def _get(self,sql,columns=None):
-        self._cursor.execute(sql)
-        if columns:
-            return dict(zip(columns,self._cursor.fetchone()))
-        else:
-            return self._cursor.fetchone()
+    def _get(self,sql,columns=None,params=None):
+        in_transaction = self._in_transaction()
+        try:
+            self._cursor.execute(sql,params)
+            if columns:
+                return dict(zip(columns,self._cursor.fetchone()))
+            else:
+                return self._cursor.fetchone()
+        finally:
+            self._end_read_transaction(in_transaction)
 
-    def update(self,sql,commit=True,autocommit=False):
+    def update(self,sql,commit=True,autocommit=False,params=None):
         """
         insert/update/delete data
+        params: the parameters bound to the sql
         """
         if self._cursor:
-            return self._update(sql,commit=commit,autocommit=autocommit)
+            return self._update(sql,commit=commit,autocommit=autocommit,params=params)
         else:
             with self as db:
-                return db._update(sql,commit=commit)
+                return db._update(sql,commit=commit,autocommit=autocommit,params=params)
                 
-    def _update(self,sql,commit=True,autocommit=False):
+    def _update(self,sql,commit=True,autocommit=False,params=None):
         try:
             commit = False if autocommit else commit
             if autocommit:
                 self._connection.autocommit = True
-            self._cursor.execute(sql)
+            self._cursor.execute(sql,params)
             if commit:
                 self._connection.commit()
         except:
             self._connection.rollback()
             raise
         finally:
-            self._connection.autocommit = False
+            #only reset the autocommit set by this method, setting it in a pending transaction is not allowed
+            if autocommit:
+                self._connection.autocommit = False
 
         return self._cursor.rowcount
 
 
-    def executeDDL(self,sql):
+    def copy_in(self,table,columns,rows,copy_format=COPY_CSV,commit=True):
+        """
+        Bulk load the rows into table with 'COPY FROM STDIN'
+        columns: the list of columns
+        rows: a iterable(can be a generator) of row tuples if csv framing; a iterable of bytes chunks encoded with postgresql binary copy format if binary framing
+        Return the statistics {"rows","bytes","seconds","rows_per_second","bytes_per_second"}, rows is None for binary framing
+        """
+        if self._cursor:
+            return self._copy_in(table,columns,rows,copy_format=copy_format,commit=commit)
+        else:
+            with self as db:
+                return db._copy_in(table,columns,rows,copy_format=copy_format,commit=commit)
+
+    def _copy_in(self,table,columns,rows,copy_format=COPY_CSV,commit=True):
+        sql = "COPY {} ({}) FROM STDIN WITH (FORMAT {})".format(_quote_identifier(table),",".join(_quote_identifier(c) for c in columns),copy_format)
+        stream = _CopyInStream(rows,copy_format=copy_format)
+        start = time.monotonic()
+        try:
+            self._cursor.copy_expert(sql,stream,size=settings.DB_COPY_BUFFER_SIZE)
+            if commit and not self._connection.autocommit:
+                self._connection.commit()
+        except:
+            self._connection.rollback()
+            raise
+        rows = self._cursor.rowcount if copy_format == COPY_BINARY else stream.rows
+        return _copy_stats("Copied into table({})".format(table),rows,stream.bytes,time.monotonic() - start)
+
+    def copy_out(self,sql,f,params=None,copy_format=COPY_CSV,header=False):
+        """
+        Export the result of the sql or the table with 'COPY TO STDOUT'
+        f: a binary file object or a file name
+        header: only meaningful for csv framing, write the column names as the first line
+        Return the statistics {"rows","bytes","seconds","rows_per_second","bytes_per_second"}
+        """
+        if isinstance(f,str):
+            with open(f,"wb") as fileobj:
+                return self.copy_out(sql,fileobj,params=params,copy_format=copy_format,header=header)
+
+        if self._cursor:
+            return self._copy_out(sql,f,params=params,copy_format=copy_format,header=header)
+        else:
+            with self as db:
+                return db._copy_out(sql,f,params=params,copy_format=copy_format,header=header)
+
+    def _copy_out(self,sql,f,params=None,copy_format=COPY_CSV,header=False):
+        if params:
+            sql = self._cursor.mogrify(sql,params).decode()
+        if self.non_char.search(sql):
+            source = "({})".format(sql)
+        else:
+            source = _quote_identifier(sql)
+        options = "FORMAT {}".format(copy_format)
+        if header and copy_format == COPY_CSV:
+            options += ", HEADER"
+        stream = _CopyOutStream(f)
+        in_transaction = self._in_transaction()
+        start = time.monotonic()
+        try:
+            self._cursor.copy_expert("COPY {} TO STDOUT WITH ({})".format(source,options),stream,size=settings.DB_COPY_BUFFER_SIZE)
+        finally:
+            self._end_read_transaction(in_transaction)
+        return _copy_stats("Copied out",self._cursor.rowcount,stream.bytes,time.monotonic() - start)
+
+    def executeDDL(self,sql,params=None):
         """
         execute ddl related statements
+        params: the parameters bound to the sql
         """
         if self._cursor:
-            return self._executeDDL(sql)
+            return self._executeDDL(sql,params=params)
         else:
             with self as db:
-                return db._executeDDL(sql)
+                return db._executeDDL(sql,params=params)
                 
-    def _executeDDL(self,sql):
+    def _executeDDL(self,sql,params=None):
         try:
-            self._cursor.execute(sql)
+            self._cursor.execute(sql,params)
             self._connection.commit()
         except:
             self._connection.rollback()
             raise
 
-    def count(self,table):
+    def count(self,table,params=None,mode=COUNT_EXACT):
         """
         Get the number of records in table.
         table can be a table, a view , and even a sql
+        params: the parameters bound to the sql
+        mode: 
+            COUNT_EXISTS: return 1 if table has any record; otherwise return 0
+            COUNT_ESTIMATE: return the row estimate of the planner, a table's estimate is read from pg_class.reltuples if the table was analyzed
+            COUNT_EXACT: return the exact number of records
+        """
+        is_sql = bool(self.non_char.search(table))
+        source = "({}) as tmp_a".format(table) if is_sql else "\"{}\"".format(table)
+        if mode == COUNT_EXISTS:
+            return 0 if self.get("select 1 from {} limit 1".format(source),params=params) is None else 1
+        elif mode == COUNT_ESTIMATE:
+            if not is_sql:
+                row = self.get(reltuples_sql,params=(table,))
+                if row and row[0] is not None and row[0] >= 0:
+                    return int(row[0])
+            #partitioned table, never analyzed table or a sql, use the row estimate of the plan
+            plan = self.get("EXPLAIN (FORMAT JSON) select 1 from {}".format(source),params=params)[0]
+            return int(plan[0]["Plan"]["Plan Rows"])
+        elif mode == COUNT_EXACT:
+            return self.get("select count(1) from {}".format(source),params=params)[0]
+        else:
+            raise Exception("Count mode({}) is not supported".format(mode))
+
+    def get_range_partitions(self,table):
+        """
+        Return None if the table is not a range partitioned table;
+        otherwise return the list of partitions ({"name":partition table,"start":inclusive lower bound,"end":exclusive upper bound}) sorted by start
+        the default partition and the partitions bounded by MINVALUE or MAXVALUE are ignored
+        """
+        row = self.get(partition_strategy_sql,params=(table,))
+        if not row or row[0] != "r":
+            return None
+        return [{"name":name,"start":start,"end":end} for name,start,end in self.query(range_partitions_sql,params=(table,))]
+
+    def get_geometry_column(self,table):
+        """
+        Return the geometry column of the table; return None if not found
+        """
+        row = self.get("SELECT f_geometry_column FROM geometry_columns WHERE f_table_name = %s",params=(table,))
+        return row[0] if row else None
+
+    def is_empty(self,table):
+        """
+        Return True if the table has no rows
+        """
+        return self.get("SELECT 1 FROM {} LIMIT 1".format(_quote_identifier(table))) is None
+
+    def create_partition_table(self,table,partition,column,start,end):
+        """
+        Create a standalone table with the same columns, defaults and constraints as the partitioned table, it can be loaded and then attached as a partition.
+        A check constraint on the partition key is created to let 'ATTACH PARTITION' skip the validation scan
+        column: the partition key
+        """
+        logger.debug("Create the partition table({}) for table({}), range=[{},{})".format(partition,table,start,end))
+        self.executeDDL("CREATE TABLE {0} (LIKE {1} INCLUDING DEFAULTS INCLUDING CONSTRAINTS); ALTER TABLE {0} ADD CONSTRAINT {2} CHECK ({3} >= %s AND {3} < %s)".format(
+            _quote_identifier(partition),
+            _quote_identifier(table),
+            _quote_identifier("{}_range".format(partition.split(".")[-1])),
+            _quote_identifier(column)
+        ),params=(start,end))
+
+    def attach_partition(self,table,partition,start,end):
+        """
+        Attach the table as the partition [start,end) of the range partitioned table;
+        the indexes of the partitioned table are created on the partition during attaching
+        """
+        logger.debug("Attach the table({}) to table({}) as partition, range=[{},{})".format(partition,table,start,end))
+        self.executeDDL("ALTER TABLE {} ATTACH PARTITION {} FOR VALUES FROM (%s) TO (%s)".format(_quote_identifier(table),_quote_identifier(partition)),params=(start,end))
+
+    def detach_partition(self,table,partition,drop=True):
+        """
+        Detach the partition from the partitioned table
+        drop: drop the detached partition table
+        """
+        sql = "ALTER TABLE {0} DETACH PARTITION {1}".format(_quote_identifier(table),_quote_identifier(partition))
+        if drop:
+            sql = "{}; DROP TABLE {}".format(sql,_quote_identifier(partition))
+        logger.debug("Detach the partition({}) from table({}), drop={}".format(partition,table,drop))
+        self.executeDDL(sql)
+
+    def prepare(self,name,sql):
+        """
+        Register a server side prepared statement; sql uses $1,$2,... as the parameter placeholders
+        The statement is prepared lazily once per pooled connection, and its plan is reused by the following executions in the same connection
+        """
+        with self._stats_lock:
+            self._statements[name] = sql
+            self._statement_stats[name] = {"prepares":0,"executions":0,"seconds":0.0,"planning_seconds":None}
+        if self.replica:
+            self.replica.prepare(name,sql)
+
+    def execute_prepared(self,name,params=None,fetch=None,commit=True):
         """
-        if self.non_char.search(table):
-            #not a table
-            count_sql = "select count(1) from ({}) as tmp_a ".format(table)
+        Execute the prepared statement
+        fetch: None: return the number of affected rows; 'one': return the first row; 'all': return all rows
+        commit: only meaningful if fetch is None
+        """
+        if self._cursor:
+            return self._execute_prepared(name,params=params,fetch=fetch,commit=commit)
         else:
-            #table or view
-            count_sql = "select count(1) from \"{}\"".format(table)
-        return self.get(count_sql)[0]
+            with self as db:
+                return db._execute_prepared(name,params=params,fetch=fetch,commit=commit)
+
+    def _execute_prepared(self,name,params=None,fetch=None,commit=True):
+        if name not in self._statements:
+            raise Exception("The prepared statement({}) is not registered".format(name))
+        params = tuple(params) if params else ()
+        execute_sql = "EXECUTE {}({})".format(name,",".join(["%s"] * len(params))) if params else "EXECUTE {}".format(name)
+        connection = self._connection
+        in_transaction = self._in_transaction()
+        stats = self._statement_stats[name]
+        try:
+            if name not in connection.prepared_statements:
+                self._cursor.execute("PREPARE {} AS {}".format(name,self._statements[name]))
+                connection.prepared_statements.add(name)
+                with self._stats_lock:
+                    stats["prepares"] += 1
+                if settings.DB_MEASURE_PLANNING and stats["planning_seconds"] is None:
+                    #the planning time of the first execution, which is the planning cost paid by each execution of an unprepared statement
+                    self._cursor.execute("EXPLAIN (SUMMARY true, FORMAT JSON) {}".format(execute_sql),params)
+                    plan = self._cursor.fetchone()[0]
+                    with self._stats_lock:
+                        stats["planning_seconds"] = plan[0]["Planning Time"] / 1000
+
+            start = time.monotonic()
+            self._cursor.execute(execute_sql,params)
+            if fetch == "one":
+                result = self._cursor.fetchone()
+            elif fetch == "all":
+                result = self._cursor.fetchall()
+            else:
+                result = self._cursor.rowcount
+                if commit and not connection.autocommit:
+                    connection.commit()
+            with self._stats_lock:
+                stats["executions"] += 1
+                stats["seconds"] += time.monotonic() - start
+        except:
+            connection.rollback()
+            raise
+
+        if fetch:
+            self._end_read_transaction(in_transaction)
+        return result
 
-    def import_spatial_data(self,spatialfile,layer=None,table=None,overwrite=True):
+    def statement_stats(self):
+        """
+        Return the execution statistics of the prepared statements
+        planning_saved_seconds: the estimated planning time saved by reusing the plan;
+            postgresql replans the first 5 executions of a prepared statement before it switches to the cached generic plan
+        """
+        result = {}
+        with self._stats_lock:
+            for name,stats in self._statement_stats.items():
+                stats = dict(stats)
+                if stats["planning_seconds"] is not None:
+                    stats["planning_saved_seconds"] = stats["planning_seconds"] * max(0,stats["executions"] - 5 * stats["prepares"])
+                result[name] = stats
+        return result
+
+    def import_spatial_data(self,spatialfile,layer=None,table=None,overwrite=True,unlogged=False,spatial_index=True):
         """
         import spatial data to database
+        unlogged: create the table as UNLOGGED table, which is not written to wal; only for the staging table which can be recreated from the file
+        spatial_index: create the spatial index during importing; if False, the caller can create the index after all data are loaded
         return the imported table name
         """
         metadata = gdal.get_layers(spatialfile,layer=layer)[0]
@@ -148,7 +635,7 @@ class PostgreSQL(object):
 
         folder,filename = os.path.split(spatialfile)
 
-        cmd = """cd {0} && ogr2ogr {9} -preserve_fid -f "PostgreSQL" PG:"host='{3}' {4} dbname='{5}' {6} {7}" {1} -nln {8}  {2}""".format(
+        cmd = """cd {0} && ogr2ogr {9} -preserve_fid -f "PostgreSQL" PG:"host='{3}' {4} dbname='{5}' {6} {7}" {1} -nln {8} {10} {2}""".format(
             folder,
             filename,
             layer,
@@ -158,12 +645,14 @@ class PostgreSQL(object):
             "user='{}'".format(self._params["user"]) if self._params["user"] else "",
             "password='{}'".format(self._params["password"]) if self._params["password"] else "",
             table,
-            "-overwrite" if overwrite else ""
+            "-overwrite" if overwrite else "",
+            " ".join(o for o in ("-lco UNLOGGED=ON" if unlogged else None,None if spatial_index else "-lco SPATIAL_INDEX=NONE") if o)
         )
     
         logger.debug("Import spatial data to database. cmd='{}'".format(cmd))
         subprocess.check_call(cmd,shell=True)
-        count = self.count(table)
+        #the exact count is required to guarantee all features are imported
+        count = self.count(table,mode=COUNT_EXACT)
         if count == metadata["features"]:
             logger.debug("Succeed to import {1} features to table({0})".format(table,count))
         else:
@@ -171,14 +660,21 @@ class PostgreSQL(object):
 
         return table
 
-    def export_spatial_data(self,sql,filename=None,file_ext=None,layer=None):
+    def export_spatial_data(self,sql,filename=None,file_ext=None,layer=None,features=None,layer_options=None):
         """
         export spatial table data using gdal
         table can be a table or a view
-        check: Check whether the table count is equal with the exported feature count.
+        features: the number of features to export, which is used to check whether all features are exported; if None, count the features with the sql
+        layer_options: the list of the layer creation options of the output driver, for example ["SPATIAL_INDEX=YES"]
         Return (layer metadata ,filename) if exported;otherwise return None if no data to export
         """
-        count = self.count(sql)
+        if features is None:
+            #check whether there is any data to export before paying for the exact count
+            if self.count(sql,mode=COUNT_EXISTS) == 0:
+                return None
+            count = self.count(sql)
+        else:
+            count = features
         if count == 0:
             #no data to export
             return None
@@ -194,7 +690,7 @@ class PostgreSQL(object):
 
         cmd = """ogr2ogr -overwrite -preserve_fid {0} PG:"host='{2}' {3} dbname='{4}' {5} {6}" {1} -sql "{7}" """.format(
             filename,
-            "-nln {}".format(layer) if layer else "",
+            " ".join((["-nln {}".format(layer)] if layer else []) + ["-lco {}".format(o) for o in (layer_options or [])]),
             self._params["host"],
             "port={}".format(self._params["port"]) if self._params["port"] else "",
             self._params["dbname"],
@@ -0,0 +1,171 @@
+import time
+import threading
+import logging
+
+import psycopg2
+import psycopg2.extensions
+
+logger = logging.getLogger(__name__)
+
+class PooledConnection(psycopg2.extensions.connection):
+    """
+    A psycopg2 connection which keeps the pool's bookkeeping data
+    """
+    def __init__(self,*args,**kwargs):
+        super().__init__(*args,**kwargs)
+        self.last_used = time.monotonic()
+        #the names of the statements prepared in this connection
+        self.prepared_statements = set()
+
+class PoolTimeout(Exception):
+    pass
+
+class ConnectionPool(object):
+    """
+    A thread safe postgresql connection pool
+    maxsize: the maximum number of opened connections
+    idle_timeout: close the connection which is idle for more than idle_timeout seconds
+    health_check_interval: check whether the connection is still usable if it is idle for more than health_check_interval seconds
+    acquire_timeout: the maximum seconds to wait for an available connection; wait forever if None
+    """
+    def __init__(self,params,maxsize=5,idle_timeout=300,health_check_interval=30,acquire_timeout=None):
+        self._params = params
+        self._maxsize = maxsize
+        self._idle_timeout = idle_timeout
+        self._health_check_interval = health_check_interval
+        self._acquire_timeout = acquire_timeout
+        self._idle = []
+        self._size = 0
+        self._cond = threading.Condition()
+
+    @property
+    def size(self):
+        """
+        The number of opened connections
+        """
+        return self._size
+
+    def _connect(self):
+        return psycopg2.connect(
+            host=self._params["host"],
+            port=self._params["port"],
+            dbname=self._params["dbname"],
+            user=self._params["user"],
+            password=self._params["password"],
+            connection_factory=PooledConnection
+        )
+
+    def _close(self,conn):
+        try:
+            conn.close()
+        except:
+            logger.error("Failed to close the database connection",exc_info=True)
+
+    def _is_healthy(self,conn):
+        """
+        Return True if the connection is usable
+        """
+        if conn.closed:
+            return False
+        if time.monotonic() - conn.last_used < self._health_check_interval:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except:
+            logger.debug("The idle database connection is not usable, discard it")
+            return False
+
+    def _remove_expired(self):
+        """
+        Remove the expired idle connections from the pool, must be called with the lock
+        Return the removed connections
+        """
+        if not self._idle_timeout:
+            return []
+        now = time.monotonic()
+        expired = [conn for conn in self._idle if now - conn.last_used >= self._idle_timeout]
+        if expired:
+            self._idle = [conn for conn in self._idle if now - conn.last_used < self._idle_timeout]
+            self._size -= len(expired)
+            self._cond.notify(len(expired))
+        return expired
+
+    def acquire(self):
+        """
+        Return a usable connection from the pool, open a new connection if no idle connection and the pool is not full
+        """
+        deadline = None if self._acquire_timeout is None else (time.monotonic() + self._acquire_timeout)
+        conn = None
+        expired = []
+        with self._cond:
+            while True:
+                expired.extend(self._remove_expired())
+                if self._idle:
+                    conn = self._idle.pop()
+                    break
+                elif self._size < self._maxsize:
+                    self._size += 1
+                    break
+                timeout = None if deadline is None else (deadline - time.monotonic())
+                if timeout is not None and timeout <= 0:
+                    raise PoolTimeout("Can't get a database connection in {} seconds, all {} connections are in use".format(self._acquire_timeout,self._maxsize))
+                self._cond.wait(timeout)
+
+        for c in expired:
+            self._close(c)
+
+        if conn is not None and not self._is_healthy(conn):
+            self._close(conn)
+            conn = None
+
+        if conn is None:
+            try:
+                conn = self._connect()
+            except:
+                with self._cond:
+                    self._size -= 1
+                    self._cond.notify()
+                raise
+
+        return conn
+
+    def release(self,conn,discard=False):
+        """
+        Return the connection to the pool
+        discard: close the connection instead of returning it to the pool
+        """
+        if not discard and not conn.closed:
+            try:
+                if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+                if conn.autocommit:
+                    conn.autocommit = False
+            except:
+                logger.debug("Failed to reset the database connection, discard it")
+                discard = True
+
+        if discard or conn.closed:
+            self._close(conn)
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+        else:
+            conn.last_used = time.monotonic()
+            with self._cond:
+                self._idle.append(conn)
+                self._cond.notify()
+
+    def close(self):
+        """
+        Close all the idle connections
+        """
+        with self._cond:
+            idle = self._idle
+            self._idle = []
+            self._size -= len(idle)
+            self._cond.notify(len(idle))
+        for conn in idle:
+            self._close(conn)
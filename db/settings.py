@@ -0,0 +1,20 @@
+from common_settings import *
+
+#the maximum number of opened connections of each database
+DB_POOL_MAXSIZE = env("DB_POOL_MAXSIZE",default=5)
+#close the pooled connection which is idle for more than DB_POOL_IDLE_TIMEOUT seconds
+DB_POOL_IDLE_TIMEOUT = env("DB_POOL_IDLE_TIMEOUT",default=300)
+#check whether the pooled connection is usable if it is idle for more than DB_POOL_HEALTH_CHECK_INTERVAL seconds
+DB_POOL_HEALTH_CHECK_INTERVAL = env("DB_POOL_HEALTH_CHECK_INTERVAL",default=30)
+#the maximum seconds to wait for an available pooled connection
+DB_POOL_ACQUIRE_TIMEOUT = env("DB_POOL_ACQUIRE_TIMEOUT",default=300)
+#the number of rows fetched from server each time by a server side cursor
+DB_FETCH_SIZE = env("DB_FETCH_SIZE",default=10000)
+#the buffer size used by COPY
+DB_COPY_BUFFER_SIZE = env("DB_COPY_BUFFER_SIZE",default=65536)
+#measure the planning time of each prepared statement once, to estimate the planning time saved by reusing the plan
+DB_MEASURE_PLANNING = env("DB_MEASURE_PLANNING",default=True)
+#the maximum seconds to wait for the replica to replay the changes committed in the primary before reading from the replica
+DB_REPLICA_MAX_WAIT = env("DB_REPLICA_MAX_WAIT",default=60)
+#the interval(seconds) to check the replay status of the replica
+DB_REPLICA_POLL_INTERVAL = env("DB_REPLICA_POLL_INTERVAL",default=1)
@@ -1,21 +1,208 @@
+import os
+import time
 import tempfile
+import logging
+from datetime import datetime,date
 
-def dump_data(view,view_sql=None,delete_sql=None,file_name=None,file_ext=None,check=True):
+try:
+    from osgeo import ogr,osr
+except ImportError:
+    ogr = None
+
+from utils import gdal
+from .database import _quote_identifier
+from . import settings
+
+logger = logging.getLogger(__name__)
+
+#the ogr driver of the supported dump file formats
+drivers = {
+    ".gpkg":"GPKG",
+    ".fgb":"FlatGeobuf",
+    ".parquet":"Parquet"
+}
+
+#the ogr geometry type of the postgis geometry type
+geometry_types = {
+    "POINT":"wkbPoint",
+    "MULTIPOINT":"wkbMultiPoint",
+    "LINESTRING":"wkbLineString",
+    "MULTILINESTRING":"wkbMultiLineString",
+    "POLYGON":"wkbPolygon",
+    "MULTIPOLYGON":"wkbMultiPolygon",
+    "GEOMETRYCOLLECTION":"wkbGeometryCollection"
+}
+
+#the columns of the table or view
+columns_sql = "SELECT column_name,udt_name FROM information_schema.columns WHERE table_name = %s ORDER BY ordinal_position"
+#the srid and geometry type of the geometry column
+geometry_column_sql = "SELECT srid,type FROM geometry_columns WHERE f_table_name = %s AND f_geometry_column = %s"
+
+def _get_field_type(udt_name):
+    """
+    Return the ogr field type of the postgresql column type
     """
+    if udt_name in ("int2","int4"):
+        return ogr.OFTInteger
+    elif udt_name == "int8":
+        return ogr.OFTInteger64
+    elif udt_name in ("float4","float8","numeric"):
+        return ogr.OFTReal
+    elif udt_name == "bool":
+        return ogr.OFTInteger
+    elif udt_name == "date":
+        return ogr.OFTDate
+    elif udt_name in ("timestamp","timestamptz"):
+        return ogr.OFTDateTime
+    else:
+        return ogr.OFTString
+
+def _set_field(feature,index,value):
+    if value is None:
+        feature.SetFieldNull(index)
+    elif isinstance(value,datetime):
+        tz = value.utcoffset()
+        #ogr timezone flag: 100 is UTC, each increment is 15 minutes
+        tzflag = 0 if tz is None else (100 + int(tz.total_seconds() // 900))
+        feature.SetField(index,value.year,value.month,value.day,value.hour,value.minute,value.second + value.microsecond / 1000000,tzflag)
+    elif isinstance(value,date):
+        feature.SetField(index,value.year,value.month,value.day,0,0,0,0)
+    elif isinstance(value,bool):
+        feature.SetField(index,1 if value else 0)
+    elif isinstance(value,(int,float,str)):
+        feature.SetField(index,value)
+    else:
+        feature.SetField(index,str(value))
+
+def _dump_with_ogr(db,view,file_name,file_ext,layer,batch_size):
+    """
+    Stream the rows of the view through a server side cursor into the spatial file with gdal python bindings
+    Return the number of dumped rows
+    """
+    columns = db.query(columns_sql,params=(view,))
+    if not columns:
+        raise Exception("Table or view({}) does not exist".format(view))
+    geometry_column = next((c[0] for c in columns if c[1] == "geometry"),None)
+    fields = [c for c in columns if c[0] != geometry_column]
+
+    driver = ogr.GetDriverByName(drivers[file_ext])
+    if os.path.exists(file_name):
+        driver.DeleteDataSource(file_name)
+    ds = driver.CreateDataSource(file_name)
+    srs = None
+    geometry_type = ogr.wkbNone
+    if geometry_column:
+        row = db.get(geometry_column_sql,params=(view,geometry_column))
+        geometry_type = ogr.wkbUnknown
+        if row:
+            srid,gtype = row
+            if srid:
+                srs = osr.SpatialReference()
+                srs.ImportFromEPSG(srid)
+                srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+            geometry_type = getattr(ogr,geometry_types.get((gtype or "").upper(),"wkbUnknown"))
+    lyr = ds.CreateLayer(layer,srs=srs,geom_type=geometry_type)
+    for name,udt_name in fields:
+        lyr.CreateField(ogr.FieldDefn(name,_get_field_type(udt_name)))
+    defn = lyr.GetLayerDefn()
+
+    select_columns = [_quote_identifier(c[0]) for c in fields]
+    if geometry_column:
+        select_columns.append("ST_AsBinary({})".format(_quote_identifier(geometry_column)))
+    sql = "SELECT {} FROM {}".format(",".join(select_columns),_quote_identifier(view))
+
+    rows = 0
+    try:
+        lyr.StartTransaction()
+        for row in db.query_iter(sql,batch_size=batch_size):
+            feature = ogr.Feature(defn)
+            for i in range(len(fields)):
+                _set_field(feature,i,row[i])
+            if geometry_column and row[-1] is not None:
+                feature.SetGeometry(ogr.CreateGeometryFromWkb(bytes(row[-1])))
+            lyr.CreateFeature(feature)
+            feature = None
+            rows += 1
+            if rows % batch_size == 0:
+                #commit each batch to bound the memory used by the driver
+                lyr.CommitTransaction()
+                lyr.StartTransaction()
+        lyr.CommitTransaction()
+    finally:
+        lyr = None
+        ds = None
+    return rows
+
+def dump_data(db,view,view_sql=None,delete_sql=None,file_name=None,file_ext=None,check=True,layer=None,batch_size=None):
+    """
+    Dump the data of a table or view into a spatial file(gpkg, fgb or parquet) chunk by chunk with bounded memory.
+    The rows are streamed through a server side cursor with gdal python bindings if installed; otherwise the data are exported by ogr2ogr
+    db: the database
     view : a table or view, where the data are coming from.
-    view_sql: if not none, should be executed before dumping, and should deleted after dumping
-    delete_sql: if not nond, should be executed after successfully dumping
+    view_sql: if not none, should be executed before dumping, and should be deleted after dumping
+    delete_sql: if not none, should be executed after successfully dumping
     file_name: the dump file name
     file_ext: the dump file extension
-    check:if True, will check the feature numbers between the view and the dumple file to check whether dumping is succeed or not.
+    check:if True, will check the feature numbers between the dumped rows and the dump file, and between the dumped rows and the deleted rows, to check whether dumping is succeed or not.
+    layer: the layer name of the dump file; use the view name if None
+    batch_size: the number of rows fetched and written in one batch
+    Return the dump result: file, layer, features, bytes, seconds, rows_per_second, deleted
     """
-    if not file_name or not file_ext:
-        raise Exception("Must specify file_name or file_ext, but not both")
+    if not file_name and not file_ext:
+        raise Exception("Must specify file_name or file_ext")
 
-    if file_ext[0] != ".":
+    if file_name:
+        file_ext = os.path.splitext(file_name)[1]
+    elif file_ext[0] != ".":
         file_ext = "." + file_ext
+    file_ext = file_ext.lower()
+    if file_ext not in drivers:
+        raise Exception("File format({}) is not supported, supported formats are {}".format(file_ext,list(drivers.keys())))
 
     if not file_name:
-        file_name = tempfile.NamedTemporaryFile(suffix=file_ext)
+        with tempfile.NamedTemporaryFile(prefix=view,suffix=file_ext,delete=False) as f:
+            file_name = f.name
+
+    layer = layer or view
+    batch_size = batch_size or settings.DB_FETCH_SIZE
+    result = {"file":file_name,"layer":layer,"features":0,"deleted":None}
+    if view_sql:
+        logger.debug("Create the view({}) to dump".format(view))
+        db.executeDDL(view_sql)
+    try:
+        start = time.monotonic()
+        if ogr:
+            rows = _dump_with_ogr(db,view,file_name,file_ext,layer,batch_size)
+        else:
+            export_result = db.export_spatial_data("SELECT * FROM {}".format(_quote_identifier(view)),filename=file_name,layer=layer)
+            rows = export_result[0]["features"] if export_result else 0
+        result["seconds"] = time.monotonic() - start
+        result["features"] = rows
+        result["bytes"] = os.path.getsize(file_name) if os.path.exists(file_name) else 0
+        result["rows_per_second"] = (rows / result["seconds"]) if result["seconds"] > 0 else None
+        logger.info("Dumped {} rows from {} to {} in {:.3f} seconds, {} rows/second, {} bytes".format(
+            rows,view,file_name,result["seconds"],"{:.0f}".format(result["rows_per_second"]) if result["rows_per_second"] else "-",result["bytes"]
+        ))
 
+        if check:
+            features = gdal.get_feature_count(file_name,layer) if rows else 0
+            if features != rows:
+                raise Exception("Failed, only {1}/{2} features were dumped to {0}".format(file_name,features,rows))
 
+        if delete_sql:
+            #delete the dumped rows, rollback if the deleted rows are not the dumped rows
+            with db.connection():
+                deleted = db.update(delete_sql,commit=False)
+                if check and deleted != rows:
+                    db.rollback()
+                    raise Exception("Rollback the deletion, {} rows were dumped, but {} rows would be deleted".format(rows,deleted))
+                db.commit()
+            result["deleted"] = deleted
+            logger.debug("Deleted {} dumped rows from database".format(deleted))
+        return result
+    finally:
+        if view_sql:
+            try:
+                db.executeDDL("DROP VIEW IF EXISTS {}".format(_quote_identifier(view)))
+            except:
+                logger.error("Failed to drop the view({})".format(view),exc_info=True)
@@ -0,0 +1,83 @@
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+#the sql to get the database load: the active client sessions, the sessions waiting for IO and the maximum replay lag(seconds) of the replicas
+load_sql = """SELECT
+    (SELECT count(1) FROM pg_stat_activity WHERE state = 'active' AND backend_type = 'client backend' AND pid <> pg_backend_pid()),
+    (SELECT count(1) FROM pg_stat_activity WHERE wait_event_type = 'IO' AND pid <> pg_backend_pid()),
+    (SELECT COALESCE(max(extract(epoch FROM replay_lag)),0) FROM pg_stat_replication)"""
+
+class LoadThrottle(object):
+    """
+    Pace the heavy maintenance work(for example archiving) by the load of the database.
+    Call 'wait' before each unit of work; it blocks while the database is overloaded, and the pause between the units grows while the database is busy and shrinks when the database has headroom.
+    The limit is ignored if it is None or 0.
+    max_active_sessions: the maximum number of the active client sessions
+    max_io_wait: the maximum number of the sessions waiting for IO
+    max_replication_lag: the maximum replay lag(seconds) of the replicas
+    max_pause: the maximum seconds to pause before checking the load again
+    The database user should be a member of role pg_monitor to see the state of the other users' sessions
+    """
+    min_pause = 1
+
+    def __init__(self,db,max_active_sessions=None,max_io_wait=None,max_replication_lag=None,max_pause=300):
+        self._db = db
+        self.max_active_sessions = max_active_sessions
+        self.max_io_wait = max_io_wait
+        self.max_replication_lag = max_replication_lag
+        self.max_pause = max_pause
+        self.pause = 0
+        self.waited = 0
+
+    @property
+    def enabled(self):
+        return any(limit for limit in (self.max_active_sessions,self.max_io_wait,self.max_replication_lag))
+
+    def load(self):
+        """
+        Return the current load as dict
+        """
+        active_sessions,io_wait,replication_lag = self._db.get(load_sql)
+        return {
+            "active_sessions":active_sessions,
+            "io_wait":io_wait,
+            "replication_lag":float(replication_lag or 0)
+        }
+
+    def overloaded(self,load):
+        """
+        Return the list of the exceeded limits
+        """
+        exceeded = []
+        for key,limit in (("active_sessions",self.max_active_sessions),("io_wait",self.max_io_wait),("replication_lag",self.max_replication_lag)):
+            if limit and load[key] > limit:
+                exceeded.append("{}={}>{}".format(key,load[key],limit))
+        return exceeded
+
+    def wait(self):
+        """
+        Block until the database load is under the limits; return the seconds paused
+        """
+        if not self.enabled:
+            return 0
+        paused = 0
+        while True:
+            load = self.load()
+            exceeded = self.overloaded(load)
+            if exceeded:
+                #back off exponentially while the database is busy
+                self.pause = min(self.max_pause,max(self.min_pause,self.pause * 2))
+                logger.info("The database is busy({}), pause {} seconds".format(",".join(exceeded),self.pause))
+            else:
+                #speed up when the database has headroom
+                self.pause = 0 if self.pause <= self.min_pause else self.pause / 2
+                if not self.pause:
+                    break
+            time.sleep(self.pause)
+            paused += self.pause
+            if not exceeded:
+                break
+        self.waited += paused
+        return paused
@@ -1,6 +1,7 @@
 import sys
 
 import utils
+from storage.metrics import dump_metrics
 
 def run():
     pass
@@ -10,4 +11,8 @@ if __name__ == "__main__":
         raise Exception("Command missing.")
 
     command = utils.load_module(sys.argv[1])
-    command.run()
+    try:
+        command.run()
+    finally:
+        #dump the storage metrics collected during the command
+        dump_metrics()
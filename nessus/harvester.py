@@ -41,7 +41,9 @@ def harvest():
                 storage = AzureBlobResource(
                         groupname,
                         settings.AZURE_STORAGE_CONNECTION_STRING,
-                        settings.NESSUS_CONTAINER)
+                        settings.NESSUS_CONTAINER,
+                        max_histories=settings.NESSUS_MAX_HISTORIES,
+                        history_days=settings.NESSUS_HISTORY_DAYS)
                 groupmetadata = storage.resourcemetadata
                 if groupmetadata:
                     try:
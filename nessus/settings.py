@@ -11,3 +11,7 @@ NESSUS_URL = env("NESSUS_URL",vtype=str,required=True)
 
 AZURE_STORAGE_CONNECTION_STRING = env("AZURE_STORAGE_CONNECTION_STRING",vtype=str,required=True)
 NESSUS_CONTAINER = env("NESSUS_CONTAINER",vtype=str,required=True)
+
+#the history retention policy of the nessus group resources
+NESSUS_MAX_HISTORIES = env("NESSUS_MAX_HISTORIES",default=100)
+NESSUS_HISTORY_DAYS = env("NESSUS_HISTORY_DAYS",vtype=int)
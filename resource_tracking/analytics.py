@@ -0,0 +1,310 @@
+import os
+import csv
+import json
+import sqlite3
+import logging
+import tempfile
+import concurrent.futures
+from datetime import timedelta
+from urllib.request import pathname2url
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+from utils import gdal,timezone
+import utils
+
+from . import settings
+from . import archive
+
+logger = logging.getLogger(__name__)
+
+#the mean radius of the earth in kilometers
+EARTH_RADIUS = 6371.0088
+
+#the columns of the loggedpoint array loaded from the archive file
+point_dtype = None if numpy is None else numpy.dtype([
+    ("deviceid","U64"),
+    ("seen","i8"),
+    ("x","f8"),
+    ("y","f8"),
+    ("velocity","f4"),
+    ("altitude","f4")
+])
+
+#the columns of the analytics result
+result_columns = ["date","deviceid","points","first_seen","last_seen","distance","moving_time","average_speed","max_speed","max_velocity","dwell_time","gaps","max_gap"]
+
+#the wkb point after the gpkg geometry header without envelope: byte order, geometry type, x, y
+_gpkg_point_dtype = None if numpy is None else numpy.dtype([("header","S8"),("byteorder","u1"),("type","<u4"),("x","<f8"),("y","<f8")])
+
+def _points_from_wkb(wkbs):
+    """
+    Return the x,y arrays of the wkb points
+    """
+    x = numpy.empty(len(wkbs),dtype=numpy.float64)
+    y = numpy.empty(len(wkbs),dtype=numpy.float64)
+    for i,wkb in enumerate(wkbs):
+        if wkb is None:
+            x[i] = y[i] = numpy.nan
+        else:
+            x[i],y[i] = numpy.frombuffer(wkb,dtype="{}f8".format("<" if wkb[0] == 1 else ">"),count=2,offset=5)
+    return x,y
+
+def _gpkg_points(blobs):
+    """
+    Return the x,y arrays of the gpkg point geometries
+    The points written by gdal are 29 bytes little endian blobs without envelope, which are decoded in one vectorized step
+    """
+    if blobs and all(b is not None and len(b) == _gpkg_point_dtype.itemsize for b in blobs):
+        points = numpy.frombuffer(b"".join(bytes(b) for b in blobs),dtype=_gpkg_point_dtype)
+        if (points["byteorder"] == 1).all() and (points["type"] == 1).all():
+            return points["x"].astype(numpy.float64),points["y"].astype(numpy.float64)
+    return _points_from_wkb([gdal.gpkg_geometry_to_wkb(b) for b in blobs])
+
+def _load_gpkg(filename):
+    layer_metadata = gdal.get_layers(filename)[0]
+    conn = sqlite3.connect("file:{}?mode=ro".format(pathname2url(os.path.abspath(filename))),uri=True)
+    try:
+        rows = conn.execute("SELECT deviceid,seen,velocity,altitude,{} FROM {}".format(gdal._quote(layer_metadata["geometry_column"]),gdal._quote(layer_metadata["layer"]))).fetchall()
+    finally:
+        conn.close()
+    points = numpy.empty(len(rows),dtype=point_dtype)
+    if rows:
+        deviceid,seen,velocity,altitude,geometry = zip(*rows)
+        points["deviceid"] = deviceid
+        points["seen"] = seen
+        points["velocity"] = numpy.array(velocity,dtype=numpy.float64)
+        points["altitude"] = numpy.array(altitude,dtype=numpy.float64)
+        points["x"],points["y"] = _gpkg_points(geometry)
+    return points
+
+def _load_parquet(filename):
+    if pyarrow is None:
+        raise Exception("Package 'pyarrow' is required to load the GeoParquet archive file({})".format(filename))
+    parquet_file = pyarrow.parquet.ParquetFile(filename)
+    geo = json.loads((parquet_file.schema_arrow.metadata or {}).get(b"geo",b"{}"))
+    geometry_column = geo.get("primary_column") or "geometry"
+    table = parquet_file.read(columns=["deviceid","seen","velocity","altitude",geometry_column])
+    points = numpy.empty(table.num_rows,dtype=point_dtype)
+    points["deviceid"] = table.column("deviceid").to_numpy(zero_copy_only=False)
+    points["seen"] = table.column("seen").to_numpy(zero_copy_only=False)
+    points["velocity"] = table.column("velocity").to_numpy(zero_copy_only=False)
+    points["altitude"] = table.column("altitude").to_numpy(zero_copy_only=False)
+    points["x"],points["y"] = _points_from_wkb(table.column(geometry_column).to_pylist())
+    return points
+
+def load_archive(filename,cache_file=None):
+    """
+    Load the archived loggedpoints into a numpy structured array(point_dtype) sorted by deviceid and seen
+    cache_file: if not None, the loaded array is saved into the npy file, and the npy file is memory mapped instead of loading the archive file again
+    """
+    if numpy is None:
+        raise Exception("Package 'numpy' is required to analyze the loggedpoint archive")
+    if cache_file and os.path.exists(cache_file):
+        return numpy.load(cache_file,mmap_mode="r")
+
+    if filename.lower().endswith(".parquet"):
+        points = _load_parquet(filename)
+    else:
+        points = _load_gpkg(filename)
+    #the GeoParquet archive files are already sorted, the sort is cheap in that case
+    points = points[numpy.lexsort((points["seen"],points["deviceid"]))]
+
+    if cache_file:
+        #write into a temporary file unique to this process first to avoid publishing a partial cache file when the same archive is cached concurrently
+        fd,tmp_file = tempfile.mkstemp(dir=os.path.dirname(cache_file) or None,prefix=os.path.basename(cache_file),suffix=".tmp")
+        try:
+            with os.fdopen(fd,"wb") as f:
+                numpy.save(f,points)
+            os.replace(tmp_file,cache_file)
+        except:
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+            raise
+        return numpy.load(cache_file,mmap_mode="r")
+    return points
+
+def _haversine(x1,y1,x2,y2):
+    """
+    Return the great circle distances(kilometers) between the points in degrees
+    """
+    x1,y1,x2,y2 = numpy.radians(x1),numpy.radians(y1),numpy.radians(x2),numpy.radians(y2)
+    a = numpy.sin((y2 - y1) / 2) ** 2 + numpy.cos(y1) * numpy.cos(y2) * numpy.sin((x2 - x1) / 2) ** 2
+    return 2 * EARTH_RADIUS * numpy.arcsin(numpy.sqrt(a))
+
+def analyze(points,gap=None,dwell_speed=None):
+    """
+    Compute the per-device metrics of the loggedpoints with vectorized operations
+    points: the loggedpoint array sorted by deviceid and seen
+    gap: the interval(seconds) between two loggedpoints longer than gap is a gap, the segment over a gap is not counted into distance and time
+    dwell_speed: the segment slower than dwell_speed(km/h) is a dwell
+    Return a list of dict with the result columns except date
+    """
+    gap = settings.LOGGEDPOINT_ANALYTICS_GAP if gap is None else gap
+    dwell_speed = settings.LOGGEDPOINT_ANALYTICS_DWELL_SPEED if dwell_speed is None else dwell_speed
+    if len(points) == 0:
+        return []
+    deviceids,starts,counts = numpy.unique(points["deviceid"],return_index=True,return_counts=True)
+    ends = starts + counts
+
+    #the segments between the consecutive points of the same device
+    seen = points["seen"]
+    interval = numpy.diff(seen).astype(numpy.float64)
+    distance = _haversine(points["x"][:-1],points["y"][:-1],points["x"][1:],points["y"][1:])
+    same_device = numpy.ones(len(interval),dtype=bool)
+    same_device[ends[:-1] - 1] = False
+    valid = same_device & ~numpy.isnan(distance)
+    is_gap = valid & (interval > gap)
+    connected = valid & ~is_gap
+    with numpy.errstate(divide="ignore",invalid="ignore"):
+        speed = numpy.where(interval > 0,distance / interval * 3600,0)
+    is_dwell = connected & (speed < dwell_speed)
+    moving = connected & ~is_dwell
+
+    #the segment i belongs to the device of point i; reduce the segments by the start point of each device
+    def _sum(values):
+        values = numpy.append(values,0)
+        return numpy.add.reduceat(values,starts)
+
+    def _max(values):
+        values = numpy.append(values,0)
+        return numpy.maximum.reduceat(values,starts)
+
+    #reduceat on the last point of a device includes the segment to the next device, which is masked out by the conditions
+    total_distance = _sum(numpy.where(connected,distance,0))
+    moving_time = _sum(numpy.where(moving,interval,0))
+    dwell_time = _sum(numpy.where(is_dwell,interval,0))
+    gaps = _sum(is_gap.astype(numpy.int64))
+    max_gap = _max(numpy.where(is_gap,interval,0))
+    max_speed = _max(numpy.where(moving,speed,0))
+    velocity = numpy.where(numpy.isnan(points["velocity"]),-1,points["velocity"])
+    max_velocity = numpy.maximum.reduceat(velocity,starts)
+
+    result = []
+    for i in range(len(deviceids)):
+        result.append({
+            "deviceid":str(deviceids[i]),
+            "points":int(counts[i]),
+            "first_seen":int(seen[starts[i]]),
+            "last_seen":int(seen[ends[i] - 1]),
+            "distance":round(float(total_distance[i]),3),
+            "moving_time":int(moving_time[i]),
+            "average_speed":round(float(total_distance[i] / moving_time[i] * 3600),3) if moving_time[i] else 0,
+            "max_speed":round(float(max_speed[i]),3),
+            "max_velocity":float(max_velocity[i]) if max_velocity[i] >= 0 else None,
+            "dwell_time":int(dwell_time[i]),
+            "gaps":int(gaps[i]),
+            "max_gap":int(max_gap[i])
+        })
+    return result
+
+def _get_cache_folder():
+    folder = settings.LOGGEDPOINT_ANALYTICS_CACHE_FOLDER or os.path.join(tempfile.gettempdir(),"loggedpoint_analytics")
+    if not os.path.exists(folder):
+        os.makedirs(folder,exist_ok=True)
+    return folder
+
+def _get_archive(d):
+    """
+    Return (the metadata of the archive file containing the day, the seen range of the day if the archive file is the monthly archive);
+    return None if the day was not archived
+    """
+    archive_group = archive.get_archive_group(d)
+    archive_id = archive.get_archive_id(d)
+    blob_resource = archive.get_blob_resource()
+    metadata = blob_resource.get_metadata(resourceid=archive_id,resource_group=archive_group)
+    if not metadata:
+        return None
+    if metadata.get("compacted_into"):
+        #analyze the day from the monthly archive
+        metadata = blob_resource.get_metadata(resourceid=metadata["compacted_into"],resource_group=archive_group,throw_exception=True)
+        start = timezone.datetime(d.year,d.month,d.day)
+        return (metadata,(int(start.timestamp()),int((start + timedelta(days=1)).timestamp())))
+    return (metadata,None)
+
+def _load_points(metadata):
+    """
+    Return the loggedpoint array of the archive file, the archive file is downloaded and cached if it is not cached
+    """
+    cache_folder = _get_cache_folder()
+    cache_file = os.path.join(cache_folder,"{}.{}.npy".format(metadata["resource_id"],metadata.get("file_md5") or "unknown"))
+    work_folder = None
+    try:
+        filename = None
+        if not os.path.exists(cache_file):
+            work_folder = tempfile.mkdtemp(prefix="analyze_loggedpoint")
+            filename = archive.get_blob_resource().download(metadata["resource_id"],resource_group=metadata["resource_group"],filename=os.path.join(work_folder,metadata["resource_file"]))[1]
+        return load_archive(filename,cache_file=cache_file)
+    finally:
+        utils.remove_folder(work_folder)
+
+def analyze_date(d,gap=None,dwell_speed=None):
+    """
+    Analyze the archived loggedpoints of the day without restoring them into database
+    The loaded array is cached as a npy file in the cache folder and is memory mapped in the next analysis
+    Return a list of dict with the result columns
+    """
+    archive_id = archive.get_archive_id(d)
+    archive_metadata = _get_archive(d)
+    if not archive_metadata:
+        logger.debug("The loggedpoints of the day({}) were not archived".format(d))
+        return []
+    metadata,seen_range = archive_metadata
+    points = _load_points(metadata)
+    if seen_range:
+        #the memory mapped monthly array is sorted by deviceid and seen, the selected points keep the order
+        points = points[(points["seen"] >= seen_range[0]) & (points["seen"] < seen_range[1])]
+    result = analyze(points,gap=gap,dwell_speed=dwell_speed)
+    for row in result:
+        row["date"] = d.strftime("%Y-%m-%d")
+    logger.debug("Analyzed the {} loggedpoints of {} devices archived in {}".format(len(points),len(result),archive_id))
+    return result
+
+def analyze_dates(start_date,end_date,workers=None,gap=None,dwell_speed=None):
+    """
+    Analyze the archived loggedpoints between start_date(inclusive) and end_date(exclusive) day by day in a process pool
+    The monthly archives are loaded and cached once before their days are analyzed in parallel
+    Return a list of dict with the result columns ordered by date and deviceid
+    """
+    workers = workers or settings.LOGGEDPOINT_ANALYTICS_WORKERS
+    dates = []
+    d = start_date
+    while d < end_date:
+        dates.append(d)
+        d += timedelta(days=1)
+    result = []
+    if workers > 1 and len(dates) > 1:
+        monthly_metadatas = {}
+        for d in dates:
+            archive_metadata = _get_archive(d)
+            if archive_metadata and archive_metadata[1]:
+                monthly_metadatas[archive_metadata[0]["resource_id"]] = archive_metadata[0]
+        for metadata in monthly_metadatas.values():
+            _load_points(metadata)
+        with concurrent.futures.ProcessPoolExecutor(max_workers=min(workers,len(dates))) as executor:
+            for rows in executor.map(analyze_date,dates,[gap] * len(dates),[dwell_speed] * len(dates)):
+                result.extend(rows)
+    else:
+        for d in dates:
+            result.extend(analyze_date(d,gap=gap,dwell_speed=dwell_speed))
+    return result
+
+def write_result(result,f,output_format="csv"):
+    """
+    Write the analytics result into the file object as csv or json
+    """
+    if output_format == "json":
+        json.dump(result,f,indent="    ")
+    else:
+        writer = csv.DictWriter(f,fieldnames=result_columns)
+        writer.writeheader()
+        for row in result:
+            writer.writerow(row)
@@ -2,6 +2,7 @@ import os
 import traceback
 import logging
 import tempfile
+import concurrent.futures
 from datetime import date,timedelta
 
 
@@ -10,29 +11,79 @@ import utils
 
 from storage.azure_blob import AzureBlobResource,AzureBlobResourceMetadata
 from storage.exception import ResourceAlreadyExist
+from db.throttle import LoadThrottle
 
 from . import settings
+from . import rawstore
+from . import catalog
+from . import grid
+from . import tracks
 
 logger = logging.getLogger(__name__)
 
+#the loggedpoint table, which can be a range partitioned table by day or month on column 'seen'
+loggedpoint_table = "tracking_loggedpoint"
 #the sql to find the earliest achiving date
 earliest_archive_date = "SELECT min(seen) FROM tracking_loggedpoint"
 #the sql to recreate the missing device from loggedpoint archive
 missing_device_sql = "INSERT INTO tracking_device (deviceid) SELECT distinct a.deviceid FROM {0} a WHERE NOT EXISTS(SELECT 1 FROM tracking_device b WHERE a.deviceid = b.deviceid)"
 #restore the loggedpoint from archive file to tracking_loggedpoint table with orignal id
-restore_with_id_sql = """INSERT INTO tracking_loggedpoint (id,device_id,point,heading,velocity,altitude,seen,message,source_device_type,raw)
+restore_with_id_sql = """INSERT INTO {1} (id,device_id,point,heading,velocity,altitude,seen,message,source_device_type,raw)
     SELECT a.id,b.id,a.point,a.heading,a.velocity,a.altitude,to_timestamp(a.seen),a.message,a.source_device_type,a.raw
-    FROM {0} a JOIN tracking_device b on a.deviceid = b.deviceid"""
+    FROM {0} a JOIN tracking_device b on a.deviceid = b.deviceid{2}"""
 
 #restore the loggedpoint from archive file to tracking_loggedpoint table with new id
-restore_sql = """INSERT INTO tracking_loggedpoint (device_id,point,heading,velocity,altitude,seen,message,source_device_type,raw)
-    SELECT b.id,a.point,a.heading,a.velocity,a.altitude,a.seen,a.message,a.source_device_type,a.raw
-    FROM {0} a JOIN tracking_device b on a.deviceid = b.deviceid"""
+restore_sql = """INSERT INTO {1} (device_id,point,heading,velocity,altitude,seen,message,source_device_type,raw)
+    SELECT b.id,a.point,a.heading,a.velocity,a.altitude,to_timestamp(a.seen),a.message,a.source_device_type,a.raw
+    FROM {0} a JOIN tracking_device b on a.deviceid = b.deviceid{2}"""
 
 #The sql to return the loggedpoint data to archive
-archive_sql = "SELECT a.id,a.point,a.heading,a.velocity,a.altitude,a.message,a.source_device_type,a.raw,extract(epoch from a.seen)::bigint as seen,b.deviceid,b.registration FROM tracking_loggedpoint a JOIN tracking_device b ON a.device_id = b.id WHERE a.seen >= '{0}' AND a.seen < '{1}'"
-#the sql to delete the archived loggedpoint from table tracking_loggedpoint
-del_sql = "DELETE FROM tracking_loggedpoint WHERE seen >= '{0}' AND seen < '{1}'"
+archive_sql = "SELECT a.id,a.point,a.heading,a.velocity,a.altitude,a.message,a.source_device_type{3},extract(epoch from a.seen)::bigint as seen,b.deviceid,b.registration FROM {2} a JOIN tracking_device b ON a.device_id = b.id WHERE a.seen >= '{0}' AND a.seen < '{1}'{4}"
+#the sql to return the raw messages to archive into the raw sidecar file, ordered by source device type to train a dictionary per source device type
+raw_sql = "SELECT a.id,a.source_device_type,a.raw FROM {0} a WHERE a.seen >= %s AND a.seen < %s AND a.raw IS NOT NULL ORDER BY a.source_device_type"
+#the order of the loggedpoint in the GeoParquet archive file
+#    the GeoPackage archive is not sorted, its feature table is clustered by fid, which is the loggedpoint id exported with '-preserve_fid'
+archive_sort_columns = ["deviceid","seen"]
+archive_order_by = " ORDER BY b.deviceid,a.seen"
+#the columns indexed in the archive file
+archive_index_columns = ["deviceid","seen"]
+#the supported archive file formats
+ARCHIVE_GPKG = "gpkg"
+ARCHIVE_PARQUET = "parquet"
+archive_formats = (ARCHIVE_GPKG,ARCHIVE_PARQUET)
+#the file extensions of the archive file formats
+archive_file_exts = (".gpkg",".parquet")
+#the archive type of the raw sidecar resource
+ARCHIVE_RAW = "raw"
+get_raw_sidecar_id = lambda archive_id:"{}.raw".format(archive_id)
+#the companion resource of the archive file to keep the density grid of the archived loggedpoints
+ARCHIVE_GRID = "grid"
+get_density_grid_id = lambda archive_id:"{}.grid".format(archive_id)
+#the companion resource of the archive file to keep the simplified daily trajectory of each device
+ARCHIVE_TRACKS = "tracks"
+get_track_overview_id = lambda archive_id:"{}.tracks".format(archive_id)
+#the companion resource of the archive file to keep the statistics of the archived loggedpoints
+#    the statistics are also kept in the archive metadata, but can be too big for the blob's custom metadata, the companion file is used to restore them when rebuilding the metadata
+ARCHIVE_STATS = "stats"
+get_stats_id = lambda archive_id:"{}.stats".format(archive_id)
+#the keys of the archive metadata referencing the companion resources
+archive_companion_keys = ("raw_sidecar","density_grid","track_overview","stats_file")
+#the functions to get the resource ids of the companion resources
+companion_id_functions = (get_raw_sidecar_id,get_density_grid_id,get_track_overview_id,get_stats_id)
+#the archive types of the companion resources and the keys of the archive metadata referencing them
+companion_keys_by_type = {ARCHIVE_RAW:"raw_sidecar",ARCHIVE_GRID:"density_grid",ARCHIVE_TRACKS:"track_overview",ARCHIVE_STATS:"stats_file"}
+#The sql to scan the loggedpoint within a time range
+scan_columns = ("id","deviceid","registration","point","heading","velocity","altitude","seen","message","source_device_type")
+scan_sql = "SELECT a.id,b.deviceid,b.registration,ST_AsText(a.point),a.heading,a.velocity,a.altitude,a.seen,a.message,a.source_device_type FROM tracking_loggedpoint a JOIN tracking_device b ON a.device_id = b.id WHERE a.seen >= %s AND a.seen < %s ORDER BY a.seen"
+#the prepared statement to count the loggedpoint to archive
+count_statement = "archive_count_loggedpoint"
+count_statement_sql = "SELECT count(1) FROM tracking_loggedpoint a JOIN tracking_device b ON a.device_id = b.id WHERE a.seen >= $1 AND a.seen < $2"
+#the prepared statement to delete the archived loggedpoint from table tracking_loggedpoint
+del_statement = "archive_delete_loggedpoint"
+del_statement_sql = "DELETE FROM tracking_loggedpoint WHERE seen >= $1 AND seen < $2"
+#the prepared statement to delete a batch of the archived loggedpoint from table tracking_loggedpoint
+del_batch_statement = "archive_delete_loggedpoint_batch"
+del_batch_statement_sql = "DELETE FROM tracking_loggedpoint WHERE id IN (SELECT id FROM tracking_loggedpoint WHERE seen >= $1 AND seen < $2 LIMIT $3)"
 #the datetime pattern used in the sql
 datetime_pattern = "%Y-%m-%d %H:%M:%S %Z"
 #the vrt pattern to generate a union layer for monthly archive 
@@ -50,6 +101,13 @@ individual_layer = """        <OGRVRTLayer name="{}">
 get_archive_group = lambda d:d.strftime("loggedpoint%Y-%m")
 #function to get the archive id from date from archive date
 get_archive_id= lambda d:d.strftime("loggedpoint%Y-%m-%d")
+#function to get the monthly archive id which is compacted from the daily archives of the month
+get_monthly_archive_id = lambda d:d.strftime("loggedpoint%Y-%m.monthly")
+
+#prepare the recurring archive statements, their plans are reused by the day by day archiving
+settings.DATABASE.prepare(count_statement,count_statement_sql)
+settings.DATABASE.prepare(del_statement,del_statement_sql)
+settings.DATABASE.prepare(del_batch_statement,del_batch_statement_sql)
 
 _blob_resource = None
 def get_blob_resource():
@@ -67,25 +125,77 @@ def get_blob_resource():
         )
     return _blob_resource
 
-def continuous_archive(delete_after_archive=False,check=False,max_archive_days=None,overwrite=False):
+_archive_status_client = None
+def get_archive_status_client():
+    """
+    Return the client of the archive status, which keeps the high-water marks of continuous archiving
+        archived_date: all the loggedpoints before and in this day were archived
+        deleted_date: all the archived loggedpoints before and in this day were deleted from table tracking_loggedpoint
+    """
+    global _archive_status_client
+    if _archive_status_client is None:
+        _archive_status_client = AzureBlobResourceMetadata(
+            settings.AZURE_CONNECTION_STRING,
+            settings.AZURE_CONTAINER,
+            resource_base_path=settings.LOGGEDPOINT_RESOURCE_NAME,
+            metaname="archive_status",
+            cache=True
+        )
+    return _archive_status_client
+
+_archive_throttle = None
+def get_archive_throttle():
+    """
+    Return the throttle which paces the archiving by the load of the primary database
+    """
+    global _archive_throttle
+    if _archive_throttle is None:
+        _archive_throttle = LoadThrottle(
+            settings.DATABASE,
+            max_active_sessions=settings.LOGGEDPOINT_ARCHIVE_MAX_ACTIVE_SESSIONS,
+            max_io_wait=settings.LOGGEDPOINT_ARCHIVE_MAX_IO_WAIT,
+            max_replication_lag=settings.LOGGEDPOINT_ARCHIVE_MAX_REPLICATION_LAG,
+            max_pause=settings.LOGGEDPOINT_ARCHIVE_MAX_PAUSE
+        )
+    return _archive_throttle
+
+def _get_earliest_date():
+    """
+    Return the date of the earliest loggedpoint in table tracking_loggedpoint; return None if table is empty
+    """
+    earliest = settings.DATABASE.get(earliest_archive_date)[0]
+    return timezone.nativetime(earliest).date() if earliest else None
+
+def continuous_archive(delete_after_archive=False,check=False,max_archive_days=None,overwrite=False,reconcile=False):
     """
     Continuous archiving the loggedpoint.
+    Start from the day after the persisted high-water mark, the days before the mark are skipped without touching the database.
     delete_after_archive: delete the archived data from table tracking_loggedpoint
     check: check whether archiving is succeed or not
     max_archive_days: the maxmium days to arhive
     overwrite: if true, overwrite the existing archived file;if false, throw exception if already archived 
+    reconcile: if true, start from the earliest loggedpoint in table tracking_loggedpoint, skip the already archived days and rebuild the high-water mark
     """
     db = settings.DATABASE
-    earliest_date = db.get(earliest_archive_date)[0].date()
+    status_client = get_archive_status_client()
+    status = dict(status_client.json or {})
+    archived_date = None if reconcile else status.get("archived_date")
+    deleted_date = None if reconcile else status.get("deleted_date")
+    if archived_date and (not delete_after_archive or deleted_date):
+        #start from the high-water mark
+        earliest_date = min(archived_date,deleted_date) if delete_after_archive else archived_date
+        earliest_date += timedelta(days=1)
+    else:
+        earliest_date = _get_earliest_date()
+        if earliest_date is None:
+            logger.info("No loggedpoints to archive")
+            return
+        if archived_date and archived_date < earliest_date:
+            #the loggedpoints after the high-water mark were already deleted
+            earliest_date = archived_date + timedelta(days=1)
     now = timezone.now()
     today = now.date()
-    if settings.END_WORKING_HOUR is not None and now.hour <= settings.END_WORKING_HOUR:
-        if settings.START_WORKING_HOUR is None or now.hour >= settings.START_WORKING_HOUR:
-            raise Exception("Please don't run continuous archive in working hour")
-
-    if settings.START_WORKING_HOUR is not None and now.hour >= settings.START_WORKING_HOUR:
-        if settings.END_WORKING_HOUR is None or now.hour <= settings.END_WORKING_HOUR:
-            raise Exception("Please don't run continuous archive in working hour")
+    throttle = get_archive_throttle()
 
     logger.info("Begin to continuous archiving loggedpoint, earliest archive date={0}, delete_after_archive={1}, check={2}, max_archive_days={3}".format(
         earliest_date,delete_after_archive,check,max_archive_days
@@ -100,16 +210,118 @@ def continuous_archive(delete_after_archive=False,check=False,max_archive_days=N
         earliest_date,last_archive_date,delete_after_archive,check,max_archive_days
     ))
     while archive_date < last_archive_date and (not max_archive_days or archived_days < max_archive_days):
-        archive_by_date(archive_date,delete_after_archive=delete_after_archive,check=check,overwrite=overwrite)
+        #wait until the database has headroom
+        throttle.wait()
+        if archived_date and archive_date <= archived_date:
+            #already archived, but not deleted
+            _delete_archived_data(archive_date)
+        else:
+            try:
+                archive_by_date(archive_date,delete_after_archive=delete_after_archive,check=check,overwrite=overwrite)
+            except ResourceAlreadyExist:
+                if not reconcile:
+                    raise
+                logger.debug("The loggedpoint of the day({}) has already been archived".format(archive_date))
+                if delete_after_archive:
+                    _delete_archived_data(archive_date)
+            archived_date = archive_date
+            status["archived_date"] = archived_date
+        if delete_after_archive:
+            deleted_date = archive_date
+            status["deleted_date"] = deleted_date
+        #persist the high-water mark after each day
+        status["updated"] = timezone.now()
+        status_client.update(status)
         archive_date += timedelta(days=1)
         archived_days += 1
 
-def archive_by_month(year,month,delete_after_archive=False,check=False,overwrite=False):
+    logger.info("Continuous archiving paused {:.0f} seconds to keep the database load under the limits".format(throttle.waited))
+    for name,stats in db.statement_stats().items():
+        logger.info("Prepared statement({}): prepares={}, executions={}, execution seconds={:.3f}, planning seconds per execution={}, estimated planning seconds saved={}".format(
+            name,stats["prepares"],stats["executions"],stats["seconds"],stats["planning_seconds"],stats.get("planning_saved_seconds")
+        ))
+
+def _delete_archived_data(d):
+    """
+    Delete the archived loggedpoint of the day from table tracking_loggedpoint
+    """
+    start_date = timezone.datetime(d.year,d.month,d.day)
+    end_date = start_date + timedelta(days=1)
+    deleted_rows = _delete_loggedpoint(settings.DATABASE,start_date,end_date)
+    logger.debug("Delete {} archived rows from table tracking_loggedpoint, day={}".format(deleted_rows,d))
+    return deleted_rows
+
+def _delete_rows(db,start_date,end_date):
+    """
+    Delete the loggedpoint between start_date(inclusive) and end_date(exclusive) from table tracking_loggedpoint batch by batch,
+    and pause between the batches if the database is busy
+    Return the number of deleted rows
+    """
+    batch_size = settings.LOGGEDPOINT_DELETE_BATCH_SIZE
+    if not batch_size:
+        return db.execute_prepared(del_statement,(start_date,end_date))
+    throttle = get_archive_throttle()
+    deleted_rows = 0
+    while True:
+        rows = db.execute_prepared(del_batch_statement,(start_date,end_date,batch_size))
+        deleted_rows += rows
+        if rows < batch_size:
+            return deleted_rows
+        throttle.wait()
+
+def _get_partition(partitions,start_date,end_date):
+    """
+    Return the partition whose range is [start_date,end_date); return None if not found
+    """
+    if partitions:
+        for partition in partitions:
+            if partition["start"] == start_date and partition["end"] == end_date:
+                return partition
+    return None
+
+def _delete_loggedpoint(db,start_date,end_date,partitions=None):
+    """
+    Delete the loggedpoint between start_date(inclusive) and end_date(exclusive) from table tracking_loggedpoint
+    If tracking_loggedpoint is a range partitioned table
+        the partitions covered by the range are detached and dropped,
+        the rows in the partially covered partitions are deleted, and the partially covered partition is dropped if it is empty and its range ends before end_date,
+        the rows in the ranges not covered by any partition are deleted through table tracking_loggedpoint, which reaches the default partition and the partitions bounded by MINVALUE or MAXVALUE
+    partitions: the partitions of table tracking_loggedpoint; retrieved from database if None
+    Return the number of deleted rows, including the rows in the dropped partitions
+    """
+    if partitions is None:
+        partitions = db.get_range_partitions(loggedpoint_table)
+    if not partitions:
+        return _delete_rows(db,start_date,end_date)
+
+    deleted_rows = 0
+    #the start of the range which is not covered by the processed partitions
+    uncovered_start = start_date
+    for partition in partitions:
+        if partition["end"] <= start_date or partition["start"] >= end_date:
+            continue
+        if partition["start"] > uncovered_start:
+            deleted_rows += _delete_rows(db,uncovered_start,partition["start"])
+        uncovered_start = max(uncovered_start,partition["end"])
+        if partition["start"] < start_date or partition["end"] > end_date:
+            deleted_rows += _delete_rows(db,max(start_date,partition["start"]),min(end_date,partition["end"]))
+            if partition["end"] > end_date or not db.is_empty(partition["name"]):
+                continue
+        else:
+            deleted_rows += db.count(partition["name"])
+        db.detach_partition(loggedpoint_table,partition["name"])
+        logger.debug("Dropped the partition({}) of table {}, range=[{},{})".format(partition["name"],loggedpoint_table,partition["start"],partition["end"]))
+    if uncovered_start < end_date:
+        deleted_rows += _delete_rows(db,uncovered_start,end_date)
+    return deleted_rows
+
+def archive_by_month(year,month,delete_after_archive=False,check=False,overwrite=False,archive_format=None):
     """
     Archive the logged point for the month.
     delete_after_archive: delete the archived data from table tracking_loggedpoint
     check: check whether archiving is succeed or not
     overwrite: if true, overwrite the existing archived file;if false, throw exception if already archived 
+    archive_format: the format of the archive file; use LOGGEDPOINT_ARCHIVE_FORMAT if None
     """
     now = timezone.now()
     today = now.date()
@@ -126,15 +338,16 @@ def archive_by_month(year,month,delete_after_archive=False,check=False,overwrite
     ))
 
     while archive_date < last_archive_date:
-        archive_by_date(archive_date,delete_after_archive=delete_after_archive,check=check,overwrite=overwrite)
+        archive_by_date(archive_date,delete_after_archive=delete_after_archive,check=check,overwrite=overwrite,archive_format=archive_format)
         archive_date += timedelta(days=1)
 
-def archive_by_date(d,delete_after_archive=False,check=False,overwrite=False):
+def archive_by_date(d,delete_after_archive=False,check=False,overwrite=False,archive_format=None):
     """
     Archive the logged point within the specified date
     delete_after_archive: delete the archived data from table tracking_loggedpoint
     check: check whether archiving is succeed or not
     overwrite: if true, overwrite the existing archived file;if false, throw exception if already archived 
+    archive_format: the format of the archive file; use LOGGEDPOINT_ARCHIVE_FORMAT if None
     """
     now = timezone.now()
     today = now.date()
@@ -144,25 +357,238 @@ def archive_by_date(d,delete_after_archive=False,check=False,overwrite=False):
     archive_id= get_archive_id(d)
     start_date = timezone.datetime(d.year,d.month,d.day)
     end_date = start_date + timedelta(days=1)
-    return archive(archive_group,archive_id,start_date,end_date,delete_after_archive=delete_after_archive,check=check,overwrite=overwrite)
+    return archive(archive_group,archive_id,start_date,end_date,delete_after_archive=delete_after_archive,check=check,overwrite=overwrite,archive_format=archive_format)
 
 
+def iter_loggedpoints(start_date,end_date,batch_size=None):
+    """
+    Return a generator which yields the loggedpoint between start_date(inclusive) and end_date(exclusive) one by one as named tuple, ordered by seen
+    The loggedpoints are fetched from a server side cursor batch by batch, from the replica if the replica has caught up with the primary
+    """
+    return settings.DATABASE.reader(until=end_date).query_iter(scan_sql,(start_date,end_date),batch_size=batch_size,columns=scan_columns)
+
 def _set_end_datetime(key):
     def _func(metadata):
         metadata[key] = timezone.now()
     return _func
 
-def archive(archive_group,archive_id,start_date,end_date,delete_after_archive=False,check=False,overwrite=False):
+def _get_layer_options(archive_format):
+    """
+    Return the layer creation options of the archive file format
+    """
+    if archive_format == ARCHIVE_PARQUET:
+        #columnar file compressed with zstd; the rows are sorted by device and time, so each row group covers a narrow range of devices
+        return ["COMPRESSION=ZSTD","ROW_GROUP_SIZE={}".format(settings.LOGGEDPOINT_PARQUET_ROW_GROUP_SIZE)]
+    else:
+        return ["SPATIAL_INDEX=YES"]
+
+def _is_data_archive(metadata):
+    """
+    Return True if the resource is a loggedpoint archive file; return False for the vrt file, the companion files and the daily archive files compacted into the monthly archive file
+    """
+    return metadata["resource_file"].endswith(archive_file_exts) and not metadata.get("archive_type") and not metadata.get("compacted_into")
+
+def _is_daily_archive(metadata):
+    """
+    Return True if the resource is a daily loggedpoint archive, including the daily archive compacted into the monthly archive
+    The metadata of the compacted daily archive is kept even if the archive file was removed, it keeps the statistics and the companion files of the day
+    """
+    return metadata["resource_file"].endswith(archive_file_exts) and not metadata.get("archive_type") and not metadata.get("compacted_from")
+
+def _is_monthly_archive(metadata):
+    """
+    Return True if the resource is a monthly loggedpoint archive compacted from the daily archives
+    """
+    return metadata["resource_file"].endswith(archive_file_exts) and not metadata.get("archive_type") and metadata["resource_id"].endswith(".monthly")
+
+def _archive_raw(reader,blob_resource,archive_group,archive_id,start_date,end_date,source_table,work_folder,check=False):
+    """
+    Archive the raw messages into a zstd compressed sidecar file and push it as a companion resource of the archive file
+    Return the resource id of the raw sidecar; return None if no raw message
+    """
+    sidecar_id = get_raw_sidecar_id(archive_id)
+    sidecar_file = "{}.sqlite".format(sidecar_id)
+    filename = os.path.join(work_folder,sidecar_file)
+    stats = rawstore.write_sidecar(reader.query_iter(raw_sql.format(source_table),(start_date,end_date)),filename)
+    if not stats["rows"]:
+        return None
+    metadata = {
+        "start_archive":timezone.now(),
+        "resource_id":sidecar_id,
+        "resource_file":sidecar_file,
+        "resource_group":archive_group,
+        "archive_type":ARCHIVE_RAW,
+        "start_archive_date":start_date,
+        "end_archive_date":end_date,
+        "file_md5":utils.file_md5(filename)
+    }
+    metadata.update(stats)
+    logger.debug("Begin to push raw sidecar file to blob storage, archive_group={},archive_id={},rows={},raw bytes={},compressed bytes={}".format(
+        archive_group,archive_id,stats["rows"],stats["raw_bytes"],stats["compressed_bytes"]
+    ))
+    _push_companion(blob_resource,filename,metadata,work_folder,check=check)
+    return sidecar_id
+
+def _push_companion(blob_resource,filename,metadata,work_folder,check=False):
+    """
+    Push the companion file of the archive file to blob storage, and check whether it was pushed successfully if check is True
+    """
+    blob_resource.push_file(filename,metadata=metadata,f_post_push=_set_end_datetime("end_archive"))
+    if check:
+        d_metadata,d_filename = blob_resource.download(metadata["resource_id"],resource_group=metadata["resource_group"],filename=os.path.join(work_folder,"download_{}".format(metadata["resource_file"])))
+        d_file_md5 = utils.file_md5(d_filename)
+        if metadata["file_md5"] != d_file_md5:
+            raise Exception("Upload {} file failed.source file's md5={}, uploaded file's md5={}".format(metadata["archive_type"],metadata["file_md5"],d_file_md5))
+
+def _delete_companions(blob_resource,archive_group,archive_id,existing_metadata=None):
+    """
+    Delete the companion resources pushed for the archive after failing to push the archive file
+    existing_metadata: the metadata of the existing archive which is overwritten, the companion resources referenced by it are kept
+    """
+    referenced = set(existing_metadata.get(key) for key in archive_companion_keys) if existing_metadata else set()
+    for companion_id in (f(archive_id) for f in companion_id_functions):
+        if companion_id in referenced:
+            continue
+        try:
+            if blob_resource.delete_resource(resourceid=companion_id,resource_group=archive_group):
+                logger.debug("Deleted the companion resource({}) of the failed archive({})".format(companion_id,archive_id))
+        except:
+            logger.error("Failed to delete the companion resource({}) of the failed archive({}).{}".format(companion_id,archive_id,traceback.format_exc()))
+
+def _archive_stats(blob_resource,archive_group,archive_id,start_date,end_date,stats,work_folder,check=False):
+    """
+    Save the statistics of the archived loggedpoints into a json file and push it as a companion resource of the archive file
+    Return the resource id of the statistics file
+    """
+    stats_id = get_stats_id(archive_id)
+    stats_file = "{}.json".format(stats_id)
+    filename = os.path.join(work_folder,stats_file)
+    catalog.write_stats(stats,filename)
+    metadata = {
+        "start_archive":timezone.now(),
+        "resource_id":stats_id,
+        "resource_file":stats_file,
+        "resource_group":archive_group,
+        "archive_type":ARCHIVE_STATS,
+        "start_archive_date":start_date,
+        "end_archive_date":end_date,
+        "file_md5":utils.file_md5(filename)
+    }
+    _push_companion(blob_resource,filename,metadata,work_folder,check=check)
+    return stats_id
+
+def _archive_grid(reader,blob_resource,archive_group,archive_id,start_date,end_date,source_table,work_folder,check=False):
+    """
+    Build the density grid of the archived loggedpoints and push it as a companion resource of the archive file
+    Return the resource id of the density grid
+    """
+    grid_id = get_density_grid_id(archive_id)
+    grid_file = "{}.npz".format(grid_id)
+    filename = os.path.join(work_folder,grid_file)
+    stats = grid.write_grid(reader,source_table,start_date,end_date,filename)
+    metadata = {
+        "start_archive":timezone.now(),
+        "resource_id":grid_id,
+        "resource_file":grid_file,
+        "resource_group":archive_group,
+        "archive_type":ARCHIVE_GRID,
+        "start_archive_date":start_date,
+        "end_archive_date":end_date,
+        "file_md5":utils.file_md5(filename)
+    }
+    metadata.update(stats)
+    logger.debug("Begin to push density grid file to blob storage, archive_group={},archive_id={},features={},cells={}".format(
+        archive_group,archive_id,stats["features"],stats["cells"]
+    ))
+    _push_companion(blob_resource,filename,metadata,work_folder,check=check)
+    return grid_id
+
+def _archive_tracks(reader,blob_resource,archive_group,archive_id,start_date,end_date,source_table,work_folder,stats,check=False):
+    """
+    Build the simplified daily trajectory of each device at each tolerance and push them as a companion resource of the archive file
+    stats: the statistics of the archived loggedpoints, used to get the number of the trajectories
+    Return the resource id of the trajectory overviews; return None if no trajectory
+    """
+    tolerances = tracks.get_tolerances()
+    #only the device with more than one loggedpoint has a trajectory
+    features = len([c for c in stats["devices"].values() if c > 1]) * len(tolerances)
+    if not features:
+        return None
+    overview_id = get_track_overview_id(archive_id)
+    overview_file = "{}.gpkg".format(overview_id)
+    sql = tracks.get_overview_sql(start_date.strftime(datetime_pattern),end_date.strftime(datetime_pattern),source_table)
+    layer_metadata,filename = reader.export_spatial_data(sql,filename=os.path.join(work_folder,overview_file),layer=ARCHIVE_TRACKS,features=features)
+    metadata = {
+        "start_archive":timezone.now(),
+        "resource_id":overview_id,
+        "resource_file":overview_file,
+        "resource_group":archive_group,
+        "archive_type":ARCHIVE_TRACKS,
+        "start_archive_date":start_date,
+        "end_archive_date":end_date,
+        "layer":layer_metadata["layer"],
+        "features":layer_metadata["features"],
+        "tolerances":tolerances,
+        "indexes":gdal.create_gpkg_indexes(filename,layer_metadata["layer"],tracks.overview_index_columns),
+        "file_md5":utils.file_md5(filename)
+    }
+    logger.debug("Begin to push trajectory overview file to blob storage, archive_group={},archive_id={},features={}".format(archive_group,archive_id,metadata["features"]))
+    _push_companion(blob_resource,filename,metadata,work_folder,check=check)
+    return overview_id
+
+def _push_vrt(blob_resource,archive_group,groupmetadata,work_folder,check=False):
+    """
+    Push the vrt file to union all the archive files in the group
+    Return the new resourcemetadata
+    """
+    vrt_id = "{}.vrt".format(archive_group)
+    try:
+        vrt_metadata = next(m for m in groupmetadata.values() if m["resource_id"] == vrt_id)
+    except StopIteration:
+        vrt_metadata = {"resource_id":vrt_id,"resource_file":vrt_id,"resource_group":archive_group}
+
+    vrt_metadata["features"] = 0
+    for m in groupmetadata.values():
+        if not _is_data_archive(m):
+            continue
+        vrt_metadata["features"] += m.get("features") or 0
+
+    layers =  [(m["resource_id"],m["resource_file"]) for m in groupmetadata.values() if _is_data_archive(m)]
+    layers.sort(key=lambda o:o[0])
+    layers = os.linesep.join(individual_layer.format(m[0],m[1]) for m in layers )
+    vrt_data = vrt.format(archive_group,layers)
+    vrt_filename = os.path.join(work_folder,"loggedpoint.vrt")
+    with open(vrt_filename,"w") as f:
+        f.write(vrt_data)
+
+    vrt_metadata["file_md5"] = utils.file_md5(vrt_filename)
+
+    resourcemetadata = blob_resource.push_file(vrt_filename,metadata=vrt_metadata,f_post_push=_set_end_datetime("updated"))
+    if check:
+        #check whether uploaded succeed or not
+        logger.debug("Begin to check whether the group vrt file was pused to blob storage successfully, archive_group={}".format(archive_group))
+        d_vrt_metadata,d_vrt_filename = blob_resource.download(vrt_id,resource_group=archive_group,filename=os.path.join(work_folder,"loggedpoint_download.vrt"))
+        d_vrt_file_md5 = utils.file_md5(d_vrt_filename)
+        if vrt_metadata["file_md5"] != d_vrt_file_md5:
+            raise Exception("Upload vrt file failed.source file's md5={}, uploaded file's md5={}".format(vrt_metadata["file_md5"],d_vrt_file_md5))
+    return resourcemetadata
+
+def archive(archive_group,archive_id,start_date,end_date,delete_after_archive=False,check=False,overwrite=False,archive_format=None):
     """
     Archive the resouce tracking history by start_date(inclusive), end_date(exclusive)
     archive_id: a unique identity of the archive file. that means different start_date and end_date should have a different archive_id
     overwrite: False: raise exception if archive_id already exists; True: overwrite the existing archive file
     delete_after_archive: delete the archived data from table tracking_loggedpoint
     check: check whether archiving is succeed or not
+    archive_format: the format of the archive file, gpkg or parquet(GeoParquet); use LOGGEDPOINT_ARCHIVE_FORMAT if None
     """
     db = settings.DATABASE
-    archive_filename = "{}.gpkg".format(archive_id)
+    archive_format = archive_format or settings.LOGGEDPOINT_ARCHIVE_FORMAT
+    if archive_format not in archive_formats:
+        raise Exception("Archive format({}) is not supported, supported formats are {}".format(archive_format,archive_formats))
+    archive_filename = "{}.{}".format(archive_id,archive_format)
     metadata = {
+        "format":archive_format,
         "start_archive":timezone.now(),
         "resource_id":archive_id,
         "resource_file":archive_filename,
@@ -172,184 +598,770 @@ def archive(archive_group,archive_id,start_date,end_date,delete_after_archive=Fa
     }
 
     filename = None
-    vrt_filename = None
     work_folder = tempfile.mkdtemp(prefix="archive_loggedpoint")
     def set_end_archive(metadata):
         metadata["end_archive"] = timezone.now()
     resourcemetadata = None
     try:
-        logger.debug("Begin to archive loggedpoint, archive_group={},archive_id={},start_date={},end_date={}".format(archive_group,archive_id,start_date,end_date))
-        blob_resource = get_blob_resource()
-        if not overwrite:
-            #check whether achive exist or not
-            resourcemetadata = blob_resource.resourcemetadata
-            if blob_resource.is_exist(archive_id,resource_group=archive_group):
-                raise ResourceAlreadyExist("The loggedpoint has already been archived. archive_id={0},start_archive_date={1},end_archive_date={2}".format(archive_id,start_date,end_date))
-
-        #export the archived data as geopackage
-        sql = archive_sql.format(start_date.strftime(datetime_pattern),end_date.strftime(datetime_pattern))
-        export_result = db.export_spatial_data(sql,filename=os.path.join(work_folder,"loggedpoint.gpkg"),layer=archive_id)
-        if not export_result:
-            logger.debug("No loggedpoints to archive, archive_group={},archive_id={},start_date={},end_date={}".format(archive_group,archive_id,start_date,end_date))
-            return
+        with db.connection():
+            logger.debug("Begin to archive loggedpoint, archive_group={},archive_id={},start_date={},end_date={}".format(archive_group,archive_id,start_date,end_date))
+            blob_resource = get_blob_resource()
+            existing_metadata = blob_resource.get_metadata(resourceid=archive_id,resource_group=archive_group)
+            if existing_metadata and existing_metadata.get("compacted_into"):
+                raise Exception("The loggedpoint was archived and compacted into the monthly archive({}). archive_id={}".format(existing_metadata["compacted_into"],archive_id))
+            if not overwrite:
+                #check whether achive exist or not
+                resourcemetadata = blob_resource.resourcemetadata
+                if blob_resource.is_exist(archive_id,resource_group=archive_group):
+                    raise ResourceAlreadyExist("The loggedpoint has already been archived. archive_id={0},start_archive_date={1},end_archive_date={2}".format(archive_id,start_date,end_date))
 
-        layer_metadata,filename = export_result
-        metadata["file_md5"] = utils.file_md5(filename)
-        metadata["layer"] = layer_metadata["layer"]
-        metadata["features"] = layer_metadata["features"]
-        #upload archive file
-        logger.debug("Begin to push loggedpoint archive file to blob storage, archive_group={},archive_id={},start_date={},end_date={}".format(archive_group,archive_id,start_date,end_date))
-        resourcemetadata = blob_resource.push_file(filename,metadata=metadata,f_post_push=_set_end_datetime("end_archive"))
-        if check:
-            #check whether uploaded succeed or not
-            logger.debug("Begin to check whether loggedpoint archive file was pushed to blob storage successfully, archive_group={},archive_id={},start_date={},end_date={}".format(
-                archive_group,archive_id,start_date,end_date
-            ))
-            d_metadata,d_filename = blob_resource.download(archive_id,resource_group=archive_group,filename=os.path.join(work_folder,"loggedpoint_download.gpkg"))
-            d_file_md5 = utils.file_md5(d_filename)
-            if metadata["file_md5"] != d_file_md5:
-                raise Exception("Upload loggedpoint archive file failed.source file's md5={}, uploaded file's md5={}".format(metadata["file_md5"],d_file_md5))
-
-            d_layer_metadata = gdal.get_layers(d_filename)[0]
-            if d_layer_metadata["features"] != layer_metadata["features"]:
-                raise Exception("Upload loggedpoint archive file failed.source file's features={}, uploaded file's features={}".format(layer_metadata["features"],d_layer_metadata["features"]))
-        
+            #export the archived data as geopackage, export from the partition directly if tracking_loggedpoint is partitioned by the archive range
+            partitions = db.get_range_partitions(loggedpoint_table)
+            partition = _get_partition(partitions,start_date,end_date)
+            #count and export from the replica if the replica has caught up with the primary
+            reader = db.reader(until=end_date)
+            features = reader.execute_prepared(count_statement,(start_date,end_date),fetch="one")[0]
+            #store the raw message in a separate sidecar file if possible
+            with_sidecar = rawstore.is_available()
+            source_table = partition["name"] if partition else loggedpoint_table
+            sql = archive_sql.format(start_date.strftime(datetime_pattern),end_date.strftime(datetime_pattern),source_table,"" if with_sidecar else ",a.raw",archive_order_by if archive_format == ARCHIVE_PARQUET else "")
+            export_result = reader.export_spatial_data(sql,filename=os.path.join(work_folder,archive_filename),layer=archive_id,features=features,layer_options=_get_layer_options(archive_format))
+            if not export_result:
+                logger.debug("No loggedpoints to archive, archive_group={},archive_id={},start_date={},end_date={}".format(archive_group,archive_id,start_date,end_date))
+                return
 
-        #update vrt file
-        logger.debug("Begin to update vrt file to union all spatial files in the same group, archive_group={},archive_id={},start_date={},end_date={}".format(
-            archive_group,archive_id,start_date,end_date
-        ))
-        groupmetadata = resourcemetadata[archive_group]
-        vrt_id = "{}.vrt".format(archive_group)
-        try:
-            vrt_metadata = next(m for m in groupmetadata.values() if m["resource_id"] == vrt_id)
-        except StopIteration as ex:
-            vrt_metadata = {"resource_id":vrt_id,"resource_file":vrt_id,"resource_group":archive_group}
+            layer_metadata,filename = export_result
+            if archive_format == ARCHIVE_PARQUET:
+                metadata["sorted_by"] = archive_sort_columns
+            else:
+                #index the archive file to support the range and device lookups
+                metadata["indexes"] = gdal.create_gpkg_indexes(filename,layer_metadata["layer"],archive_index_columns)
+            metadata["file_md5"] = utils.file_md5(filename)
+            metadata["layer"] = layer_metadata["layer"]
+            metadata["features"] = layer_metadata["features"]
+            #the statistics to answer the catalog queries without downloading the archive file
+            metadata["stats"] = catalog.get_archive_stats(reader,source_table,start_date,end_date)
+            try:
+                if metadata["stats"]:
+                    metadata["stats_file"] = _archive_stats(blob_resource,archive_group,archive_id,start_date,end_date,metadata["stats"],work_folder,check=check)
+                if with_sidecar:
+                    sidecar_id = _archive_raw(reader,blob_resource,archive_group,archive_id,start_date,end_date,source_table,work_folder,check=check)
+                    if sidecar_id:
+                        metadata["raw_sidecar"] = sidecar_id
+                if grid.is_available():
+                    metadata["density_grid"] = _archive_grid(reader,blob_resource,archive_group,archive_id,start_date,end_date,source_table,work_folder,check=check)
+                if tracks.is_available() and metadata["stats"]:
+                    overview_id = _archive_tracks(reader,blob_resource,archive_group,archive_id,start_date,end_date,source_table,work_folder,metadata["stats"],check=check)
+                    if overview_id:
+                        metadata["track_overview"] = overview_id
+                #upload archive file
+                logger.debug("Begin to push loggedpoint archive file to blob storage, archive_group={},archive_id={},start_date={},end_date={}".format(archive_group,archive_id,start_date,end_date))
+                resourcemetadata = blob_resource.push_file(filename,metadata=metadata,f_post_push=_set_end_datetime("end_archive"))
+                if check:
+                    #check whether uploaded succeed or not
+                    logger.debug("Begin to check whether loggedpoint archive file was pushed to blob storage successfully, archive_group={},archive_id={},start_date={},end_date={}".format(
+                        archive_group,archive_id,start_date,end_date
+                    ))
+                    d_metadata,d_filename = blob_resource.download(archive_id,resource_group=archive_group,filename=os.path.join(work_folder,"download_{}".format(archive_filename)))
+                    d_file_md5 = utils.file_md5(d_filename)
+                    if metadata["file_md5"] != d_file_md5:
+                        raise Exception("Upload loggedpoint archive file failed.source file's md5={}, uploaded file's md5={}".format(metadata["file_md5"],d_file_md5))
 
-        vrt_metadata["features"] = 0
-        for m in groupmetadata.values():
-            if m["resource_id"] == vrt_id:
-                continue
-            vrt_metadata["features"] += m["features"]
-
-        layers =  [(m["resource_id"],m["resource_file"]) for m in groupmetadata.values() if m["resource_id"] != vrt_id]
-        layers.sort(key=lambda o:o[0])
-        layers = os.linesep.join(individual_layer.format(m[0],m[1]) for m in layers )
-        vrt_data = vrt.format(archive_group,layers)
-        vrt_filename = os.path.join(work_folder,"loggedpoint.vrt")
-        with open(vrt_filename,"w") as f:
-            f.write(vrt_data)
-
-        vrt_metadata["file_md5"] = utils.file_md5(vrt_filename)
-
-        resourcemetadata = blob_resource.push_file(vrt_filename,metadata=vrt_metadata,f_post_push=_set_end_datetime("updated"))
-        if check:
-            #check whether uploaded succeed or not
-            logger.debug("Begin to check whether the group vrt file was pused to blob storage successfully, archive_group={},archive_id={},start_date={},end_date={}".format(
-                archive_group,archive_id,start_date,end_date
-            ))
-            d_vrt_metadata,d_vrt_filename = blob_resource.download(vrt_id,resource_group=archive_group,filename=os.path.join(work_folder,"loggedpoint_download.vrt"))
-            d_vrt_file_md5 = utils.file_md5(d_vrt_filename)
-            if vrt_metadata["file_md5"] != d_vrt_file_md5:
-                raise Exception("Upload vrt file failed.source file's md5={}, uploaded file's md5={}".format(vrt_metadata["file_md5"],d_vrt_file_md5))
+                    d_layer_metadata = gdal.get_layers(d_filename)[0]
+                    if d_layer_metadata["features"] != layer_metadata["features"]:
+                        raise Exception("Upload loggedpoint archive file failed.source file's features={}, uploaded file's features={}".format(layer_metadata["features"],d_layer_metadata["features"]))
+            except:
+                #the companion files pushed for this archive are not referenced by any archive metadata
+                _delete_companions(blob_resource,archive_group,archive_id,existing_metadata)
+                raise
+        
 
-        if delete_after_archive:
-            logger.debug("Begin to delete archived data, archive_group={},archive_id={},start_date={},end_date={}".format(
+            #update vrt file
+            logger.debug("Begin to update vrt file to union all spatial files in the same group, archive_group={},archive_id={},start_date={},end_date={}".format(
                 archive_group,archive_id,start_date,end_date
             ))
+            resourcemetadata = _push_vrt(blob_resource,archive_group,resourcemetadata[archive_group],work_folder,check=check)
 
-            delete_sql = del_sql.format(start_date.strftime(datetime_pattern),end_date.strftime(datetime_pattern))
-            deleted_rows = db.update(delete_sql)
-            logger.debug("Delete {} rows from table tracking_loggedpoint, archive_group={},archive_id={},start_date={},end_date={}".format(
-                deleted_rows,archive_group,archive_id,start_date,end_date
-            ))
+            if delete_after_archive:
+                logger.debug("Begin to delete archived data, archive_group={},archive_id={},start_date={},end_date={}".format(
+                    archive_group,archive_id,start_date,end_date
+                ))
 
-        logger.debug("End to archive loggedpoint, archive_group={},archive_id={},start_date={},end_date={}".format(archive_group,archive_id,start_date,end_date))
+                deleted_rows = _delete_loggedpoint(db,start_date,end_date,partitions=partitions)
+                logger.debug("Delete {} rows from table tracking_loggedpoint, archive_group={},archive_id={},start_date={},end_date={}".format(
+                    deleted_rows,archive_group,archive_id,start_date,end_date
+                ))
+
+            logger.debug("End to archive loggedpoint, archive_group={},archive_id={},start_date={},end_date={}".format(archive_group,archive_id,start_date,end_date))
 
 
     finally:
         utils.remove_folder(work_folder)
         pass
             
-def restore_by_month(year,month,restore_to_origin_table=False,preserve_id=True):
+def _rehydrate(blob_resource,metadatas,timeout=None):
+    """
+    Make sure the archive files are online before restoring; start the rehydration of all archived files together and wait until rehydrated or timeout
+    raise exception if some archive files are still being rehydrated
+    """
+    timeout = settings.LOGGEDPOINT_REHYDRATE_TIMEOUT if timeout is None else timeout
+    pending = blob_resource.rehydrate(metadatas,timeout=timeout)
+    if pending:
+        raise Exception("{}/{} archive files are being rehydrated from archive tier, please restore again later.".format(pending,len(metadatas)))
+
+def tier_archives(months=None,tier=None):
+    """
+    Move the loggedpoint archives older than months to the tier
+    the vrt files, the density grids, the trajectory overviews and the statistics files are kept in the current tier
+    """
+    months = settings.LOGGEDPOINT_TIER_MONTHS if months is None else months
+    tier = tier or settings.LOGGEDPOINT_TIER
+    today = timezone.now().date()
+    #the first month which should be kept in the current tier
+    month_index = today.year * 12 + today.month - 1 - months
+    earliest_group = get_archive_group(date(month_index // 12,month_index % 12 + 1,1))
+
+    blob_resource = get_blob_resource()
+    resourcemetadata = blob_resource.resourcemetadata or {}
+    changed = 0
+    for archive_group in sorted(resourcemetadata.keys()):
+        if archive_group >= earliest_group:
+            continue
+        logger.debug("Move the loggedpoint archives in group({}) to {} tier".format(archive_group,tier))
+        changed += len(blob_resource.set_tier(tier,resource_group=archive_group,f_filter=lambda m:not m["resource_id"].endswith(".vrt") and m.get("archive_type") not in (ARCHIVE_GRID,ARCHIVE_TRACKS,ARCHIVE_STATS) and not m.get("removed")))
+
+    logger.info("Moved {} loggedpoint archives older than {} months to {} tier".format(changed,months,tier))
+    return changed
+
+def restore_by_month(year,month,restore_to_origin_table=False,preserve_id=True,rehydrate_timeout=None,with_raw=False):
     """
     Restore the loggedpoint from archived files for the month
+    The daily archive files are loaded in parallel into UNLOGGED staging tables
     restore_to_origin_table: if true, restore the data to table tracking_loggedpoint; otherwise restore the data into a table with layer name
     preserve_id: meaningful if restore_to_origin_table is True.
+    rehydrate_timeout: the maximum seconds to wait for the rehydration of the archive files in archive tier
+    with_raw: restore the raw messages from the raw sidecar files
     """
     d = date(year,month,1)
     archive_group = get_archive_group(d)
     logger.debug("Begin to import archived loggedpoint, archive_group={}".format(archive_group))
     blob_resource = get_blob_resource()
+    f_filter = (lambda m:_is_data_archive(m) or m.get("archive_type") == ARCHIVE_RAW) if with_raw else _is_data_archive
+    _rehydrate(blob_resource,[m for m in blob_resource.get_metadata(resource_group=archive_group,throw_exception=True).values() if f_filter(m)],timeout=rehydrate_timeout)
     work_folder = tempfile.mkdtemp(prefix="restore_loggedpoint")
     try:
-        metadata,filename = blob_resource.download_group(archive_group,folder=work_folder,overwrite=True)
-        imported_table = _restore_data(os.path.join(work_folder,"{}.vrt".format(archive_group)),restore_to_origin_table=restore_to_origin_table,preserve_id=preserve_id)
-        logger.debug("End to import archived loggedpoint, archive_group={},imported_table".format(archive_group,imported_table))
+        groupmetadata,folder = blob_resource.download_group(archive_group,folder=work_folder,overwrite=True,f_filter=f_filter)
+        filenames = sorted(os.path.join(work_folder,m["resource_file"]) for m in groupmetadata.values() if _is_data_archive(m))
+        raw_filenames = sorted(os.path.join(work_folder,m["resource_file"]) for m in groupmetadata.values() if m.get("archive_type") == ARCHIVE_RAW) if with_raw else None
+        start_date = timezone.datetime(d.year,d.month,d.day)
+        end_date = timezone.datetime(d.year + 1,1,1) if d.month == 12 else timezone.datetime(d.year,d.month + 1,1)
+        imported_table = _restore_files(archive_group,filenames,start_date,end_date,restore_to_origin_table=restore_to_origin_table,preserve_id=preserve_id,raw_filenames=raw_filenames)
+        logger.debug("End to import archived loggedpoint, archive_group={},imported_table={}".format(archive_group,imported_table))
     finally:
         utils.remove_folder(work_folder)
         pass
 
 
-def restore_by_date(d,restore_to_origin_table=False,preserve_id=True):
+def restore_by_date(d,restore_to_origin_table=False,preserve_id=True,rehydrate_timeout=None,with_raw=False):
     """
     Restore the loggedpoint from archived files for the day
     restore_to_origin_table: if true, restore the data to table tracking_loggedpoint; otherwise restore the data into a table with layer name
     preserve_id: meaningful if restore_to_origin_table is True.
+    rehydrate_timeout: the maximum seconds to wait for the rehydration of the archive file in archive tier
+    with_raw: restore the raw messages from the raw sidecar file
     """
     archive_group = get_archive_group(d)
     archive_id= get_archive_id(d)
-    archive_filename = "{}.gpkg".format(archive_id)
     logger.debug("Begin to import archived loggedpoint, archive_group={},archive_id={}".format(archive_group,archive_id))
     blob_resource = get_blob_resource()
+    daily_metadata = blob_resource.get_metadata(resourceid=archive_id,resource_group=archive_group,throw_exception=True)
+    start_date = timezone.datetime(d.year,d.month,d.day)
+    end_date = start_date + timedelta(days=1)
+    seen_range = None
+    if daily_metadata.get("compacted_into"):
+        #restore the day from the monthly archive
+        metadata = blob_resource.get_metadata(resourceid=daily_metadata["compacted_into"],resource_group=archive_group,throw_exception=True)
+        seen_range = (int(start_date.timestamp()),int(end_date.timestamp()))
+    else:
+        metadata = daily_metadata
+    metadatas = [metadata]
+    if with_raw and daily_metadata.get("raw_sidecar"):
+        metadatas.append(blob_resource.get_metadata(resourceid=daily_metadata["raw_sidecar"],resource_group=archive_group,throw_exception=True))
+    _rehydrate(blob_resource,metadatas,timeout=rehydrate_timeout)
     work_folder = tempfile.mkdtemp(prefix="restore_loggedpoint")
     try:
-        metadata,filename = blob_resource.download(archive_id,resource_group=archive_group,filename=os.path.join(work_folder,archive_filename))
-        imported_table =_restore_data(filename,restore_to_origin_table=restore_to_origin_table,preserve_id=preserve_id)
+        filenames = []
+        for m in metadatas:
+            filenames.append(blob_resource.download(m["resource_id"],resource_group=archive_group,filename=os.path.join(work_folder,m["resource_file"]))[1])
+        imported_table = _restore_files(archive_id,filenames[:1],start_date,end_date,restore_to_origin_table=restore_to_origin_table,preserve_id=preserve_id,raw_filenames=filenames[1:] if with_raw else None,seen_range=seen_range)
         logger.debug("End to import archived loggedpoint, archive_group={},archive_id={},imported_table={}".format(archive_group,archive_id,imported_table))
     finally:
         utils.remove_folder(work_folder)
         pass
 
-def _restore_data(filename,restore_to_origin_table=False,preserve_id=True):
+def _restore_filter(seen_range=None,id_range=None):
+    """
+    Return the where clause of the restore sql
+    seen_range: (start,end) epoch seconds
+    id_range: (start,end) ids
+    """
+    conditions = []
+    if seen_range:
+        conditions.append("a.seen >= {} AND a.seen < {}".format(*seen_range))
+    if id_range:
+        conditions.append("a.id >= {} AND a.id < {}".format(*id_range))
+    return " WHERE {}".format(" AND ".join(conditions)) if conditions else ""
+
+def _insert_batches(db,sql,source,target,seen_range=None):
+    """
+    Insert the loggedpoint from the source table into the target table in id-range batches, each batch is committed separately to keep the transactions short
+    seen_range: only insert the loggedpoint within the range (start,end) epoch seconds
+    Return the number of inserted rows
+    """
+    min_id,max_id = db.get("SELECT min(id),max(id) FROM {}".format(source))
+    if min_id is None:
+        return 0
+    batch_size = settings.LOGGEDPOINT_RESTORE_BATCH_SIZE or (max_id - min_id + 1)
+    rows = 0
+    start_id = min_id
+    while start_id <= max_id:
+        end_id = start_id + batch_size
+        rows += db.update(sql.format(source,target,_restore_filter(seen_range=seen_range,id_range=(start_id,end_id))),autocommit=True)
+        start_id = end_id
+    return rows
+
+def _get_restore_ranges(partitions,start_date,end_date):
+    """
+    Split the restore range [start_date,end_date) into the partition ranges of table tracking_loggedpoint
+    The partition interval(day or month) is decided by the existing partitions
+    Return the list of (start,end,partition start,partition end,partition name,exist)
+    """
+    day_partitioned = (partitions[-1]["end"] - partitions[-1]["start"]) <= timedelta(hours=25)
+    ranges = []
+    start = start_date
+    while start < end_date:
+        if day_partitioned:
+            partition_start = timezone.datetime(start.year,start.month,start.day)
+            partition_end = partition_start + timedelta(days=1)
+            name = "{}_p{}".format(loggedpoint_table,start.strftime("%Y%m%d"))
+        else:
+            partition_start = timezone.datetime(start.year,start.month,1)
+            partition_end = timezone.datetime(start.year + 1,1,1) if start.month == 12 else timezone.datetime(start.year,start.month + 1,1)
+            name = "{}_p{}".format(loggedpoint_table,start.strftime("%Y%m"))
+        end = min(end_date,partition_end)
+        exist = any(p["start"] < partition_end and p["end"] > partition_start for p in partitions)
+        ranges.append((start,end,partition_start,partition_end,name,exist))
+        start = end
+    return ranges
+
+def _restore_partitions(db,source,sql,partitions,start_date,end_date):
+    """
+    Restore the loggedpoint into the partitioned table tracking_loggedpoint
+    The data of a missing partition is loaded into a new standalone table which is attached as a partition after loading;
+    the data of an existing partition is inserted into table tracking_loggedpoint in batches
+    Return the number of restored rows
+    """
+    rows = 0
+    for start,end,partition_start,partition_end,name,exist in _get_restore_ranges(partitions,start_date,end_date):
+        seen_range = (int(start.timestamp()),int(end.timestamp()))
+        if exist or db.get("SELECT to_regclass(%s)",params=(name,))[0]:
+            rows += _insert_batches(db,sql,source,loggedpoint_table,seen_range=seen_range)
+            continue
+        db.create_partition_table(loggedpoint_table,name,"seen",partition_start,partition_end)
+        try:
+            rows += db.update(sql.format(source,"\"{}\"".format(name),_restore_filter(seen_range=seen_range)),autocommit=True)
+            db.attach_partition(loggedpoint_table,name,partition_start,partition_end)
+        except:
+            db.executeDDL("DROP TABLE IF EXISTS \"{}\"".format(name))
+            raise
+        logger.debug("Restored the logged points into the new partition({}) of table {}, range=[{},{})".format(name,loggedpoint_table,partition_start,partition_end))
+    return rows
+
+def _load_staging_tables(db,filenames):
+    """
+    Load the archive files in parallel into UNLOGGED staging tables without spatial index
+    Return the list of the staging tables
+    """
+    tables = ["restore_{}".format(db.non_char.sub("_",os.path.splitext(os.path.basename(f))[0])) for f in filenames]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=settings.LOGGEDPOINT_RESTORE_WORKERS) as executor:
+        futures = [executor.submit(db.import_spatial_data,f,table=t,unlogged=True,spatial_index=False) for f,t in zip(filenames,tables)]
+        concurrent.futures.wait(futures)
+    failed = next((f for f in futures if f.exception()),None)
+    if failed:
+        _drop_tables(db,[t for f,t in zip(futures,tables) if not f.exception()])
+        raise failed.exception()
+    logger.debug("Loaded {} archive files into staging tables".format(len(tables)))
+    return tables
+
+def _drop_tables(db,tables,view=None):
+    if view:
+        tables = [view] + tables
+    for table in tables:
+        try:
+            logger.debug("Try to drop the imported table({0})".format(table))
+            db.executeDDL("DROP {} IF EXISTS \"{}\"".format("VIEW" if table == view else "TABLE",table))
+            logger.debug("Dropped the imported table({0})".format(table))
+        except:
+            logger.error("Failed to drop the temporary imported table({0}). {1}".format(table,traceback.format_exc()))
+
+def _load_raw_table(db,name,raw_filenames):
+    """
+    Load the raw messages from the raw sidecar files into an UNLOGGED staging table
+    Return the staging table
+    """
+    table = "restore_raw_{}".format(db.non_char.sub("_",name))
+    db.executeDDL("DROP TABLE IF EXISTS \"{0}\"; CREATE UNLOGGED TABLE \"{0}\" (id bigint,raw text)".format(table))
+    try:
+        for filename in raw_filenames:
+            db.copy_in(table,("id","raw"),rawstore.read_sidecar(filename))
+        db.executeDDL("ALTER TABLE \"{0}\" ADD PRIMARY KEY (id); ANALYZE \"{0}\"".format(table))
+    except:
+        _drop_tables(db,[table])
+        raise
+    return table
+
+def _get_source_sql(db,table,raw_table=None):
+    """
+    Return the sql to select the loggedpoint with the raw message from the staging table
+    The raw message is read from the staging table if the archive file includes the raw message(archived before the raw sidecar was introduced),
+    otherwise read from the raw staging table if have; otherwise the raw message is null.
+    """
+    columns = [c[0] for c in db.query("SELECT column_name FROM information_schema.columns WHERE table_name = %s ORDER BY ordinal_position",params=(table,))]
+    #the raw message is the last column to keep the columns in the same order for union
+    select_columns = ",".join("a.\"{}\"".format(c) for c in columns if c != "raw")
+    if "raw" in columns:
+        return "SELECT {},a.raw FROM \"{}\" a".format(select_columns,table)
+    elif raw_table:
+        return "SELECT {},r.raw FROM \"{}\" a LEFT JOIN \"{}\" r ON a.id = r.id".format(select_columns,table,raw_table)
+    else:
+        return "SELECT {},NULL::text AS raw FROM \"{}\" a".format(select_columns,table)
+
+def _restore_files(name,filenames,start_date,end_date,restore_to_origin_table=False,preserve_id=True,raw_filenames=None,seen_range=None):
     """
     Restore the loggedpoint from the archived files
+    name: the name of the restored data; used as the table name if not restore_to_origin_table
+    start_date: the start date(inclusive) of the archived data
+    end_date: the end date(exclusive) of the archived data
     restore_to_origin_table: if true, restore the data to table tracking_loggedpoint; otherwise restore the data into a table with layer name
     preserve_id: meaningful if restore_to_origin_table is True.
+    raw_filenames: the raw sidecar files; the raw messages are restored if not None
+    seen_range: only restore the loggedpoint within the range (start,end) epoch seconds if not None, used to restore a day from the monthly archive
     """
     db = settings.DATABASE
-    imported_table = db.import_spatial_data(filename)
+    if not restore_to_origin_table and len(filenames) == 1 and raw_filenames is None and seen_range is None:
+        return db.import_spatial_data(filenames[0])
+
+    tables = _load_staging_tables(db,filenames)
+    view = None
+    try:
+        if raw_filenames:
+            tables.append(_load_raw_table(db,name,raw_filenames))
+            raw_table = tables[-1]
+            data_tables = tables[:-1]
+        else:
+            raw_table = None
+            data_tables = tables
+        #union the staging tables and normalize the raw message column
+        view = source = "restore_{}".format(db.non_char.sub("_",name))
+        view_sql = " UNION ALL ".join(_get_source_sql(db,t,raw_table) for t in data_tables)
+        if seen_range:
+            view_sql = "SELECT * FROM ({}) a{}".format(view_sql,_restore_filter(seen_range=seen_range))
+        db.executeDDL("CREATE OR REPLACE VIEW \"{}\" AS {}".format(view,view_sql))
 
-    if restore_to_origin_table:
+        if restore_to_origin_table:
+            #build the indexes used by the batched moving after all data are loaded
+            for table in data_tables:
+                db.executeDDL("CREATE INDEX ON \"{0}\" (id); ANALYZE \"{0}\"".format(table))
+            _restore_data(db,source,start_date,end_date,preserve_id=preserve_id)
+            return loggedpoint_table
+        else:
+            table = db.non_char.sub("_",db.head_or_tail_non_char.sub("",name))
+            geometry_column = db.get_geometry_column(tables[0])
+            db.executeDDL("DROP TABLE IF EXISTS \"{0}\"; CREATE TABLE \"{0}\" AS SELECT * FROM \"{1}\"".format(table,source))
+            if geometry_column:
+                db.executeDDL("CREATE INDEX ON \"{}\" USING GIST (\"{}\")".format(table,geometry_column))
+            db.executeDDL("ANALYZE \"{}\"".format(table))
+            logger.debug("Restored the logged points from {} archive files into table({})".format(len(filenames),table))
+            return table
+    finally:
+        _drop_tables(db,tables,view=view)
+
+def _restore_data(db,source,start_date,end_date,preserve_id=True):
+    """
+    Restore the loggedpoint from the imported table to table tracking_loggedpoint
+    start_date: the start date(inclusive) of the archived data
+    end_date: the end date(exclusive) of the archived data
+    preserve_id: restore the loggedpoint with the original id
+    """
+    #share one pooled connection during restoring
+    with db.connection():
         #insert the missing device
-        logger.debug("Create the missing devices from imported table({0})".format(imported_table))
-        sql = missing_device_sql.format(imported_table)
+        logger.debug("Create the missing devices from imported table({0})".format(source))
+        sql = missing_device_sql.format(source)
         rows = db.update(sql,autocommit=True)
         if rows :
-            logger.debug("Created {2} missing devices from imported table({0})".format(imported_table,rows))
+            logger.debug("Created {1} missing devices from imported table({0})".format(source,rows))
         else:
-            logger.debug("All devices referenced from imported table({0}) exist".format(imported_table,rows))
+            logger.debug("All devices referenced from imported table({0}) exist".format(source))
 
-        logger.debug("Restore the logged points from table({0}) to table(tracking_loggedpoint)".format(imported_table))
+        logger.debug("Restore the logged points from table({0}) to table(tracking_loggedpoint)".format(source))
         if preserve_id:
             sql = restore_with_id_sql
         else:
             sql = restore_sql
 
-        sql = sql.format(imported_table)
-        rows = db.update(sql,autocommit=True)
-        logger.debug("{1} records are restored from from table({0}) to table(tracking_loggedpoint)".format(imported_table,rows))
-        try:
-            logger.debug("Try to drop the imported table({0})".format(imported_table))
-            rows = db.executeDDL("DROP TABLE \"{}\"".format(imported_table))
-            logger.debug("Dropped the imported table({0})".format(imported_table))
-        except:
-            logger.error("Failed to drop the temporary imported table to table({0}). {1}".format(imported_table,traceback.format_exc()))
-            pass
-        return "tracking_loggedpoint"
+        partitions = db.get_range_partitions(loggedpoint_table)
+        if partitions:
+            rows = _restore_partitions(db,source,sql,partitions,start_date,end_date)
+        else:
+            rows = _insert_batches(db,sql,source,loggedpoint_table)
+        db.executeDDL("ANALYZE {}".format(loggedpoint_table))
+        logger.debug("{1} records are restored from from table({0}) to table(tracking_loggedpoint)".format(source,rows))
+
+def compact_month(year,month,remove_dailies=False,check=False,overwrite=False):
+    """
+    Compact the daily archives of the closed month into one geopackage file, which is clustered by the loggedpoint id and indexed by deviceid and seen
+    The feature count of the monthly archive is verified against the daily archive metadata and files;
+    the monthly archive and the compacted daily archives are swapped in one metadata update, so the readers see either the daily archives or the monthly archive.
+    The metadata of the compacted daily archives is kept to keep the statistics and the companion files of each day
+    remove_dailies: remove the compacted daily archive files
+    check: check whether the monthly archive was pushed successfully before swapping the metadata
+    overwrite: compact the month again if the month was already compacted, the compacted daily archive files should not be removed
+    Return the metadata of the monthly archive
+    """
+    today = timezone.now().date()
+    d = date(year,month,1)
+    next_month = date(year + 1,1,1) if month == 12 else date(year,month + 1,1)
+    if next_month > today:
+        raise Exception("Can only compact the archives of a closed month, the month({}/{}) is not closed".format(year,month))
+    archive_group = get_archive_group(d)
+    monthly_id = get_monthly_archive_id(d)
+    blob_resource = get_blob_resource()
+    groupmetadata = blob_resource.get_metadata(resource_group=archive_group,throw_exception=True)
+    if monthly_id in groupmetadata and not overwrite:
+        raise ResourceAlreadyExist("The loggedpoint archives of the month({}/{}) were already compacted. archive_id={}".format(year,month,monthly_id))
+    dailies = sorted((m for m in groupmetadata.values() if _is_daily_archive(m)),key=lambda m:m["resource_id"])
+    removed = [m["resource_id"] for m in dailies if m.get("removed")]
+    if removed:
+        raise Exception("The compacted daily archives({}) were removed, can't compact the month({}/{}) again".format(",".join(removed),year,month))
+    if not dailies:
+        raise Exception("No daily archives to compact in the month({}/{})".format(year,month))
+    _rehydrate(blob_resource,dailies)
 
+    logger.info("Begin to compact {} daily loggedpoint archives of the month({}/{})".format(len(dailies),year,month))
+    work_folder = tempfile.mkdtemp(prefix="compact_loggedpoint")
+    try:
+        sources = []
+        template = None
+        features = 0
+        for m in dailies:
+            filename = blob_resource.download(m["resource_id"],resource_group=archive_group,filename=os.path.join(work_folder,m["resource_file"]))[1]
+            layer_metadata = gdal.get_layers(filename)[0]
+            if m.get("features") is not None and layer_metadata["features"] != m["features"]:
+                raise Exception("The daily archive({}) has {} features, but the metadata has {} features".format(m["resource_id"],layer_metadata["features"],m["features"]))
+            if not filename.endswith(".gpkg"):
+                #convert the daily archive to geopackage to merge it with sqlite
+                gpkg_filename = "{}.gpkg".format(os.path.splitext(filename)[0])
+                gdal.convert(filename,gpkg_filename,layer=layer_metadata["layer"],layer_options=["SPATIAL_INDEX=NO"])
+                filename = gpkg_filename
+            sources.append((filename,layer_metadata["layer"]))
+            features += layer_metadata["features"]
+            #use the daily archive with the most columns as the template of the monthly archive
+            if template is None or len(layer_metadata["fields"]) > template[2]:
+                template = (filename,layer_metadata["layer"],len(layer_metadata["fields"]))
+
+        monthly_file = "{}.gpkg".format(monthly_id)
+        filename = os.path.join(work_folder,monthly_file)
+        gdal.convert(template[0],filename,layer=template[1],target_layer=monthly_id,where="1 = 0",layer_options=["SPATIAL_INDEX=NO"])
+        merged_features = gdal.merge_gpkg_layers(sources,filename,monthly_id)
+        if merged_features != features:
+            raise Exception("Failed, only {}/{} features were merged into the monthly archive({})".format(merged_features,features,monthly_id))
+        #create the spatial index first to let 'analyze' collect the statistics of all indexes
+        gdal.create_gpkg_spatial_index(filename,monthly_id)
+        indexes = gdal.create_gpkg_indexes(filename,monthly_id,archive_index_columns)
+
+        daily_stats = [m.get("stats") for m in dailies]
+        metadata = {
+            "format":ARCHIVE_GPKG,
+            "start_archive":timezone.now(),
+            "resource_id":monthly_id,
+            "resource_file":monthly_file,
+            "resource_group":archive_group,
+            "start_archive_date":timezone.datetime(d.year,d.month,d.day),
+            "end_archive_date":timezone.datetime(next_month.year,next_month.month,next_month.day),
+            "indexes":indexes,
+            "file_md5":utils.file_md5(filename),
+            "layer":monthly_id,
+            "features":merged_features,
+            "stats":catalog.merge_stats(daily_stats) if all(daily_stats) else None,
+            "compacted_from":[m["resource_id"] for m in dailies]
+        }
+
+        def _post_push(metadata):
+            metadata["end_archive"] = timezone.now()
+            if check:
+                #check the pushed file before the metadata is swapped
+                d_filename = os.path.join(work_folder,"download_{}".format(monthly_file))
+                with open(d_filename,"wb") as f:
+                    blob_resource.get_blob_client(metadata["resource_path"]).download_blob().readinto(f)
+                d_file_md5 = utils.file_md5(d_filename)
+                if metadata["file_md5"] != d_file_md5:
+                    #the metadata is not saved if the check failed, delete the pushed file to avoid a orphaned blob
+                    try:
+                        blob_resource.get_blob_client(metadata["resource_path"]).delete_blob()
+                    except:
+                        logger.error("Failed to delete the pushed monthly archive file({}).{}".format(metadata["resource_path"],traceback.format_exc()))
+                    raise Exception("Upload monthly archive file failed.source file's md5={}, uploaded file's md5={}".format(metadata["file_md5"],d_file_md5))
+
+        def _swap_dailies(resourcemetadata):
+            superseded = []
+            group = resourcemetadata[archive_group]
+            for m in dailies:
+                daily_metadata = group.get(m["resource_id"])
+                if not daily_metadata:
+                    continue
+                daily_metadata["compacted_into"] = monthly_id
+                if remove_dailies:
+                    superseded.append(dict(daily_metadata))
+                    daily_metadata["removed"] = True
+                    daily_metadata.pop("resource_path",None)
+            return superseded
+
+        logger.debug("Begin to push monthly loggedpoint archive file to blob storage, archive_group={},archive_id={},features={}".format(archive_group,monthly_id,merged_features))
+        resourcemetadata = blob_resource.push_file(filename,metadata=metadata,f_post_push=_post_push,f_update_metadata=_swap_dailies)
+        if remove_dailies:
+            blob_resource.wait_for_cleanup()
+        _push_vrt(blob_resource,archive_group,resourcemetadata[archive_group],work_folder,check=check)
+        logger.info("Compacted {} daily loggedpoint archives of the month({}/{}) into {}, features={}".format(len(dailies),year,month,monthly_id,merged_features))
+        return metadata
+    finally:
+        utils.remove_folder(work_folder)
+
+def _get_archive_metadata(blob_name,resource_group,resource_file):
+    """
+    Populate the archive metadata for the archive file pushed before the archive metadata was saved in blob's custom metadata
+    """
+    if resource_file.endswith(".vrt"):
+        return {"resource_id":resource_file}
     else:
-        return imported_table
+        return {"resource_id":os.path.splitext(resource_file)[0],"layer":os.path.splitext(resource_file)[0]}
+
+def _restore_compactions(resourcemetadata):
+    """
+    Restore the relationship between the monthly archive and the compacted daily archives when rebuilding the metadata,
+    'compacted_into' is not kept in the blob's custom metadata of the daily archives, and 'compacted_from' of the monthly archive can be dropped if its metadata is too big.
+    The metadata of the removed daily archives is recreated from their companion files to keep the statistics and the companion files of each day
+    """
+    for archive_group,groupmetadata in resourcemetadata.items():
+        monthly = next((m for m in groupmetadata.values() if _is_monthly_archive(m)),None)
+        if not monthly:
+            continue
+        compacted_from = monthly.get("compacted_from")
+        for m in list(groupmetadata.values()):
+            key = companion_keys_by_type.get(m.get("archive_type"))
+            if not key:
+                continue
+            archive_id = os.path.splitext(m["resource_id"])[0]
+            if compacted_from is not None and archive_id not in compacted_from:
+                continue
+            daily_metadata = groupmetadata.get(archive_id)
+            if not daily_metadata:
+                #the daily archive file was removed after compacting
+                daily_metadata = {
+                    "resource_id":archive_id,
+                    "resource_file":"{}.{}".format(archive_id,ARCHIVE_GPKG),
+                    "resource_group":archive_group,
+                    "start_archive_date":m.get("start_archive_date"),
+                    "end_archive_date":m.get("end_archive_date"),
+                    "removed":True
+                }
+                groupmetadata[archive_id] = daily_metadata
+            if daily_metadata.get("removed"):
+                daily_metadata[key] = m["resource_id"]
+        if compacted_from is None:
+            compacted_from = sorted(m["resource_id"] for m in groupmetadata.values() if m is not monthly and _is_daily_archive(m))
+            monthly["compacted_from"] = compacted_from
+        for archive_id in compacted_from:
+            if archive_id in groupmetadata:
+                groupmetadata[archive_id]["compacted_into"] = monthly["resource_id"]
+        logger.debug("Restored the {} daily archives compacted into the monthly archive({})".format(len(compacted_from),monthly["resource_id"]))
+
+def _restore_archive_stats(resourcemetadata):
+    """
+    Restore the statistics dropped from the blob's custom metadata of the archives from their statistics files
+    """
+    blob_resource = get_blob_resource()
+    restored = 0
+    for archive_group,groupmetadata in resourcemetadata.items():
+        for m in groupmetadata.values():
+            if not _is_daily_archive(m) or m.get("stats") or not m.get("stats_file"):
+                continue
+            stats_metadata = groupmetadata.get(m["stats_file"])
+            if not stats_metadata:
+                logger.warning("The statistics file({}) of the archive({}) is missing".format(m["stats_file"],m["resource_id"]))
+                continue
+            m["stats"] = catalog.read_stats(blob_resource.get_blob_client(stats_metadata["resource_path"]).download_blob().readall())
+            if m.get("features") is None:
+                m["features"] = m["stats"]["features"]
+            restored += 1
+        #the statistics of the monthly archive are merged from the statistics of the compacted daily archives
+        for m in groupmetadata.values():
+            if _is_monthly_archive(m) and not m.get("stats") and m.get("compacted_from"):
+                daily_stats = [(groupmetadata.get(archive_id) or {}).get("stats") for archive_id in m["compacted_from"]]
+                m["stats"] = catalog.merge_stats(daily_stats) if all(daily_stats) else None
+    if restored:
+        logger.debug("Restored the statistics of {} archives from the statistics files".format(restored))
+
+def _complete_archive_metadata(resourcemetadata):
+    """
+    Complete the rebuilt archive metadata with the properties which are not kept in the blob's custom metadata
+    """
+    _restore_compactions(resourcemetadata)
+    _restore_archive_stats(resourcemetadata)
+
+def rebuild_metadata(dry_run=False):
+    """
+    Rebuild the loggedpoint archive metadata from the blob storage without downloading the archive files
+    The statistics which are too big to keep in the blob's custom metadata are restored from the statistics files,
+    and the daily archives compacted into the monthly archive are marked again
+    Return the rebuilt metadata
+    """
+    blob_resource = get_blob_resource()
+    resourcemetadata = blob_resource.rebuild_metadata(f_resource_metadata=_get_archive_metadata,f_post_rebuild=_complete_archive_metadata,dry_run=dry_run)
+    for archive_group,groupmetadata in resourcemetadata.items():
+        missing = [m["resource_id"] for m in groupmetadata.values() if _is_data_archive(m) and m.get("features") is None]
+        if missing:
+            logger.warning("The feature count of the archives({}) in group({}) is unknown".format(",".join(sorted(missing)),archive_group))
+    return resourcemetadata
+
+def query_catalog(start_date=None,end_date=None,deviceid=None,source_device_type=None):
+    """
+    Query the loggedpoint archives from the archive metadata without downloading the archive files
+    start_date: the first archive date(inclusive); no limit if None
+    end_date: the last archive date(exclusive); no limit if None
+    deviceid: only return the archives containing the device if not None
+    source_device_type: only return the archives containing the source device type if not None
+    Return the list of the archive summary ordered by archive date
+    """
+    blob_resource = get_blob_resource()
+    resourcemetadata = blob_resource.resourcemetadata or {}
+    if start_date:
+        start_date = timezone.datetime(start_date.year,start_date.month,start_date.day)
+    if end_date:
+        end_date = timezone.datetime(end_date.year,end_date.month,end_date.day)
+    metadatas = []
+    for archive_group in sorted(resourcemetadata.keys()):
+        if start_date and archive_group < get_archive_group(start_date):
+            continue
+        if end_date and archive_group > get_archive_group(end_date):
+            continue
+        for m in resourcemetadata[archive_group].values():
+            if not _is_daily_archive(m):
+                continue
+            if not m.get("start_archive_date") or not m.get("end_archive_date"):
+                logger.warning("The archive date range of the archive({}) is unknown, ignored".format(m["resource_id"]))
+                continue
+            metadatas.append(m)
+    return catalog.query(metadatas,start_date=start_date,end_date=end_date,deviceid=deviceid,source_device_type=source_device_type)
+
+def merge_density_grids(start_date,end_date,filename):
+    """
+    Merge the density grids of the archives between start_date(inclusive) and end_date(exclusive) into one grid file, the archive files are not downloaded.
+    filename: the merged grid file, a compressed npz file or an ESRI ASCII grid file(.asc); the extension '.npz' is appended if it is not a '.asc' or '.npz' file
+    Return the merged grid summary: the number of merged grids, the archives without density grid, the number of loggedpoints and the grid file
+    """
+    blob_resource = get_blob_resource()
+    resourcemetadata = blob_resource.resourcemetadata or {}
+    start_date = timezone.datetime(start_date.year,start_date.month,start_date.day)
+    end_date = timezone.datetime(end_date.year,end_date.month,end_date.day)
+    grid_metadatas = []
+    missing = []
+    for archive_group in sorted(resourcemetadata.keys()):
+        if archive_group < get_archive_group(start_date) or archive_group > get_archive_group(end_date):
+            continue
+        groupmetadata = resourcemetadata[archive_group]
+        for m in groupmetadata.values():
+            if not _is_daily_archive(m) or not m.get("start_archive_date"):
+                continue
+            if m["start_archive_date"] < start_date or m["start_archive_date"] >= end_date:
+                continue
+            if m.get("density_grid") and m["density_grid"] in groupmetadata:
+                grid_metadatas.append(groupmetadata[m["density_grid"]])
+            else:
+                missing.append(m["resource_id"])
+    if missing:
+        logger.warning("The archives({}) have no density grid".format(",".join(sorted(missing))))
+    if not grid_metadatas:
+        raise Exception("No density grids between {} and {}".format(start_date,end_date))
+
+    work_folder = tempfile.mkdtemp(prefix="merge_grid")
+    try:
+        filenames = []
+        for m in grid_metadatas:
+            d_metadata,d_filename = blob_resource.download(m["resource_id"],resource_group=m["resource_group"],filename=os.path.join(work_folder,m["resource_file"]))
+            filenames.append(d_filename)
+        counts,extent,resolution = grid.merge_grids(filenames)
+        filename = grid.save_grid(counts,extent,resolution,filename)
+        logger.info("Merged {} density grids between {} and {} into {}".format(len(filenames),start_date,end_date,filename))
+        return {"grids":len(filenames),"missing":sorted(missing),"features":int(counts.sum()),"file":filename}
+    finally:
+        utils.remove_folder(work_folder)
+
+def _get_track_cache_folder():
+    folder = settings.LOGGEDPOINT_TRACK_CACHE_FOLDER or os.path.join(tempfile.gettempdir(),"loggedpoint_tracks")
+    if not os.path.exists(folder):
+        os.makedirs(folder,exist_ok=True)
+    return folder
+
+def query_tracks(deviceid,start_date,end_date,level=0):
+    """
+    Return the simplified daily tracks of the device between start_date(inclusive) and end_date(exclusive) from the trajectory overviews
+    The overview files are downloaded into the local cache folder and are reused until the overview is changed
+    level: the overview level, 0 is the most detailed level
+    Return the list of the tracks ordered by seen
+    """
+    blob_resource = get_blob_resource()
+    resourcemetadata = blob_resource.resourcemetadata or {}
+    start_date = timezone.datetime(start_date.year,start_date.month,start_date.day)
+    end_date = timezone.datetime(end_date.year,end_date.month,end_date.day)
+    cache_folder = _get_track_cache_folder()
+    result = []
+    missing = []
+    for archive_group in sorted(resourcemetadata.keys()):
+        if archive_group < get_archive_group(start_date) or archive_group > get_archive_group(end_date):
+            continue
+        groupmetadata = resourcemetadata[archive_group]
+        for m in groupmetadata.values():
+            if not _is_daily_archive(m) or not m.get("start_archive_date"):
+                continue
+            if m["start_archive_date"] < start_date or m["start_archive_date"] >= end_date:
+                continue
+            if m.get("stats") and deviceid not in m["stats"]["devices"]:
+                #the device has no loggedpoint in the archive
+                continue
+            overview_metadata = groupmetadata.get(m.get("track_overview"))
+            if not overview_metadata:
+                if not m.get("stats") or m["stats"]["devices"][deviceid] > 1:
+                    missing.append(m["resource_id"])
+                continue
+            if level >= len(overview_metadata["tolerances"]):
+                raise Exception("The overview level({}) is not available, the overview({}) only has {} levels".format(level,overview_metadata["resource_id"],len(overview_metadata["tolerances"])))
+            filename = os.path.join(cache_folder,overview_metadata["resource_file"])
+            if not os.path.exists(filename) or utils.file_md5(filename) != overview_metadata["file_md5"]:
+                blob_resource.download(overview_metadata["resource_id"],resource_group=archive_group,filename=filename,overwrite=True)
+            result.extend(tracks.read_tracks(filename,overview_metadata["layer"],deviceid,level))
+    if missing:
+        logger.warning("The archives({}) have no trajectory overview".format(",".join(sorted(missing))))
+    result.sort(key=lambda t:t["start_seen"])
+    return result
+
+def relocate(resource_base_path=None,container_name=None,connection_string=None,standard_blob_tier=None,delete_source=True):
+    """
+    Copy or move the loggedpoint archives to the new location with azure server side copy
+    The settings should be changed to the new location after relocating
+    """
+    blob_resource = get_blob_resource()
+    return blob_resource.copy_resource(resource_base_path=resource_base_path,container_name=container_name,connection_string=connection_string,standard_blob_tier=standard_blob_tier,delete_source=delete_source)
 
 def user_confirm(message,possible_answers,case_sensitive=False):
     """
@@ -413,30 +1425,18 @@ def delete_archive_by_date(d):
     work_folder = None
     blob_resource = get_blob_resource()
     try:
+        metadata = blob_resource.get_metadata(resourceid=archive_id,resource_group=archive_group)
+        if metadata and metadata.get("compacted_into"):
+            raise Exception("The archive({}) was compacted into the monthly archive({}), please delete the archives of the month instead".format(archive_id,metadata["compacted_into"]))
         del_metadata = blob_resource.delete_resource(resourceid=archive_id,resource_group=archive_group)
+        for companion in archive_companion_keys:
+            if del_metadata and del_metadata.get(companion):
+                blob_resource.delete_resource(resourceid=del_metadata[companion],resource_group=archive_group)
 
         groupmetadata = blob_resource.get_metadata(resource_group=archive_group,throw_exception=True)
-
-        vrt_metadata = next(m for m in groupmetadata.values() if m["resource_id"] == vrt_id)
-
-        vrt_metadata["features"] = 0
-        for m in groupmetadata.values():
-            if m["resource_id"] == vrt_id:
-                continue
-            vrt_metadata["features"] += m["features"]
-
-        layers =  [(m["resource_id"],m["resource_file"]) for m in groupmetadata.values() if m["resource_id"] != vrt_id]
-        if layers:
+        if any(_is_data_archive(m) for m in groupmetadata.values()):
             work_folder = tempfile.mkdtemp(prefix="delete_archive")
-            layers.sort(key=lambda o:o[0])
-            layers = os.linesep.join(individual_layer.format(m[0],m[1]) for m in layers )
-            vrt_data = vrt.format(archive_group,layers)
-            vrt_filename = os.path.join(work_folder,"loggedpoint.vrt")
-            with open(vrt_filename,"w") as f:
-                f.write(vrt_data)
-
-            vrt_metadata["file_md5"] = utils.file_md5(vrt_filename)
-            resourcemetadata = blob_resource.push_file(vrt_filename,metadata=vrt_metadata,f_post_push=_set_end_datetime("updated"))
+            _push_vrt(blob_resource,archive_group,groupmetadata,work_folder)
         else:
             #all archives in the group were deleted
             blob_resource.delete_resource(resourceid=vrt_id,resource_group=archive_group)
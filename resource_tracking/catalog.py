@@ -0,0 +1,150 @@
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+#the statistics of the archived loggedpoints, grouped by device and by source device type in one scan
+#    the seen is the epoch seconds
+stats_sql = """SELECT GROUPING(b.deviceid),b.deviceid,a.source_device_type,count(1),
+    extract(epoch from min(a.seen))::bigint,extract(epoch from max(a.seen))::bigint,
+    ST_XMin(ST_Extent(a.point)),ST_YMin(ST_Extent(a.point)),ST_XMax(ST_Extent(a.point)),ST_YMax(ST_Extent(a.point)),
+    min(a.velocity),max(a.velocity),min(a.altitude),max(a.altitude)
+FROM {0} a JOIN tracking_device b ON a.device_id = b.id
+WHERE a.seen >= %s AND a.seen < %s
+GROUP BY GROUPING SETS ((b.deviceid),(a.source_device_type))"""
+
+def _min(v1,v2):
+    if v1 is None:
+        return v2
+    elif v2 is None:
+        return v1
+    else:
+        return min(v1,v2)
+
+def _max(v1,v2):
+    if v1 is None:
+        return v2
+    elif v2 is None:
+        return v1
+    else:
+        return max(v1,v2)
+
+def _number(v):
+    return None if v is None else float(v)
+
+def _new_stats():
+    return {
+        "features":0,
+        "seen":[None,None],
+        "extent":[None,None,None,None],
+        "velocity":[None,None],
+        "altitude":[None,None],
+        "devices":{},
+        "source_device_types":{}
+    }
+
+def get_archive_stats(db,source_table,start_date,end_date):
+    """
+    Return the statistics of the loggedpoints between start_date(inclusive) and end_date(exclusive)
+        features: the number of loggedpoints
+        seen: [the first seen, the last seen] in epoch seconds
+        extent: [minx,miny,maxx,maxy]
+        velocity: [min velocity,max velocity]
+        altitude: [min altitude,max altitude]
+        devices: {deviceid:the number of loggedpoints}
+        source_device_types: {source device type:the number of loggedpoints}
+    Return None if no loggedpoints
+    """
+    stats = _new_stats()
+    for row in db.query(stats_sql.format(source_table),params=(start_date,end_date)):
+        by_source_device_type,deviceid,source_device_type,features,first_seen,last_seen,minx,miny,maxx,maxy,min_velocity,max_velocity,min_altitude,max_altitude = row
+        if by_source_device_type:
+            stats["source_device_types"][source_device_type or ""] = features
+            continue
+        #the overall statistics are aggregated from the device groups
+        stats["devices"][deviceid] = features
+        stats["features"] += features
+        stats["seen"] = [_min(stats["seen"][0],first_seen),_max(stats["seen"][1],last_seen)]
+        stats["extent"] = [_min(stats["extent"][0],minx),_min(stats["extent"][1],miny),_max(stats["extent"][2],maxx),_max(stats["extent"][3],maxy)]
+        stats["velocity"] = [_min(stats["velocity"][0],_number(min_velocity)),_max(stats["velocity"][1],_number(max_velocity))]
+        stats["altitude"] = [_min(stats["altitude"][0],_number(min_altitude)),_max(stats["altitude"][1],_number(max_altitude))]
+
+    if not stats["features"]:
+        return None
+    logger.debug("The statistics of the loggedpoints between {} and {}: features={},devices={},source device types={}".format(
+        start_date,end_date,stats["features"],len(stats["devices"]),len(stats["source_device_types"])
+    ))
+    return stats
+
+def write_stats(stats,filename):
+    """
+    Save the statistics into a json file, which is kept as a companion file of the archive
+    """
+    with open(filename,"w") as f:
+        json.dump(stats,f)
+
+def read_stats(data):
+    """
+    Return the statistics from the content of the statistics file
+    """
+    return json.loads(data)
+
+def merge_stats(stats_list):
+    """
+    Merge the statistics of the archives; return None if no statistics
+    """
+    result = None
+    for stats in stats_list:
+        if not stats:
+            continue
+        if result is None:
+            result = _new_stats()
+        result["features"] += stats["features"]
+        result["seen"] = [_min(result["seen"][0],stats["seen"][0]),_max(result["seen"][1],stats["seen"][1])]
+        result["extent"] = [_min(result["extent"][0],stats["extent"][0]),_min(result["extent"][1],stats["extent"][1]),_max(result["extent"][2],stats["extent"][2]),_max(result["extent"][3],stats["extent"][3])]
+        result["velocity"] = [_min(result["velocity"][0],stats["velocity"][0]),_max(result["velocity"][1],stats["velocity"][1])]
+        result["altitude"] = [_min(result["altitude"][0],stats["altitude"][0]),_max(result["altitude"][1],stats["altitude"][1])]
+        for key in ("devices","source_device_types"):
+            for k,v in stats[key].items():
+                result[key][k] = result[key].get(k,0) + v
+    return result
+
+def query(metadatas,start_date=None,end_date=None,deviceid=None,source_device_type=None):
+    """
+    Answer the catalog query from the archive metadata only
+    metadatas: the metadata of the data archives
+    start_date: the archives ending after start_date; no limit if None
+    end_date: the archives starting before end_date; no limit if None
+    deviceid: only return the archives containing the device if not None
+    source_device_type: only return the archives containing the source device type if not None
+    Return the list of the archive summary ordered by archive date; the archives without statistics are included with unknown(None) counts
+        archive_id,start_archive_date,end_archive_date,features,devices,seen,extent,velocity,altitude,device_features,source_device_type_features
+    """
+    result = []
+    for m in sorted(metadatas,key=lambda m:m["start_archive_date"]):
+        if start_date and m["end_archive_date"] <= start_date:
+            continue
+        if end_date and m["start_archive_date"] >= end_date:
+            continue
+        stats = m.get("stats")
+        row = {
+            "archive_id":m["resource_id"],
+            "start_archive_date":m["start_archive_date"],
+            "end_archive_date":m["end_archive_date"],
+            "features":m.get("features"),
+            "devices":len(stats["devices"]) if stats else None,
+            "seen":stats["seen"] if stats else None,
+            "extent":stats["extent"] if stats else None,
+            "velocity":stats["velocity"] if stats else None,
+            "altitude":stats["altitude"] if stats else None
+        }
+        if deviceid is not None:
+            row["device_features"] = stats["devices"].get(deviceid,0) if stats else None
+            if row["device_features"] == 0:
+                continue
+        if source_device_type is not None:
+            row["source_device_type_features"] = stats["source_device_types"].get(source_device_type,0) if stats else None
+            if row["source_device_type_features"] == 0:
+                continue
+        result.append(row)
+    return result
@@ -0,0 +1,31 @@
+import argparse
+from datetime import datetime,timedelta
+import sys
+
+from resource_tracking import analytics
+
+def parse_date(value):
+    return datetime.strptime(value,"%Y-%m-%d").date()
+
+parser = argparse.ArgumentParser(prog="analyze",description='Compute the distance, speed, dwell time and gaps of each device per day from the archived logged points without restoring them')
+parser.add_argument('start_date', type=parse_date, action='store',help='The first archive date(yyyy-mm-dd)')
+parser.add_argument('end_date', type=parse_date, action='store',nargs="?",help='The last archive date(yyyy-mm-dd, inclusive), same as start date if not specified')
+parser.add_argument('--workers', type=int, action='store',help='The number of days analyzed in parallel, use the configured value if not specified')
+parser.add_argument('--gap', type=int, action='store',help='The interval(seconds) longer than gap is a gap, use the configured value if not specified')
+parser.add_argument('--dwell-speed',dest='dwell_speed', type=float, action='store',help='The speed(km/h) under which the device is dwelling, use the configured value if not specified')
+parser.add_argument('--format', dest='output_format', action='store',choices=("csv","json"),default="csv",help='The format of the result')
+parser.add_argument('--output', action='store',help='Save the result into the file; print the result if not specified')
+
+
+def run():
+    args = parser.parse_args(sys.argv[2:])
+    end_date = args.end_date or args.start_date
+    if end_date < args.start_date:
+        raise Exception("The end date({}) is earlier than the start date({})".format(end_date,args.start_date))
+    result = analytics.analyze_dates(args.start_date,end_date + timedelta(days=1),workers=args.workers,gap=args.gap,dwell_speed=args.dwell_speed)
+    if args.output:
+        with open(args.output,"w",newline="") as f:
+            analytics.write_result(result,f,output_format=args.output_format)
+        print("Saved the analytics of {} device days into {}".format(len(result),args.output))
+    else:
+        analytics.write_result(result,sys.stdout,output_format=args.output_format)
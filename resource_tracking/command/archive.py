@@ -15,6 +15,7 @@ parser.add_argument('day', type=int, action='store',choices=[d for d in range(1,
 parser.add_argument('--check',  action='store_true',help='Download the archived files to check whether it was archived successfully or not')
 parser.add_argument('--delete', action='store_true',help='Delete the archived logged points from table after archiving')
 parser.add_argument('--overwrite', action='store_true',help='Overwrite the existing archive file')
+parser.add_argument('--format', dest='archive_format', action='store',choices=archive.archive_formats,help='The format of the archive file, use the configured format if not specified')
 
 
 def run():
@@ -24,10 +25,10 @@ def run():
         raise Exception("Can only archive logged points happened before today.")
     if args.day:
         #archive by date
-        archive.archive_by_date(d,delete_after_archive=args.delete,check=args.check,overwrite=args.overwrite)
+        archive.archive_by_date(d,delete_after_archive=args.delete,check=args.check,overwrite=args.overwrite,archive_format=args.archive_format)
     else:
         #archive by month
-        archive.archive_by_month(d.year,d.month,delete_after_archive=args.delete,check=args.check,overwrite=args.overwrite)
+        archive.archive_by_month(d.year,d.month,delete_after_archive=args.delete,check=args.check,overwrite=args.overwrite,archive_format=args.archive_format)
 
 
 
@@ -0,0 +1,43 @@
+import argparse
+import json
+from datetime import datetime,timedelta
+import sys
+
+from resource_tracking import archive
+from utils import JSONEncoder
+
+def parse_date(value):
+    return datetime.strptime(value,"%Y-%m-%d").date()
+
+parser = argparse.ArgumentParser(prog="catalog",description='Query the loggedpoint archives from the archive metadata, the archive files are not downloaded')
+parser.add_argument('start_date', type=parse_date, action='store',nargs="?",help='The first archive date(yyyy-mm-dd), no limit if not specified')
+parser.add_argument('end_date', type=parse_date, action='store',nargs="?",help='The last archive date(yyyy-mm-dd, inclusive), same as start date if not specified')
+parser.add_argument('--device',dest='deviceid', action='store',help='Only list the archives containing the device')
+parser.add_argument('--source-device-type',dest='source_device_type', action='store',help='Only list the archives containing the source device type')
+parser.add_argument('--json', action='store_true',help='Print the result as json')
+
+
+def run():
+    args = parser.parse_args(sys.argv[2:])
+    end_date = args.end_date or args.start_date
+    result = archive.query_catalog(
+        start_date=args.start_date,
+        end_date=(end_date + timedelta(days=1)) if end_date else None,
+        deviceid=args.deviceid,
+        source_device_type=args.source_device_type
+    )
+    if args.json:
+        print(json.dumps(result,indent="    ",cls=JSONEncoder))
+        return
+
+    columns = ["archive_id","features","devices"]
+    if args.deviceid is not None:
+        columns.append("device_features")
+    if args.source_device_type is not None:
+        columns.append("source_device_type_features")
+    print("\t".join(columns + ["first_seen","last_seen"]))
+    for row in result:
+        seen = [datetime.fromtimestamp(s).strftime("%Y-%m-%d %H:%M:%S") if s else "" for s in (row["seen"] or [None,None])]
+        print("\t".join(["" if row[c] is None else str(row[c]) for c in columns] + seen))
+    count_column = "device_features" if args.deviceid is not None else ("source_device_type_features" if args.source_device_type is not None else "features")
+    print("{} archives, {} features".format(len(result),sum(row[count_column] or 0 for row in result)))
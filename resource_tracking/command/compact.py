@@ -0,0 +1,21 @@
+import argparse
+from datetime import datetime
+import sys
+
+from resource_tracking import archive
+
+now = datetime.now()
+year = now.year
+
+parser = argparse.ArgumentParser(prog="compact",description='Compact the daily archives of a closed month into one monthly archive')
+parser.add_argument('year', type=int, action='store',choices=[y for y in range(year - 10,year + 1,1)],help='The year of the logged points')
+parser.add_argument('month', type=int, action='store',choices=[m for m in range(1,13)],help='The month of the logged points')
+parser.add_argument('--remove-dailies',dest='remove_dailies', action='store_true',help='Remove the daily archive files after compacting')
+parser.add_argument('--check',  action='store_true',help='Download the monthly archive file to check whether it was pushed successfully before swapping the metadata')
+parser.add_argument('--overwrite', action='store_true',help='Compact the month again if it was already compacted')
+
+
+def run():
+    args = parser.parse_args(sys.argv[2:])
+    metadata = archive.compact_month(args.year,args.month,remove_dailies=args.remove_dailies,check=args.check,overwrite=args.overwrite)
+    print("Compacted {} daily archives into {}, {} logged points".format(len(metadata["compacted_from"]),metadata["resource_file"],metadata["features"]))
@@ -0,0 +1,24 @@
+import argparse
+from datetime import datetime,timedelta
+import sys
+
+from resource_tracking import archive
+
+def parse_date(value):
+    return datetime.strptime(value,"%Y-%m-%d").date()
+
+parser = argparse.ArgumentParser(prog="merge_grid",description='Merge the density grids of the archived logged points in a date range, the archive files are not downloaded')
+parser.add_argument('start_date', type=parse_date, action='store',help='The first archive date(yyyy-mm-dd)')
+parser.add_argument('end_date', type=parse_date, action='store',nargs="?",help='The last archive date(yyyy-mm-dd, inclusive), same as start date if not specified')
+parser.add_argument('--output', action='store',required=True,help='The merged grid file, a compressed numpy file(.npz) or an ESRI ASCII grid file(.asc)')
+
+
+def run():
+    args = parser.parse_args(sys.argv[2:])
+    end_date = args.end_date or args.start_date
+    if end_date < args.start_date:
+        raise Exception("The end date({}) is earlier than the start date({})".format(end_date,args.start_date))
+    result = archive.merge_density_grids(args.start_date,end_date + timedelta(days=1),args.output)
+    print("Merged {} density grids into {}, {} logged points".format(result["grids"],result["file"],result["features"]))
+    if result["missing"]:
+        print("The archives without density grid: {}".format(",".join(result["missing"])))
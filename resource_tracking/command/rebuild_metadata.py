@@ -0,0 +1,18 @@
+import argparse
+import json
+import sys
+
+from resource_tracking import archive
+from utils import JSONEncoder
+
+parser = argparse.ArgumentParser(prog="rebuild_metadata",description='Rebuild the loggedpoint archive metadata from the archive files in blob storage')
+parser.add_argument('--dry-run',dest='dry_run', action='store_true',help='Print the rebuilt metadata instead of pushing it to blob storage')
+
+
+def run():
+    args = parser.parse_args(sys.argv[2:])
+    resourcemetadata = archive.rebuild_metadata(dry_run=args.dry_run)
+    if args.dry_run:
+        print(json.dumps(resourcemetadata,indent="    ",cls=JSONEncoder))
+
+
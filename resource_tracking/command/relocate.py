@@ -0,0 +1,18 @@
+import argparse
+import sys
+
+from resource_tracking import archive
+
+parser = argparse.ArgumentParser(prog="relocate",description='Move the loggedpoint archives to another location with azure server side copy')
+parser.add_argument('--container', dest='container_name', action='store',help='The target container; use the current container if not specified')
+parser.add_argument('--resource-base-path', dest='resource_base_path', action='store',help='The target resource base path; use the current resource base path if not specified')
+parser.add_argument('--connection-string', dest='connection_string', action='store',help='The connection string of the target storage account; use the current storage account if not specified')
+parser.add_argument('--tier', dest='tier', action='store',choices=("Hot","Cool","Archive"),help='The access tier of the copied archive files')
+parser.add_argument('--copy', action='store_true',help='Keep the archives in the current location')
+
+
+def run():
+    args = parser.parse_args(sys.argv[2:])
+    archive.relocate(resource_base_path=args.resource_base_path,container_name=args.container_name,connection_string=args.connection_string,standard_blob_tier=args.tier,delete_source=not args.copy)
+
+
@@ -14,6 +14,8 @@ parser.add_argument('month', type=int, action='store',choices=[m for m in range(
 parser.add_argument('day', type=int, action='store',choices=[d for d in range(1,32)],nargs="?",help='The day of the logged points')
 parser.add_argument('--preserve-id',dest='preserve_id', action='store_true',help='Preserve loggedpoint\' id during restoring the data into table \'tracking_loggedpoint\'')
 parser.add_argument('--restore-to-origin-table',dest='restore_to_origin_table', action='store_true',help='Restore the archived data to table \'tracking_loggedpoint\'')
+parser.add_argument('--rehydrate-timeout',dest='rehydrate_timeout', type=int,action='store',help='The maximum seconds to wait for the rehydration of the archived files in archive tier')
+parser.add_argument('--with-raw',dest='with_raw', action='store_true',help='Restore the raw messages from the raw sidecar files')
 
 
 def run():
@@ -23,10 +25,10 @@ def run():
         raise Exception("Can only restore logged points happened before today.")
     if args.day:
         #restore by date
-        archive.restore_by_date(d,restore_to_origin_table=args.restore_to_origin_table,preserve_id=args.preserve_id)
+        archive.restore_by_date(d,restore_to_origin_table=args.restore_to_origin_table,preserve_id=args.preserve_id,rehydrate_timeout=args.rehydrate_timeout,with_raw=args.with_raw)
     else:
         #restore by month
-        archive.restore_by_month(d.year,d.month,restore_to_origin_table=args.restore_to_origin_table,preserve_id=args.preserve_id)
+        archive.restore_by_month(d.year,d.month,restore_to_origin_table=args.restore_to_origin_table,preserve_id=args.preserve_id,rehydrate_timeout=args.rehydrate_timeout,with_raw=args.with_raw)
 
 
 
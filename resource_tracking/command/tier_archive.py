@@ -0,0 +1,15 @@
+import argparse
+import sys
+
+from resource_tracking import archive
+
+parser = argparse.ArgumentParser(prog="tier_archive",description='Move the old loggedpoint archives to a cheaper access tier')
+parser.add_argument('--months', type=int, action='store',help='Move the archives older than months; use the configured value if not specified')
+parser.add_argument('--tier', action='store',choices=("Hot","Cool","Archive"),help='The access tier; use the configured tier if not specified')
+
+
+def run():
+    args = parser.parse_args(sys.argv[2:])
+    archive.tier_archives(months=args.months,tier=args.tier)
+
+
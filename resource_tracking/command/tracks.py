@@ -0,0 +1,30 @@
+import argparse
+import json
+from datetime import datetime,timedelta
+import sys
+
+from resource_tracking import archive,tracks
+
+def parse_date(value):
+    return datetime.strptime(value,"%Y-%m-%d").date()
+
+parser = argparse.ArgumentParser(prog="tracks",description='Query the simplified daily tracks of a device from the trajectory overviews of the archived logged points')
+parser.add_argument('deviceid', action='store',help='The device id')
+parser.add_argument('start_date', type=parse_date, action='store',help='The first archive date(yyyy-mm-dd)')
+parser.add_argument('end_date', type=parse_date, action='store',nargs="?",help='The last archive date(yyyy-mm-dd, inclusive), same as start date if not specified')
+parser.add_argument('--level', type=int, action='store',default=0,help='The overview level, 0 is the most detailed level')
+parser.add_argument('--output', action='store',help='Save the tracks as geojson into the file; print the geojson if not specified')
+
+
+def run():
+    args = parser.parse_args(sys.argv[2:])
+    end_date = args.end_date or args.start_date
+    if end_date < args.start_date:
+        raise Exception("The end date({}) is earlier than the start date({})".format(end_date,args.start_date))
+    result = tracks.to_geojson(archive.query_tracks(args.deviceid,args.start_date,end_date + timedelta(days=1),level=args.level))
+    if args.output:
+        with open(args.output,"w") as f:
+            json.dump(result,f)
+        print("Saved {} tracks into {}".format(len(result["features"]),args.output))
+    else:
+        print(json.dumps(result,indent="    "))
@@ -0,0 +1,111 @@
+import os
+import logging
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from . import settings
+
+logger = logging.getLogger(__name__)
+
+#the number of loggedpoints in each grid cell, the cells out of the grid extent are ignored
+#    parameters: miny,resolution,minx,resolution,start_date,end_date,minx,miny,maxx,maxy
+density_sql = """SELECT floor((ST_Y(a.point) - %s) / %s)::integer,floor((ST_X(a.point) - %s) / %s)::integer,count(1)
+FROM {0} a
+WHERE a.seen >= %s AND a.seen < %s AND a.point && ST_MakeEnvelope(%s,%s,%s,%s,4326)
+GROUP BY 1,2"""
+
+def is_available():
+    """
+    Return True if the density grid is enabled and numpy is installed
+    """
+    return bool(settings.LOGGEDPOINT_DENSITY_GRID) and numpy is not None
+
+def get_grid_settings():
+    """
+    Return the configured grid extent (minx,miny,maxx,maxy) and resolution
+    """
+    return tuple(float(v) for v in settings.LOGGEDPOINT_GRID_EXTENT),float(settings.LOGGEDPOINT_GRID_RESOLUTION)
+
+def get_grid_shape(extent,resolution):
+    """
+    Return the shape (rows,columns) of the grid; row 0 is the southmost row
+    """
+    return (int(round((extent[3] - extent[1]) / resolution)),int(round((extent[2] - extent[0]) / resolution)))
+
+def write_grid(db,source_table,start_date,end_date,filename):
+    """
+    Count the loggedpoints between start_date(inclusive) and end_date(exclusive) in each grid cell and save the grid into a compressed npz file
+    Return the grid metadata: the extent, the resolution, the shape, the number of counted loggedpoints and the number of non-empty cells
+    """
+    extent,resolution = get_grid_settings()
+    shape = get_grid_shape(extent,resolution)
+    rows = db.query(density_sql.format(source_table),params=(extent[1],resolution,extent[0],resolution,start_date,end_date,extent[0],extent[1],extent[2],extent[3]))
+    counts = numpy.zeros(shape,dtype=numpy.uint32)
+    if rows:
+        cells = numpy.array(rows,dtype=numpy.int64)
+        #the points on the north or east boundary of the extent are counted in the last row or column
+        row_index = numpy.clip(cells[:,0],0,shape[0] - 1)
+        column_index = numpy.clip(cells[:,1],0,shape[1] - 1)
+        numpy.add.at(counts,(row_index,column_index),cells[:,2].astype(numpy.uint32))
+    if os.path.exists(filename):
+        os.remove(filename)
+    numpy.savez_compressed(filename,counts=counts,extent=numpy.array(extent),resolution=numpy.array(resolution))
+    stats = {
+        "extent":list(extent),
+        "resolution":resolution,
+        "shape":list(shape),
+        "features":int(counts.sum(dtype=numpy.uint64)),
+        "cells":int(numpy.count_nonzero(counts))
+    }
+    logger.debug("Wrote the density grid({}) of the loggedpoints between {} and {}, features={}, cells={}".format(filename,start_date,end_date,stats["features"],stats["cells"]))
+    return stats
+
+def read_grid(filename):
+    """
+    Return the (counts,extent,resolution) of the grid file
+    """
+    if numpy is None:
+        raise Exception("Package 'numpy' is required to read the density grid file({})".format(filename))
+    with numpy.load(filename) as data:
+        return (data["counts"],tuple(data["extent"].tolist()),float(data["resolution"]))
+
+def merge_grids(filenames):
+    """
+    Sum the density grids
+    All grids should have the same extent and resolution
+    Return the (counts,extent,resolution) of the merged grid; return None if no grid files
+    """
+    total = None
+    extent = None
+    resolution = None
+    for filename in filenames:
+        counts,grid_extent,grid_resolution = read_grid(filename)
+        if total is None:
+            total = counts.astype(numpy.uint64)
+            extent = grid_extent
+            resolution = grid_resolution
+        elif grid_extent != extent or grid_resolution != resolution:
+            raise Exception("The density grid({}) has a different extent({}) or resolution({}) from the other grids(extent={},resolution={})".format(filename,grid_extent,grid_resolution,extent,resolution))
+        else:
+            total += counts
+    return None if total is None else (total,extent,resolution)
+
+def save_grid(counts,extent,resolution,filename):
+    """
+    Save the grid into a compressed npz file, or an ESRI ASCII grid file if the file extension is '.asc'
+    The extension '.npz' is appended to the npz file name if missing, as numpy does.
+    Return the saved file
+    """
+    if filename.lower().endswith(".asc"):
+        with open(filename,"w") as f:
+            f.write("ncols {}\nnrows {}\nxllcorner {}\nyllcorner {}\ncellsize {}\nNODATA_value -1\n".format(counts.shape[1],counts.shape[0],extent[0],extent[1],resolution))
+            #the first row of the ascii grid is the northmost row
+            numpy.savetxt(f,counts[::-1],fmt="%d")
+    else:
+        if not filename.endswith(".npz"):
+            filename = "{}.npz".format(filename)
+        numpy.savez_compressed(filename,counts=counts,extent=numpy.array(extent),resolution=numpy.array(resolution))
+    return filename
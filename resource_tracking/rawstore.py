@@ -0,0 +1,125 @@
+import os
+import sqlite3
+import logging
+from urllib.request import pathname2url
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from . import settings
+
+logger = logging.getLogger(__name__)
+
+#the sqlite schema of the raw sidecar file
+#    dictionaries: the zstd dictionary trained for each source device type; dictionary is null if not enough samples to train a dictionary
+#    raw: the compressed raw message of each loggedpoint, keyed by the loggedpoint id(the fid of the archive file)
+sidecar_schema = """
+CREATE TABLE dictionaries (source_device_type TEXT PRIMARY KEY,dictionary BLOB);
+CREATE TABLE raw (fid INTEGER PRIMARY KEY,source_device_type TEXT,data BLOB);
+"""
+
+def is_available():
+    """
+    Return True if the raw sidecar is enabled and zstandard is installed
+    """
+    return bool(settings.LOGGEDPOINT_RAW_SIDECAR) and zstandard is not None
+
+def _encode(raw):
+    if isinstance(raw,memoryview):
+        return raw.tobytes()
+    elif isinstance(raw,bytes):
+        return raw
+    else:
+        return str(raw).encode()
+
+def _train(samples):
+    """
+    Train a zstd dictionary from the samples; return None if failed
+    """
+    if len(samples) < settings.LOGGEDPOINT_RAW_DICT_MIN_SAMPLES:
+        return None
+    try:
+        return zstandard.train_dictionary(settings.LOGGEDPOINT_RAW_DICT_SIZE,samples)
+    except zstandard.ZstdError as ex:
+        logger.debug("Failed to train the zstd dictionary from {} samples. {}".format(len(samples),str(ex)))
+        return None
+
+def write_sidecar(rows,filename):
+    """
+    Write the raw messages into the sidecar file
+    rows: an iterator of (loggedpoint id,source device type,raw) ordered by source device type
+    The first LOGGEDPOINT_RAW_DICT_SAMPLES messages of each source device type are buffered to train the dictionary, the memory is bounded by the number of samples
+    Return the sidecar metadata: the number of rows, the raw bytes, the compressed bytes, and the source device types which have a dictionary
+    """
+    if os.path.exists(filename):
+        os.remove(filename)
+    conn = sqlite3.connect(filename)
+    stats = {"rows":0,"raw_bytes":0,"compressed_bytes":0,"dictionaries":[]}
+    try:
+        conn.executescript(sidecar_schema)
+        source_device_type = None
+        buffered = []
+        compressor = None
+
+        def _write(rows):
+            data = []
+            for fid,device_type,raw in rows:
+                compressed = compressor.compress(raw)
+                stats["raw_bytes"] += len(raw)
+                stats["compressed_bytes"] += len(compressed)
+                data.append((fid,device_type,compressed))
+            conn.executemany("INSERT INTO raw (fid,source_device_type,data) VALUES (?,?,?)",data)
+            stats["rows"] += len(data)
+
+        def _start_compress():
+            dictionary = _train([r[2] for r in buffered])
+            conn.execute("INSERT INTO dictionaries (source_device_type,dictionary) VALUES (?,?)",(source_device_type,dictionary.as_bytes() if dictionary else None))
+            if dictionary:
+                stats["dictionaries"].append(source_device_type)
+            return zstandard.ZstdCompressor(level=settings.LOGGEDPOINT_RAW_COMPRESSION_LEVEL,dict_data=dictionary)
+
+        for fid,device_type,raw in rows:
+            if raw is None:
+                continue
+            if device_type != source_device_type:
+                if buffered:
+                    compressor = _start_compress()
+                    _write(buffered)
+                source_device_type = device_type
+                buffered = []
+                compressor = None
+            row = (fid,device_type,_encode(raw))
+            if compressor:
+                _write([row])
+            else:
+                buffered.append(row)
+                if len(buffered) >= settings.LOGGEDPOINT_RAW_DICT_SAMPLES:
+                    compressor = _start_compress()
+                    _write(buffered)
+                    buffered = []
+        if buffered:
+            compressor = _start_compress()
+            _write(buffered)
+        conn.commit()
+    finally:
+        conn.close()
+    logger.debug("Wrote {} raw messages into sidecar file({}), raw bytes={}, compressed bytes={}".format(stats["rows"],filename,stats["raw_bytes"],stats["compressed_bytes"]))
+    return stats
+
+def read_sidecar(filename):
+    """
+    Return a generator which yields (loggedpoint id,raw message) from the sidecar file
+    """
+    if zstandard is None:
+        raise Exception("Package 'zstandard' is required to read the raw sidecar file({})".format(filename))
+    conn = sqlite3.connect("file:{}?mode=ro".format(pathname2url(os.path.abspath(filename))),uri=True)
+    try:
+        decompressors = {}
+        for source_device_type,dictionary in conn.execute("SELECT source_device_type,dictionary FROM dictionaries"):
+            decompressors[source_device_type] = zstandard.ZstdDecompressor(dict_data=zstandard.ZstdCompressionDict(dictionary) if dictionary else None)
+        for fid,source_device_type,data in conn.execute("SELECT fid,source_device_type,data FROM raw"):
+            yield (fid,decompressors[source_device_type].decompress(data).decode())
+    finally:
+        conn.close()
@@ -7,7 +7,11 @@ from db.database import PostgreSQL
 
 import psycopg2
 
-DATABASE = PostgreSQL(env("RESOURCE_TRACKING_DATABASE_URL",vtype=str,required=True))
+#RESOURCE_TRACKING_REPLICA_DATABASE_URL: the optional read-only streaming replica, which is used to count and export the loggedpoint to archive
+DATABASE = PostgreSQL(
+    env("RESOURCE_TRACKING_DATABASE_URL",vtype=str,required=True),
+    replica_url=env("RESOURCE_TRACKING_REPLICA_DATABASE_URL",vtype=str)
+)
 
 AZURE_CONNECTION_STRING = env("RESOURCE_TRACKING_STORAGE_CONNECTION_STRING",vtype=str,required=True)
 AZURE_CONTAINER = env("RESOURCE_TRACKING_CONTAINER",vtype=str,required=True)
@@ -16,6 +20,62 @@ LOGGEDPOINT_ARCHIVE_DELETE_DISABLED = env("LOGGEDPOINT_ARCHIVE_DELETE_DISABLED",
 
 LOGGEDPOINT_ACTIVE_DAYS = env("LOGGEDPOINT_ACTIVE_DAYS",vtype=int,default=30)
 
-START_WORKING_HOUR =  env("START_WORKING_HOUR",vtype=int)
-END_WORKING_HOUR =  env("END_WORKING_HOUR",vtype=int)
+#the format of the loggedpoint archive file: gpkg(GeoPackage) or parquet(GeoParquet, requires gdal 3.5+ with parquet driver)
+LOGGEDPOINT_ARCHIVE_FORMAT = env("LOGGEDPOINT_ARCHIVE_FORMAT",default="gpkg")
+#the maximum number of rows in a row group of the GeoParquet archive file
+LOGGEDPOINT_PARQUET_ROW_GROUP_SIZE = env("LOGGEDPOINT_PARQUET_ROW_GROUP_SIZE",default=65536)
+#store the raw message in a separate zstd compressed sidecar file instead of the archive file, requires package 'zstandard'
+#    the archive file has no 'raw' column if enabled
+LOGGEDPOINT_RAW_SIDECAR = env("LOGGEDPOINT_RAW_SIDECAR",default=False)
+#the maximum size(bytes) of the zstd dictionary trained for each source device type
+LOGGEDPOINT_RAW_DICT_SIZE = env("LOGGEDPOINT_RAW_DICT_SIZE",default=112640)
+#the number of raw messages sampled to train the zstd dictionary of a source device type
+LOGGEDPOINT_RAW_DICT_SAMPLES = env("LOGGEDPOINT_RAW_DICT_SAMPLES",default=2000)
+#don't train the dictionary if the number of raw messages of a source device type is less than this value
+LOGGEDPOINT_RAW_DICT_MIN_SAMPLES = env("LOGGEDPOINT_RAW_DICT_MIN_SAMPLES",default=100)
+#the zstd compression level of the raw message
+LOGGEDPOINT_RAW_COMPRESSION_LEVEL = env("LOGGEDPOINT_RAW_COMPRESSION_LEVEL",default=10)
+#build a density grid(the number of loggedpoints in each grid cell) for each archive, requires package 'numpy'
+LOGGEDPOINT_DENSITY_GRID = env("LOGGEDPOINT_DENSITY_GRID",default=True)
+#the extent(minx,miny,maxx,maxy) of the density grid in EPSG:4326
+LOGGEDPOINT_GRID_EXTENT = env("LOGGEDPOINT_GRID_EXTENT",default=(108.0,-45.0,155.0,-9.0))
+#the cell size(degrees) of the density grid
+LOGGEDPOINT_GRID_RESOLUTION = env("LOGGEDPOINT_GRID_RESOLUTION",default=0.02)
+#build the simplified daily trajectory of each device for each archive
+LOGGEDPOINT_TRACK_OVERVIEW = env("LOGGEDPOINT_TRACK_OVERVIEW",default=True)
+#the simplification tolerances(degrees) of the trajectory overviews, one overview level for each tolerance
+LOGGEDPOINT_TRACK_TOLERANCES = env("LOGGEDPOINT_TRACK_TOLERANCES",default=(0.0001,0.001,0.01))
+#the local folder to cache the downloaded trajectory overview files, use a folder in the system temporary folder if empty
+LOGGEDPOINT_TRACK_CACHE_FOLDER = env("LOGGEDPOINT_TRACK_CACHE_FOLDER",vtype=str)
+#move the loggedpoint archives older than LOGGEDPOINT_TIER_MONTHS months to the access tier LOGGEDPOINT_TIER
+LOGGEDPOINT_TIER_MONTHS = env("LOGGEDPOINT_TIER_MONTHS",default=6)
+LOGGEDPOINT_TIER = env("LOGGEDPOINT_TIER",default="Cool")
+#the maximum seconds to wait for the rehydration of the archived files before restoring, don't wait if 0
+LOGGEDPOINT_REHYDRATE_TIMEOUT = env("LOGGEDPOINT_REHYDRATE_TIMEOUT",default=0)
+
+#the number of archive files loaded into staging tables in parallel when restoring a month
+LOGGEDPOINT_RESTORE_WORKERS = env("LOGGEDPOINT_RESTORE_WORKERS",default=4)
+#the width of the id range moved from the staging table into table tracking_loggedpoint in one batch, move all rows in one statement if 0
+LOGGEDPOINT_RESTORE_BATCH_SIZE = env("LOGGEDPOINT_RESTORE_BATCH_SIZE",default=100000)
+
+#the number of days analyzed in parallel by the archive analytics
+LOGGEDPOINT_ANALYTICS_WORKERS = env("LOGGEDPOINT_ANALYTICS_WORKERS",default=4)
+#the interval(seconds) between two loggedpoints of a device longer than this value is a gap, which is not counted into the distance and time
+LOGGEDPOINT_ANALYTICS_GAP = env("LOGGEDPOINT_ANALYTICS_GAP",default=1800)
+#the device moving slower than this speed(km/h) is dwelling
+LOGGEDPOINT_ANALYTICS_DWELL_SPEED = env("LOGGEDPOINT_ANALYTICS_DWELL_SPEED",default=1.0)
+#the local folder to cache the loaded archives as memory mapped numpy files, use a folder in the system temporary folder if empty
+LOGGEDPOINT_ANALYTICS_CACHE_FOLDER = env("LOGGEDPOINT_ANALYTICS_CACHE_FOLDER",vtype=str)
+
+#pace the continuous archiving to keep the database load under the limits, the limit is disabled if it is 0
+#the maximum number of the active client sessions
+LOGGEDPOINT_ARCHIVE_MAX_ACTIVE_SESSIONS = env("LOGGEDPOINT_ARCHIVE_MAX_ACTIVE_SESSIONS",default=20)
+#the maximum number of the sessions waiting for IO
+LOGGEDPOINT_ARCHIVE_MAX_IO_WAIT = env("LOGGEDPOINT_ARCHIVE_MAX_IO_WAIT",default=10)
+#the maximum replay lag(seconds) of the replicas
+LOGGEDPOINT_ARCHIVE_MAX_REPLICATION_LAG = env("LOGGEDPOINT_ARCHIVE_MAX_REPLICATION_LAG",default=60)
+#the maximum seconds to pause before checking the database load again
+LOGGEDPOINT_ARCHIVE_MAX_PAUSE = env("LOGGEDPOINT_ARCHIVE_MAX_PAUSE",default=300)
+#the number of rows deleted in one batch after archiving, delete all the rows in one statement if 0
+LOGGEDPOINT_DELETE_BATCH_SIZE = env("LOGGEDPOINT_DELETE_BATCH_SIZE",default=50000)
 
@@ -0,0 +1,64 @@
+import logging
+
+from utils import gdal
+
+from . import settings
+
+logger = logging.getLogger(__name__)
+
+#the daily trajectory of each device simplified at each tolerance(level of detail), level 0 is the most detailed overview
+#    the seen is the epoch seconds; the sql is executed by ogr2ogr, so it can't contain double quotes
+#    parameters: start datetime, end datetime, source table, the values of (level,tolerance)
+overview_sql = """WITH tracks AS (SELECT a.device_id,count(1) AS points,extract(epoch from min(a.seen))::bigint AS start_seen,extract(epoch from max(a.seen))::bigint AS end_seen,ST_MakeLine(a.point ORDER BY a.seen) AS track FROM {2} a WHERE a.seen >= '{0}' AND a.seen < '{1}' GROUP BY a.device_id HAVING count(1) > 1)
+SELECT b.deviceid,b.registration,t.level,t.tolerance,c.points,c.start_seen,c.end_seen,ST_NPoints(ST_Simplify(c.track,t.tolerance,true)) AS vertices,ST_Simplify(c.track,t.tolerance,true) AS track
+FROM tracks c JOIN tracking_device b ON c.device_id = b.id CROSS JOIN (VALUES {3}) AS t(level,tolerance)
+ORDER BY b.deviceid,t.level"""
+
+overview_columns = ["deviceid","registration","level","tolerance","points","start_seen","end_seen","vertices"]
+#the columns indexed in the overview file
+overview_index_columns = ["deviceid"]
+
+def is_available():
+    """
+    Return True if the trajectory overviews are enabled
+    """
+    return bool(settings.LOGGEDPOINT_TRACK_OVERVIEW) and bool(get_tolerances())
+
+def get_tolerances():
+    """
+    Return the configured simplification tolerances(degrees), ordered from the most detailed to the least detailed
+    """
+    return sorted(float(t) for t in settings.LOGGEDPOINT_TRACK_TOLERANCES)
+
+def get_overview_sql(start,end,source_table):
+    """
+    Return the sql to build the trajectory overviews
+    start,end: the formatted start and end datetime
+    """
+    levels = ",".join("({},{}::float8)".format(level,tolerance) for level,tolerance in enumerate(get_tolerances()))
+    return overview_sql.format(start,end,source_table,levels)
+
+def read_tracks(filename,layer,deviceid,level):
+    """
+    Return the tracks of the device at the level from the overview file
+    Each track is a dict with the overview columns and the coordinates of the track
+    """
+    tracks = []
+    for values,wkb in gdal.query_gpkg(filename,layer,overview_columns,where="deviceid = ? AND level = ?",params=(deviceid,level)):
+        track = dict(zip(overview_columns,values))
+        track["coordinates"] = gdal.wkb_linestring_coordinates(wkb) if wkb else []
+        tracks.append(track)
+    return tracks
+
+def to_geojson(tracks):
+    """
+    Return the tracks as a geojson feature collection
+    """
+    return {
+        "type":"FeatureCollection",
+        "features":[{
+            "type":"Feature",
+            "properties":dict((k,v) for k,v in track.items() if k != "coordinates"),
+            "geometry":{"type":"LineString","coordinates":track["coordinates"]}
+        } for track in tracks]
+    }
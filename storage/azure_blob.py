@@ -1,30 +1,71 @@
 import json
+import copy
+import time
 import tempfile
 import logging
 import os
 import shutil
 import traceback
+import threading
+from datetime import datetime,timedelta,timezone as dt_timezone
+from concurrent.futures import ThreadPoolExecutor
 
-from azure.storage.blob import  BlobServiceClient,BlobClient,BlobType
+from azure.storage.blob import  BlobServiceClient,BlobClient,BlobType,ContainerClient,BlobPrefix,generate_blob_sas,BlobSasPermissions
 from azure.core.exceptions import (ResourceNotFoundError,)
 
 from .storage import ResourceStorage
 from . import settings
+from .metrics import metrics,UPLOAD,DOWNLOAD,METADATA_READ,METADATA_WRITE,DELETE,COPY,SET_TIER
 from utils import JSONEncoder,JSONDecoder,timezone
 
 logger = logging.getLogger(__name__)
 
+#the key of the blob's custom metadata to keep a copy of the resource metadata, used to rebuild the resource metadata
+BLOB_METADATA_KEY = "resource_metadata"
+#the maximum size of the resource metadata saved in the blob's custom metadata(azure limits all custom metadata to 8K)
+BLOB_METADATA_MAX_SIZE = 7 * 1024
+
+def get_blob_metadata(metadata):
+    """
+    Return the blob's custom metadata which keeps a copy of the resource metadata
+    Only the scalar properties are kept if the resource metadata is too big
+    """
+    data = json.dumps(metadata,cls=JSONEncoder)
+    if len(data) > BLOB_METADATA_MAX_SIZE:
+        dropped = [k for k,v in metadata.items() if isinstance(v,(dict,list,tuple))]
+        logger.warning("The metadata of the resource({}) is too big({} bytes) for the blob's custom metadata, the properties({}) are dropped".format(metadata.get("resource_id"),len(data),",".join(dropped)))
+        data = json.dumps(dict((k,v) for k,v in metadata.items() if k not in dropped),cls=JSONEncoder)
+    return {BLOB_METADATA_KEY:data}
+
+_cleanup_executor = None
+_cleanup_lock = threading.Lock()
+def get_cleanup_executor():
+    """
+    Return the executor to delete the pruned blobs in the background
+    The pending deletions are finished before the process exits
+    """
+    global _cleanup_executor
+    if _cleanup_executor is None:
+        with _cleanup_lock:
+            if _cleanup_executor is None:
+                _cleanup_executor = ThreadPoolExecutor(max_workers=settings.AZURE_CLEANUP_WORKERS,thread_name_prefix="blob_cleanup")
+    return _cleanup_executor
+
 class AzureBlob(object):
     """
     A blob client to get/update a blob resource
     """
+    #the operation name used to track the blob uploading
+    _upload_operation = UPLOAD
+
     def __init__(self,blob_path,connection_string,container_name):
         self._blob_path = blob_path
         self._blob_client = BlobClient.from_connection_string(connection_string,container_name,blob_path,**settings.AZURE_BLOG_CLIENT_KWARGS)
 
     def delete(self):
         try:
-            self._blob_client.delete_blob()
+            with metrics.track(DELETE):
+                self._blob_client.delete_blob()
         except:
             logger.error("Failed to delete the resource from blob storage.{}".format(self._blob_path,traceback.format_exc()))
 
@@ -42,11 +83,12 @@ class AzureBlob(object):
                     #already exist and can't overwrite
                     raise Exception("The path({}) already exists".format(filename))
         else:
-            with tempfile.NamedTemporaryFile(prefix=self.resourcename) as f:
+            with tempfile.NamedTemporaryFile(prefix=os.path.basename(self._blob_path)) as f:
                 filename = f.name
 
         with open(filename,'wb') as f:
-            blob_data = self.get_blob_client(metadata["resource_path"]).download_blob().readinto(f)
+            with metrics.track(DOWNLOAD) as tracker:
+                tracker.bytes = self._blob_client.download_blob().readinto(f)
 
         return filename
         
@@ -57,19 +99,23 @@ class AzureBlob(object):
         """
         if blob_data is None:
             #delete the blob resource
-            self._blob_client.delete_blob(delete_snapshots="include")
+            with metrics.track(DELETE):
+                self._blob_client.delete_blob(delete_snapshots="include")
         else:
             if not isinstance(blob_data,bytes):
                 #blob_data is not byte array, convert it to json string
                 raise Exception("Updated data must be bytes type.")
             #self._blob_client.stage_block("main",blob_data)
             #self._blob_client.commit_block_list(["main"])
-            self._blob_client.upload_blob(blob_data,overwrite=True,timeout=3600)
+            with metrics.track(self._upload_operation,len(blob_data)):
+                self._blob_client.upload_blob(blob_data,overwrite=True,timeout=3600)
 
 class AzureJsonBlob(AzureBlob):
     """
     A blob client to get/update a json blob resource
     """
+    _upload_operation = METADATA_WRITE
+
     @property
     def json(self):
         """
@@ -77,7 +123,9 @@ class AzureJsonBlob(AzureBlob):
         Return None if resource is not found
         """
         try:
-            data = self._blob_client.download_blob().readall()
+            with metrics.track(METADATA_READ,expected=ResourceNotFoundError) as tracker:
+                data = self._blob_client.download_blob().readall()
+                tracker.bytes = len(data)
             return json.loads(data.decode(),cls=JSONDecoder)
         except ResourceNotFoundError as e:
             #blob not found
@@ -231,7 +279,11 @@ class AzureBlobResourceBase(object):
     _f_resourceid = staticmethod(lambda resource_name:resource_name)
     _f_resource_file = staticmethod(lambda resourceid:"{0}_{1}.json".format(resourceid,timezone.now().strftime("%Y-%m-%d-%H-%M-%S")))
     _f_resource_path = staticmethod(lambda data_path,resource_group,resource_file:"{0}/{1}/{2}".format(data_path,resource_group,resource_file) if resource_group else "{0}/{1}".format(data_path,resource_file))
-    def __init__(self,resource_name,connection_string,container_name,resource_base_path=None,group_resource=False,archive=True,metaname=None,f_resourceid=None,f_resource_file=None):
+    def __init__(self,resource_name,connection_string,container_name,resource_base_path=None,group_resource=False,archive=True,metaname=None,f_resourceid=None,f_resource_file=None,max_histories=None,history_days=None):
+        """
+        max_histories: only meaningful for archive resource, the maximum number of history versions to keep; keep all history versions if None
+        history_days: only meaningful for archive resource, only keep the history versions published in the last history_days days; keep all history versions if None
+        """
         self._resource_name = resource_name
         self._resource_base_path = resource_name if resource_base_path is None else resource_base_path
         if self._resource_base_path:
@@ -240,17 +292,24 @@ class AzureBlobResourceBase(object):
             self._resource_data_path = "data"
         self._connection_string = connection_string
         self._container_name = container_name
+        self._metaname = metaname
         self._metadata_client = AzureBlobResourceMetadata(connection_string,container_name,resource_base_path=self._resource_base_path,metaname=metaname,cache=True)
         self._archive = archive
         self.group_resource = group_resource
-        if not f_resourceid:
-            self._f_resourceid = staticmethod(f_resourceid)
-        if not f_resource_file:
-            self._f_resource_file = staticmethod(f_resource_file)
+        if f_resourceid:
+            self._f_resourceid = f_resourceid
+        if f_resource_file:
+            self._f_resource_file = f_resource_file
+        self._max_histories = max_histories if max_histories is None or max_histories >= 0 else None
+        self._history_days = history_days if history_days and history_days > 0 else None
+        self._cleanup_futures = []
 
     def get_blob_client(self,blob_name):
         return BlobClient.from_connection_string(self._connection_string,self._container_name,blob_name,**settings.AZURE_BLOG_CLIENT_KWARGS)
 
+    def get_container_client(self):
+        return ContainerClient.from_connection_string(self._connection_string,self._container_name,**settings.AZURE_BLOG_CLIENT_KWARGS)
+
     @property
     def resourcename(self):
         return self._resource_name
@@ -388,28 +447,34 @@ class AzureBlobResourceBase(object):
             logger.debug("Delete the resource({}.{}.{})".format(self.resourcename,metadata["resource_group"],metadata["resource_id"]))
         else:
             logger.debug("Delete the resource({}.{})".format(self.resourcename,metadata["resource_id"]))
-        #delete the resource file from storage
+        #delete the resource file from storage, the resource without resource_path(for example the resource whose blob was removed) has no blob to delete
         if self._archive:
             #archive resource
             #delete the current archive
-            blob_client = self.get_blob_client(metadata["current"]["resource_path"])
-            try:
-                blob_client.delete_blob()
-            except:
-                logger.error("Failed to delete the current resource({}) from blob storage.{}".format(metadata["current"]["resource_path"],traceback.format_exc()))
+            if (metadata.get("current") or {}).get("resource_path"):
+                blob_client = self.get_blob_client(metadata["current"]["resource_path"])
+                try:
+                    with metrics.track(DELETE):
+                        blob_client.delete_blob()
+                except:
+                    logger.error("Failed to delete the current resource({}) from blob storage.{}".format(metadata["current"]["resource_path"],traceback.format_exc()))
             #delete all history arvhives
-            for m in metadata.get("histroies") or []:
+            for m in metadata.get("histories") or []:
+                if not m.get("resource_path"):
+                    continue
                 blob_client = self.get_blob_client(m["resource_path"])
                 try:
-                    blob_client.delete_blob()
+                    with metrics.track(DELETE):
+                        blob_client.delete_blob()
                 except:
                     logger.error("Failed to delete the history resource({}) from blob storage.{}".format(m["resource_path"],traceback.format_exc()))
 
             
-        else:
+        elif metadata.get("resource_path"):
             blob_client = self.get_blob_client(metadata["resource_path"])
             try:
-                blob_client.delete_blob()
+                with metrics.track(DELETE):
+                    blob_client.delete_blob()
             except:
                 logger.error("Failed to delete the resource({}) from blob storage.{}".format(metadata["resource_path"],traceback.format_exc()))
             
@@ -424,9 +489,423 @@ class AzureBlobResourceBase(object):
         self._metadata_client.update(resourcemetadata)
         
 
-    def download_group(self,resource_group,folder=None,overwrite=False):
+    def _prune_histories(self,histories):
+        """
+        Apply the history retention policy to the history list(the latest history is the first one)
+        Return (kept histories,pruned histories)
+        """
+        if not histories or (self._max_histories is None and not self._history_days):
+            return (histories,[])
+
+        kept = histories if self._max_histories is None else histories[:self._max_histories]
+        if self._history_days:
+            earliest_publish_date = timezone.now() - timedelta(days=self._history_days)
+            kept = [m for m in kept if not m.get("publish_date") or m["publish_date"] >= earliest_publish_date]
+
+        kept_ids = set(id(m) for m in kept)
+        return (kept,[m for m in histories if id(m) not in kept_ids])
+
+    def _delete_blob(self,resource_path):
+        try:
+            with metrics.track(DELETE):
+                self.get_blob_client(resource_path).delete_blob()
+            logger.debug("Deleted the resource({}) from blob storage".format(resource_path))
+        except ResourceNotFoundError:
+            logger.debug("The resource({}) was already deleted from blob storage".format(resource_path))
+        except:
+            logger.error("Failed to delete the resource({}) from blob storage.{}".format(resource_path,traceback.format_exc()))
+
+    def _delete_blobs_in_background(self,metadatas):
+        """
+        Delete the blobs of the resources in the background
+        """
+        if not metadatas:
+            return
+        executor = get_cleanup_executor()
+        self._cleanup_futures = [f for f in self._cleanup_futures if not f.done()]
+        for m in metadatas:
+            if m.get("resource_path"):
+                self._cleanup_futures.append(executor.submit(self._delete_blob,m["resource_path"]))
+
+    def wait_for_cleanup(self):
+        """
+        Wait until all the blobs deleted in the background are deleted
+        """
+        futures = self._cleanup_futures
+        self._cleanup_futures = []
+        for f in futures:
+            f.result()
+
+    def compact_histories(self):
+        """
+        Only available for archive resource
+        Apply the history retention policy to all resources, push the compacted metadata and delete the pruned history blobs in the background
+        Return the pruned history metadata list
+        """
+        if not self._archive:
+            raise Exception("{} is not a archive resource.".format(self.resourcename))
+
+        resourcemetadata = self.resourcemetadata
+        if not resourcemetadata:
+            return []
+
+        if self.group_resource:
+            resources = [m for groupmetadata in resourcemetadata.values() for m in groupmetadata.values()]
+        else:
+            resources = list(resourcemetadata.values())
+
+        pruned = []
+        for m in resources:
+            m["histories"],pruned_histories = self._prune_histories(m.get("histories"))
+            pruned.extend(pruned_histories)
+
+        if pruned:
+            self._metadata_client.update(resourcemetadata)
+            self._delete_blobs_in_background(pruned)
+            logger.debug("Prune {} history resources from resource({})".format(len(pruned),self.resourcename))
+
+        return pruned
+
+    def _get_blob_metadatas(self,resourcemetadata):
+        """
+        Return the list of the metadata of all resource blobs, including the history blobs of archive resource
+        The resources without resource_path have no blob and are not included
+        """
+        if not resourcemetadata:
+            return []
+        result = []
+        for groupmetadata in (resourcemetadata.values() if self.group_resource else [resourcemetadata]):
+            for m in groupmetadata.values():
+                if self._archive:
+                    if m.get("current"):
+                        result.append(m["current"])
+                    result.extend(m.get("histories") or [])
+                else:
+                    result.append(m)
+        return [m for m in result if m.get("resource_path")]
+
+    def _get_source_url(self,blob_client):
+        """
+        Return the url which can be used by azure to read the blob for server side copy
+        """
+        credential = blob_client.credential
+        if credential is not None and getattr(credential,"account_key",None):
+            sas_token = generate_blob_sas(
+                blob_client.account_name,
+                blob_client.container_name,
+                blob_client.blob_name,
+                account_key=credential.account_key,
+                permission=BlobSasPermissions(read=True),
+                expiry=datetime.now(tz=dt_timezone.utc) + timedelta(hours=settings.AZURE_COPY_SAS_HOURS)
+            )
+            return "{}?{}".format(blob_client.url,sas_token)
+        else:
+            #the url already contains the sas token or the blob is public
+            return blob_client.url
+
+    def _get_copy_status(self,blob_client):
+        return blob_client.get_blob_properties().copy
+
+    def _cleanup_copies(self,copies):
+        """
+        Abort the pending copies and delete the target blobs of a failed copying
+        """
+        def _cleanup(c):
+            target_client,copy_id = c[1],c[2]
+            try:
+                if copy_id and self._get_copy_status(target_client).status == "pending":
+                    target_client.abort_copy(copy_id)
+            except ResourceNotFoundError:
+                return
+            except:
+                logger.error("Failed to abort the copy to the blob({}).{}".format(target_client.blob_name,traceback.format_exc()))
+            try:
+                with metrics.track(DELETE):
+                    target_client.delete_blob()
+            except ResourceNotFoundError:
+                pass
+            except:
+                logger.error("Failed to delete the copied blob({}).{}".format(target_client.blob_name,traceback.format_exc()))
+
+        if not copies:
+            return
+        with ThreadPoolExecutor(max_workers=settings.AZURE_LIST_WORKERS,thread_name_prefix="blob_copy") as executor:
+            list(executor.map(_cleanup,copies))
+        logger.debug("Aborted and deleted {} copied blobs of the resource({})".format(len(copies),self.resourcename))
+
+    def copy_resource(self,resource_base_path=None,container_name=None,connection_string=None,standard_blob_tier=None,delete_source=False):
+        """
+        Copy all the resource blobs to the new resource base path or container or storage account with azure server side copy,
+        the copies are started together and their progress is polled concurrently;
+        the metadata of the target resource is pushed after all copies are completed successfully.
+        The blobs in archive tier should be rehydrated before copying; if copying failed, the pending copies are aborted and the copied blobs are deleted
+        standard_blob_tier: the access tier of the copied blobs; use the default access tier if None
+        delete_source: delete the source blobs and metadata after copying, that means relocating the resource
+        Return the target resource
+        """
+        target = self.__class__(
+            self._resource_name,
+            connection_string or self._connection_string,
+            container_name or self._container_name,
+            resource_base_path=self._resource_base_path if resource_base_path is None else resource_base_path,
+            group_resource=self.group_resource,
+            archive=self._archive,
+            metaname=self._metaname,
+            max_histories=self._max_histories,
+            history_days=self._history_days
+        )
+        if target._connection_string == self._connection_string and target._container_name == self._container_name and target._resource_base_path == self._resource_base_path:
+            raise Exception("The target resource is the same as the source resource({}).".format(self.resourcename))
+
+        source_metadata = self.resourcemetadata
+        if not source_metadata:
+            raise ResourceNotFoundError("The resource({}) Not Found".format(self.resourcename))
+        resourcemetadata = copy.deepcopy(source_metadata)
+        blob_metadatas = self._get_blob_metadatas(resourcemetadata)
+        for m in blob_metadatas:
+            if not m["resource_path"].startswith(self._resource_data_path):
+                raise Exception("The resource blob({}) is not in the resource data folder({})".format(m["resource_path"],self._resource_data_path))
+
+        #the blobs in archive tier can't be copied, check the tiers before starting any copy
+        def _get_properties(m):
+            with metrics.track(METADATA_READ):
+                return self.get_blob_client(m["resource_path"]).get_blob_properties()
+        with ThreadPoolExecutor(max_workers=settings.AZURE_LIST_WORKERS,thread_name_prefix="blob_copy") as executor:
+            blob_properties = list(executor.map(_get_properties,blob_metadatas))
+        archived = [m["resource_path"] for m,p in zip(blob_metadatas,blob_properties) if p.blob_tier == "Archive"]
+        if archived:
+            raise Exception("{} blobs of the resource({}) are in archive tier, please rehydrate them before copying.{}".format(len(archived),self.resourcename,",".join(archived)))
+
+        copies = []
+        try:
+            #start all copies
+            for m in blob_metadatas:
+                source_client = self.get_blob_client(m["resource_path"])
+                m["resource_path"] = "{}{}".format(target._resource_data_path,m["resource_path"][len(self._resource_data_path):])
+                if standard_blob_tier:
+                    m["tier"] = standard_blob_tier
+                target_client = target.get_blob_client(m["resource_path"])
+                kwargs = {"metadata":get_blob_metadata(m)}
+                if standard_blob_tier:
+                    kwargs["standard_blob_tier"] = standard_blob_tier
+                with metrics.track(COPY):
+                    copy_props = target_client.start_copy_from_url(self._get_source_url(source_client),**kwargs)
+                copies.append((source_client,target_client,copy_props.get("copy_id")))
+            logger.debug("Started {} server side copies from resource({}) to {}/{}".format(len(copies),self.resourcename,target._container_name,target._resource_base_path))
+
+            #poll the copy status of all pending copies concurrently
+            pending = copies
+            with ThreadPoolExecutor(max_workers=settings.AZURE_LIST_WORKERS,thread_name_prefix="blob_copy") as executor:
+                while pending:
+                    statuses = list(executor.map(lambda c:self._get_copy_status(c[1]),pending))
+                    failed = [(c[1].blob_name,status.status,status.status_description) for c,status in zip(pending,statuses) if status.status not in ("pending","success")]
+                    if failed:
+                        raise Exception("Failed to copy the resource({}).{}".format(self.resourcename,"; ".join("{}:{} {}".format(*f) for f in failed)))
+                    pending = [c for c,status in zip(pending,statuses) if status.status == "pending"]
+                    if pending:
+                        logger.debug("{}/{} blobs of the resource({}) are still being copied".format(len(pending),len(copies),self.resourcename))
+                        time.sleep(settings.AZURE_COPY_POLL_INTERVAL)
+
+            target._metadata_client.update(resourcemetadata)
+        except:
+            self._cleanup_copies(copies)
+            raise
+        logger.debug("Copied {} blobs from resource({}) to {}/{}".format(len(copies),self.resourcename,target._container_name,target._resource_base_path))
+
+        if delete_source:
+            self._delete_blobs_in_background(self._get_blob_metadatas(source_metadata))
+            self.wait_for_cleanup()
+            self._metadata_client.delete()
+
+        return target
+
+    def relocate(self,resource_base_path=None,container_name=None,connection_string=None,standard_blob_tier=None):
+        """
+        Move the resource to the new resource base path or container or storage account with azure server side copy
+        Return the relocated resource
+        """
+        return self.copy_resource(resource_base_path=resource_base_path,container_name=container_name,connection_string=connection_string,standard_blob_tier=standard_blob_tier,delete_source=True)
+
+    def _set_blob_tier(self,resource_path,standard_blob_tier,rehydrate_priority=None):
+        kwargs = {"rehydrate_priority":rehydrate_priority} if rehydrate_priority else {}
+        with metrics.track(SET_TIER):
+            self.get_blob_client(resource_path).set_standard_blob_tier(standard_blob_tier,**kwargs)
+
+    def set_tier(self,standard_blob_tier,resource_group=None,resourceid=None,f_filter=None):
+        """
+        Set the access tier of the resource blobs(including the history blobs of archive resource), and record the tier in the metadata
+        resource_group,resourceid: only set the tier of the specified resource group or resource; set the tier of all resource blobs if both are None
+        f_filter: a function to choose the resource blobs, has one parameter "metadata"
+        Return the metadata list of the changed blobs
+        Use method 'rehydrate' to move the blobs out of 'Archive' tier
+        """
+        resourcemetadata = self.resourcemetadata
+        if resourceid or resource_group:
+            metadata = self.get_metadata(resourceid=resourceid,resource_group=resource_group,resource_file=None,throw_exception=True)
+            if resourceid:
+                scope = {resource_group:{resourceid:metadata}} if self.group_resource else {resourceid:metadata}
+            else:
+                scope = {resource_group:metadata}
+        else:
+            scope = resourcemetadata
+
+        blob_metadatas = [m for m in self._get_blob_metadatas(scope) if m.get("tier") != standard_blob_tier and (not f_filter or f_filter(m))]
+        if not blob_metadatas:
+            return []
+
+        with ThreadPoolExecutor(max_workers=settings.AZURE_LIST_WORKERS,thread_name_prefix="blob_tier") as executor:
+            list(executor.map(lambda m:self._set_blob_tier(m["resource_path"],standard_blob_tier),blob_metadatas))
+
+        for m in blob_metadatas:
+            m["tier"] = standard_blob_tier
+        self._metadata_client.update(resourcemetadata)
+        logger.debug("Set the access tier of {} blobs of the resource({}) to {}".format(len(blob_metadatas),self.resourcename,standard_blob_tier))
+        return blob_metadatas
+
+    def rehydrate(self,metadatas,standard_blob_tier="Hot",rehydrate_priority=None,timeout=0):
+        """
+        Make sure the blobs of the resources are online before downloading them.
+        Start the rehydration of all archived blobs at once, then poll them together until all are rehydrated or timeout
+        metadatas: the metadata list of the resource blobs
+        timeout: the maximum seconds to wait for rehydration; don't wait if 0; wait until rehydrated if None
+        Return the number of blobs which are still being rehydrated
+        """
+        metadatas = [m for m in metadatas if m.get("resource_path")]
+        if not metadatas:
+            return 0
+
+        def _get_properties(m):
+            with metrics.track(METADATA_READ):
+                return self.get_blob_client(m["resource_path"]).get_blob_properties()
+
+        started = time.monotonic()
+        archived_ids = set()
+        pending = metadatas
+        with ThreadPoolExecutor(max_workers=settings.AZURE_LIST_WORKERS,thread_name_prefix="blob_rehydrate") as executor:
+            while True:
+                blob_properties = list(executor.map(_get_properties,pending))
+                archived = [m for m,p in zip(pending,blob_properties) if p.blob_tier == "Archive" and not p.archive_status]
+                if archived:
+                    #start the rehydration of all archived blobs at once
+                    list(executor.map(lambda m:self._set_blob_tier(m["resource_path"],standard_blob_tier,rehydrate_priority=rehydrate_priority or settings.AZURE_REHYDRATE_PRIORITY),archived))
+                    logger.debug("Start to rehydrate {} blobs of the resource({})".format(len(archived),self.resourcename))
+
+                pending = [m for m,p in zip(pending,blob_properties) if p.blob_tier == "Archive"]
+                archived_ids.update(id(m) for m in pending)
+                if not pending:
+                    break
+                if timeout is not None and time.monotonic() - started + settings.AZURE_REHYDRATE_POLL_INTERVAL > timeout:
+                    break
+                logger.debug("{} blobs of the resource({}) are being rehydrated".format(len(pending),self.resourcename))
+                time.sleep(settings.AZURE_REHYDRATE_POLL_INTERVAL)
+
+        #record the tier of the rehydrated blobs
+        pending_ids = set(id(m) for m in pending)
+        rehydrated = [m for m in metadatas if id(m) in archived_ids and id(m) not in pending_ids]
+        if rehydrated:
+            for m in rehydrated:
+                m["tier"] = standard_blob_tier
+            self._metadata_client.update(self.resourcemetadata)
+
+        return len(pending)
+
+    def _list_blobs(self,prefix):
+        """
+        Return the list of blobs(with custom metadata) whose name starts with prefix
+        """
+        with metrics.track(METADATA_READ):
+            return list(self.get_container_client().list_blobs(name_starts_with=prefix,include=["metadata"]))
+
+    def _get_resource_metadata_from_blob(self,blob,resource_group,f_resource_metadata=None):
+        """
+        Return the resource metadata from blob properties and blob's custom metadata
+        Return None if the resource metadata can't be populated
+        """
+        resource_file = blob.name[blob.name.rfind("/") + 1:]
+        data = (blob.metadata or {}).get(BLOB_METADATA_KEY)
+        if data:
+            metadata = json.loads(data,cls=JSONDecoder)
+        elif f_resource_metadata:
+            metadata = f_resource_metadata(blob.name,resource_group,resource_file)
+            if not metadata:
+                return None
+        else:
+            metadata = {"resource_id":os.path.splitext(resource_file)[0]}
+
+        metadata["resource_file"] = resource_file
+        metadata["resource_path"] = blob.name
+        metadata["resource_group"] = resource_group
+        if not metadata.get("publish_date"):
+            metadata["publish_date"] = timezone.nativetime(blob.last_modified)
+        if not metadata.get("file_md5") and blob.content_settings and blob.content_settings.content_md5:
+            metadata["file_md5"] = bytes(blob.content_settings.content_md5).hex()
+
+        return metadata
+
+    def rebuild_metadata(self,f_resource_metadata=None,f_post_rebuild=None,dry_run=False):
+        """
+        Rebuild the resource metadata from the blobs' properties and custom metadata, the blob data is not downloaded.
+        The blobs of each resource group are listed concurrently.
+        f_resource_metadata: a function to populate the resource metadata for the blob without custom metadata, has three parameters "blob_name","resource_group" and "resource_file", return None to ignore the blob
+        f_post_rebuild: a function to complete the rebuilt resource metadata before pushing it, has one parameter "resourcemetadata"
+        dry_run: if True, don't push the rebuilt metadata to storage
+        Return the rebuilt resource metadata
+        """
+        prefix = "{}/".format(self._resource_data_path)
+        if self.group_resource:
+            with metrics.track(METADATA_READ):
+                group_prefixes = [p.name for p in self.get_container_client().walk_blobs(name_starts_with=prefix,delimiter="/") if isinstance(p,BlobPrefix)]
+        else:
+            group_prefixes = [prefix]
+
+        with ThreadPoolExecutor(max_workers=settings.AZURE_LIST_WORKERS,thread_name_prefix="blob_list") as executor:
+            group_blobs = list(executor.map(self._list_blobs,group_prefixes))
+
+        resourcemetadata = {}
+        for group_prefix,blobs in zip(group_prefixes,group_blobs):
+            resource_group = group_prefix[len(prefix):].rstrip("/") if self.group_resource else None
+            groupmetadata = {}
+            for blob in blobs:
+                if "/" in blob.name[len(group_prefix):]:
+                    #not a resource blob
+                    continue
+                metadata = self._get_resource_metadata_from_blob(blob,resource_group,f_resource_metadata=f_resource_metadata)
+                if not metadata:
+                    logger.warning("Ignore the blob({}), can't populate its resource metadata".format(blob.name))
+                    continue
+                groupmetadata.setdefault(metadata["resource_id"],[]).append(metadata)
+
+            if not groupmetadata:
+                continue
+
+            for resourceid,metadatas in groupmetadata.items():
+                #the latest resource is the first one
+                metadatas.sort(key=lambda m:m["publish_date"],reverse=True)
+                if self._archive:
+                    groupmetadata[resourceid] = {"current":metadatas[0],"histories":metadatas[1:]}
+                else:
+                    if len(metadatas) > 1:
+                        logger.warning("Found {} blobs for the resource({}), only the latest one({}) is used".format(len(metadatas),resourceid,metadatas[0]["resource_path"]))
+                    groupmetadata[resourceid] = metadatas[0]
+
+            if self.group_resource:
+                resourcemetadata[resource_group] = groupmetadata
+            else:
+                resourcemetadata = groupmetadata
+
+        if f_post_rebuild:
+            f_post_rebuild(resourcemetadata)
+
+        if not dry_run:
+            self._metadata_client.update(resourcemetadata)
+            logger.debug("Rebuilt the metadata of the resource({}) from {} blobs".format(self.resourcename,sum(len(blobs) for blobs in group_blobs)))
+
+        return resourcemetadata
+
+    def download_group(self,resource_group,folder=None,overwrite=False,f_filter=None):
         """
         Only available for group resource
+        f_filter: only download the resources whose metadata match the filter if not None
         """
         if not self.group_resource:
             raise Exception("{} is not a group resource.".format(self.resourcename))
@@ -454,9 +933,12 @@ class AzureBlobResourceBase(object):
                 metadata = metadata.get("current")
             if not metadata:
                 continue
+            if f_filter and not f_filter(metadata):
+                continue
             if metadata.get("resource_file") and metadata.get("resource_path"):
                 with open(os.path.join(folder,metadata["resource_file"]),'wb') as f:
-                    self.get_blob_client(metadata["resource_path"]).download_blob().readinto(f)
+                    with metrics.track(DOWNLOAD) as tracker:
+                        tracker.bytes = self.get_blob_client(metadata["resource_path"]).download_blob().readinto(f)
 
         return (groupmetadata,folder)
 
@@ -481,7 +963,8 @@ class AzureBlobResourceBase(object):
                 filename = f.name
 
         with open(filename,'wb') as f:
-            self.get_blob_client(metadata["resource_path"]).download_blob().readinto(f)
+            with metrics.track(DOWNLOAD) as tracker:
+                tracker.bytes = self.get_blob_client(metadata["resource_path"]).download_blob().readinto(f)
 
         return (metadata,filename)
 
@@ -501,10 +984,12 @@ class AzureBlobResource(AzureBlobResourceBase,ResourceStorage):
 
     """
 
-    def push_resource(self,data,metadata=None,f_post_push=None,length=None):
+    def push_resource(self,data,metadata=None,f_post_push=None,length=None,f_update_metadata=None):
         """
         Push the resource to the storage
         f_post_push: a function to call after pushing resource to blob container but before pushing the metadata, has one parameter "metadata"
+        f_update_metadata: a function to change the other resources' metadata in the same metadata update, has one parameter "resourcemetadata",
+            return the list of the resources' metadata whose blobs should be deleted after the metadata is updated
         Return the new resourcemetadata.
         """
         #populute the latest resource metadata
@@ -555,15 +1040,19 @@ class AzureBlobResource(AzureBlobResourceBase,ResourceStorage):
             groupmetadata[resourceid] = currentmetadata
 
 
+        pruned_histories = None
         if self._archive:
             if "histories" not in currentmetadata:
                 currentmetadata["histories"] = []
             if currentmetadata.get("current"):
                 currentmetadata["histories"].insert(0,currentmetadata["current"])
+            #apply the retention policy to keep the metadata size roughly constant
+            currentmetadata["histories"],pruned_histories = self._prune_histories(currentmetadata["histories"])
 
         #push the resource to azure storage
         blob_client = self.get_blob_client(resource_path)
-        blob_client.upload_blob(data,blob_type=BlobType.BlockBlob,overwrite=True,timeout=3600,max_concurrency=5,length=length)
+        with metrics.track(UPLOAD,length or (len(data) if isinstance(data,(bytes,str)) else 0)):
+            blob_client.upload_blob(data,blob_type=BlobType.BlockBlob,overwrite=True,timeout=3600,max_concurrency=5,length=length,metadata=get_blob_metadata(metadata))
         #update the resource metadata
         if f_post_push:
             f_post_push(metadata)
@@ -573,7 +1062,14 @@ class AzureBlobResource(AzureBlobResourceBase,ResourceStorage):
         else:
             currentmetadata.update(metadata)
 
+        #the pushed resource and the changes of the other resources are saved in one metadata update
+        superseded = f_update_metadata(resourcemetadata) if f_update_metadata else None
+
         self._metadata_client.update(resourcemetadata)
 
+        #delete the pruned history blobs and the superseded blobs after the metadata no longer references them
+        self._delete_blobs_in_background(pruned_histories)
+        self._delete_blobs_in_background(superseded)
+
         return resourcemetadata
         
@@ -0,0 +1,171 @@
+import json
+import os
+import threading
+import time
+import logging
+from contextlib import contextmanager
+
+from . import settings
+
+logger = logging.getLogger(__name__)
+
+#the upper bounds(seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.01,0.05,0.1,0.25,0.5,1,2.5,5,10,30,60,300,float("inf"))
+
+#the storage operations which are tracked
+UPLOAD = "upload"
+DOWNLOAD = "download"
+METADATA_READ = "metadata_read"
+METADATA_WRITE = "metadata_write"
+DELETE = "delete"
+COPY = "copy"
+SET_TIER = "set_tier"
+
+class OperationMetrics(object):
+    """
+    The counters of one storage operation
+    """
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.bytes = 0
+        self.seconds = 0.0
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+
+    def observe(self,seconds,nbytes=0,failed=False):
+        self.count += 1
+        self.seconds += seconds
+        self.bytes += nbytes or 0
+        if failed:
+            self.errors += 1
+        for i,bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                self.buckets[i] += 1
+                break
+
+    def as_dict(self):
+        """
+        Return the counters as dict object, the histogram buckets are cumulative
+        """
+        buckets = {}
+        total = 0
+        for bound,count in zip(LATENCY_BUCKETS,self.buckets):
+            total += count
+            buckets["+Inf" if bound == float("inf") else str(bound)] = total
+        return {
+            "count":self.count,
+            "errors":self.errors,
+            "bytes":self.bytes,
+            "seconds":self.seconds,
+            "buckets":buckets
+        }
+
+class _Tracker(object):
+    """
+    Returned by StorageMetrics.track, the caller can set the transferred bytes
+    """
+    def __init__(self,nbytes=0):
+        self.bytes = nbytes
+
+class StorageMetrics(object):
+    """
+    A thread safe in-process registry of the storage operation counters
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._operations = {}
+
+    def record(self,operation,seconds,nbytes=0,failed=False):
+        with self._lock:
+            metrics = self._operations.get(operation)
+            if metrics is None:
+                metrics = OperationMetrics()
+                self._operations[operation] = metrics
+            metrics.observe(seconds,nbytes=nbytes,failed=failed)
+
+    @contextmanager
+    def track(self,operation,nbytes=0,expected=()):
+        """
+        Track the latency of the operation executed in the with block; the operation is recorded as failed if an exception is raised
+        expected: the exception types which are part of the normal flow(for example resource not found) and are not recorded as errors
+        """
+        tracker = _Tracker(nbytes)
+        failed = False
+        start = time.monotonic()
+        try:
+            yield tracker
+        except expected:
+            raise
+        except:
+            failed = True
+            raise
+        finally:
+            self.record(operation,time.monotonic() - start,nbytes=tracker.bytes,failed=failed)
+
+    def snapshot(self):
+        """
+        Return a dict between operation and its counters
+        """
+        with self._lock:
+            return dict((operation,metrics.as_dict()) for operation,metrics in self._operations.items())
+
+    def reset(self):
+        with self._lock:
+            self._operations.clear()
+
+    def to_prometheus(self):
+        """
+        Return the counters with prometheus text exposition format
+        """
+        snapshot = self.snapshot()
+        lines = []
+        for name,key,mtype,help_text in (
+            ("storage_operations_total","count","counter","The number of storage operations"),
+            ("storage_operation_errors_total","errors","counter","The number of failed storage operations"),
+            ("storage_operation_bytes_total","bytes","counter","The bytes transferred by storage operations")
+        ):
+            lines.append("# HELP {} {}".format(name,help_text))
+            lines.append("# TYPE {} {}".format(name,mtype))
+            for operation,metrics in sorted(snapshot.items()):
+                lines.append("{}{{operation=\"{}\"}} {}".format(name,operation,metrics[key]))
+
+        name = "storage_operation_duration_seconds"
+        lines.append("# HELP {} The latency of storage operations".format(name))
+        lines.append("# TYPE {} histogram".format(name))
+        for operation,metrics in sorted(snapshot.items()):
+            for bound,count in metrics["buckets"].items():
+                lines.append("{}_bucket{{operation=\"{}\",le=\"{}\"}} {}".format(name,operation,bound,count))
+            lines.append("{}_sum{{operation=\"{}\"}} {}".format(name,operation,metrics["seconds"]))
+            lines.append("{}_count{{operation=\"{}\"}} {}".format(name,operation,metrics["count"]))
+
+        lines.append("")
+        return "\n".join(lines)
+
+    def dump(self,filename):
+        """
+        Dump the counters to file, json format if file extension is '.json'; otherwise prometheus text format
+        The file is replaced atomically, so it can be used as a prometheus textfile
+        """
+        if os.path.splitext(filename)[1].lower() == ".json":
+            data = json.dumps(self.snapshot(),indent="    ")
+        else:
+            data = self.to_prometheus()
+
+        tmp_filename = "{}.tmp".format(filename)
+        with open(tmp_filename,"w") as f:
+            f.write(data)
+        os.replace(tmp_filename,filename)
+        logger.debug("Dump storage metrics to {}".format(filename))
+
+metrics = StorageMetrics()
+
+def dump_metrics():
+    """
+    Dump the storage metrics to the configured file, do nothing if not configured
+    """
+    if not settings.STORAGE_METRICS_FILE:
+        return
+    try:
+        metrics.dump(settings.STORAGE_METRICS_FILE)
+    except:
+        logger.error("Failed to dump storage metrics to {}".format(settings.STORAGE_METRICS_FILE),exc_info=True)
@@ -6,3 +6,22 @@ for key,ekey,vtype in [("max_single_put_size","AZURE_MAX_SINGLE_PUT_SIZE",int),(
     if val is None:
         continue
     AZURE_BLOG_CLIENT_KWARGS[key] = val
+
+#the file to dump the storage operation metrics at the end of each command; json format if file extension is '.json', otherwise prometheus textfile
+STORAGE_METRICS_FILE = env("STORAGE_METRICS_FILE",vtype=str)
+
+#the number of threads to delete the pruned history blobs in the background
+AZURE_CLEANUP_WORKERS = env("AZURE_CLEANUP_WORKERS",default=4)
+
+#the number of threads to list the blobs concurrently
+AZURE_LIST_WORKERS = env("AZURE_LIST_WORKERS",default=8)
+
+#the interval(seconds) to poll the status of the server side copies
+AZURE_COPY_POLL_INTERVAL = env("AZURE_COPY_POLL_INTERVAL",default=5)
+#the lifetime(hours) of the sas token used by server side copy to read the source blob
+AZURE_COPY_SAS_HOURS = env("AZURE_COPY_SAS_HOURS",default=24)
+
+#the rehydrate priority to move the blobs out of archive tier, "Standard" or "High"
+AZURE_REHYDRATE_PRIORITY = env("AZURE_REHYDRATE_PRIORITY",default="Standard")
+#the interval(seconds) to poll the status of the rehydrating blobs
+AZURE_REHYDRATE_POLL_INTERVAL = env("AZURE_REHYDRATE_POLL_INTERVAL",default=300)
@@ -90,10 +90,12 @@ class ResourceStorage(object):
         finally:
             os.remove(filename)
 
-    def push_resource(self,data,metadata=None,f_post_push=None,length=None):
+    def push_resource(self,data,metadata=None,f_post_push=None,length=None,f_update_metadata=None):
         """
         Push the resource to the storage
         f_post_push: a function to call after pushing resource to blob container but before pushing the metadata, has one parameter "metadata"
+        f_update_metadata: a function to change the other resources' metadata in the same metadata update, has one parameter "resourcemetadata",
+            return the list of the resources' metadata whose files should be deleted after the metadata is updated
         Return the new resourcemetadata.
         """
         raise NotImplementedError("Method 'push_resource' is not implemented.")
@@ -107,12 +109,13 @@ class ResourceStorage(object):
         """
         return self.push_resource(json.dumps(obj,cls=JSONEncoder).encode(),metadata=metadata,f_post_push=f_post_push)
 
-    def push_file(self,filename,metadata=None,f_post_push=None):
+    def push_file(self,filename,metadata=None,f_post_push=None,f_update_metadata=None):
         """
         Push the resource from file to the storage
         f_post_push: a function to call after pushing resource to blob container but before pushing the metadata, has one parameter "metadata"
+        f_update_metadata: a function to change the other resources' metadata in the same metadata update, see push_resource
         Return the new resourcemetadata.
         """
         file_length = file_size(filename)
         with open(filename,'rb') as f:
-            return self.push_resource(f,metadata=metadata,f_post_push=f_post_push,length=file_length)
+            return self.push_resource(f,metadata=metadata,f_post_push=f_post_push,length=file_length,f_update_metadata=f_update_metadata)
@@ -0,0 +1,73 @@
+import json
+import unittest
+from datetime import datetime
+
+from resource_tracking import catalog
+
+def _stats(features,seen,extent,velocity,altitude,devices,source_device_types):
+    return {
+        "features":features,
+        "seen":seen,
+        "extent":extent,
+        "velocity":velocity,
+        "altitude":altitude,
+        "devices":devices,
+        "source_device_types":source_device_types
+    }
+
+class MergeStatsTest(unittest.TestCase):
+    def test_no_stats(self):
+        self.assertIsNone(catalog.merge_stats([]))
+        self.assertIsNone(catalog.merge_stats([None,None]))
+
+    def test_merge(self):
+        stats1 = _stats(3,[100,200],[115.0,-32.0,116.0,-31.0],[0.0,50.0],[None,None],{"d1":2,"d2":1},{"iriditrak":3})
+        stats2 = _stats(2,[150,300],[114.0,-31.5,115.5,-30.0],[None,None],[10.0,20.0],{"d2":1,"d3":1},{"iriditrak":1,"dplus":1})
+        result = catalog.merge_stats([stats1,None,stats2])
+        self.assertEqual(result,_stats(5,[100,300],[114.0,-32.0,116.0,-30.0],[0.0,50.0],[10.0,20.0],{"d1":2,"d2":2,"d3":1},{"iriditrak":4,"dplus":1}))
+        #the source statistics are not changed
+        self.assertEqual(stats1["devices"],{"d1":2,"d2":1})
+
+    def test_round_trip(self):
+        stats = _stats(1,[100,100],[115.0,-32.0,115.0,-32.0],[1.5,1.5],[2.0,2.0],{"d1":1},{"":1})
+        self.assertEqual(catalog.merge_stats([catalog.read_stats(json.dumps(stats))]),stats)
+
+class QueryTest(unittest.TestCase):
+    def setUp(self):
+        self.metadatas = [
+            {
+                "resource_id":"loggedpoint20200102",
+                "start_archive_date":datetime(2020,1,2),
+                "end_archive_date":datetime(2020,1,3),
+                "features":1,
+                "stats":_stats(1,[100,100],[115.0,-32.0,115.0,-32.0],[1.5,1.5],[2.0,2.0],{"d1":1},{"iriditrak":1})
+            },
+            {
+                "resource_id":"loggedpoint20200101",
+                "start_archive_date":datetime(2020,1,1),
+                "end_archive_date":datetime(2020,1,2),
+                "features":2
+            }
+        ]
+
+    def test_order_and_date_range(self):
+        self.assertEqual([r["archive_id"] for r in catalog.query(self.metadatas)],["loggedpoint20200101","loggedpoint20200102"])
+        self.assertEqual([r["archive_id"] for r in catalog.query(self.metadatas,start_date=datetime(2020,1,2))],["loggedpoint20200102"])
+        self.assertEqual([r["archive_id"] for r in catalog.query(self.metadatas,end_date=datetime(2020,1,2))],["loggedpoint20200101"])
+
+    def test_archive_without_stats(self):
+        row = catalog.query(self.metadatas,end_date=datetime(2020,1,2))[0]
+        self.assertEqual(row["features"],2)
+        self.assertIsNone(row["devices"])
+        self.assertIsNone(row["extent"])
+
+    def test_device_filter(self):
+        result = catalog.query(self.metadatas,deviceid="d1")
+        self.assertEqual([(r["archive_id"],r["device_features"]) for r in result],[("loggedpoint20200101",None),("loggedpoint20200102",1)])
+        self.assertEqual([r["archive_id"] for r in catalog.query(self.metadatas,deviceid="d2")],["loggedpoint20200101"])
+
+    def test_source_device_type_filter(self):
+        self.assertEqual([r["archive_id"] for r in catalog.query(self.metadatas,source_device_type="dplus")],["loggedpoint20200101"])
+
+if __name__ == "__main__":
+    unittest.main()
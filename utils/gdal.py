@@ -1,6 +1,16 @@
 import re
 import os
+import struct
+import sqlite3
+import threading
 import subprocess
+import collections
+from urllib.request import pathname2url
+
+try:
+    from osgeo import ogr
+except ImportError:
+    ogr = None
 
 def detect_epsg(filename):
     gdal_cmd = ['gdalsrsinfo', '-e', filename]
@@ -19,26 +29,16 @@ layer_re = re.compile("[\r\n]+Layer name:")
 layer_info_re = re.compile("[\r\n]+(?P<key>[a-zA-Z0-9_\-][a-zA-Z0-9_\- ]*)[ \t]*[:=](?P<value>[^\r\n]*([\r\n]+(([ \t]+[^\r\n]*)|(GEOGCS[^\r\n]*)))*)")
 extent_re = re.compile("\s*\(\s*(?P<minx>-?[0-9\.]+)\s*\,\s*(?P<miny>-?[0-9\.]+)\s*\)\s*\-\s*\(\s*(?P<maxx>-?[0-9\.]+)\s*\,\s*(?P<maxy>-?[0-9\.]+)\s*\)\s*")
 field_re = re.compile("[ \t]*(?P<type>[a-zA-Z0-9]+)[ \t]*(\([ \t]*(?P<width>[0-9]+)\.(?P<precision>[0-9]+)\))?[ \t]*")
-def get_layers(datasource,layer=None):
+def _get_layers_by_ogrinfo(datasource,layer=None):
     """
-    Get layers' meta data from spatial data file
-    layer: only get the specified layer from spatial data file; if none, get all layers 
-    Return a list of layer's metadata
-       fields: a list of fields
-       features: the number of features
-       extent: the extent of the layer
-       fid_column: the feature id column
-       geometry_column: the geometry column
+    Get layers' meta data by parsing the output of ogrinfo
     """
     # needs gdal 1.10+
-    infoIter = None
-
     folder,filename = os.path.split(datasource)
-    #import ipdb;ipdb.set_trace()
-    cmd = "cd {0} && ogrinfo -al -so -ro {1}".format(folder,filename)
+    cmd = "cd {0} && ogrinfo -al -so -ro {1}".format(folder or ".",filename)
 
     if layer:
-        cmd.append(layer)
+        cmd = "{} {}".format(cmd,layer)
 
     def getLayerInfo(layerInfo):
         info = {"fields":[]}
@@ -86,11 +86,316 @@ def get_layers(datasource,layer=None):
 
     return layers
 
+#the columns of the gpkg contents table: table name, extent
+gpkg_contents_sql = "SELECT table_name,min_x,min_y,max_x,max_y FROM gpkg_contents WHERE data_type = 'features'"
+#the geometry column, geometry type of the gpkg feature tables
+gpkg_geometry_columns_sql = "SELECT table_name,column_name,geometry_type_name FROM gpkg_geometry_columns"
+
+def _quote(name):
+    return "\"{}\"".format(name.replace("\"","\"\""))
+
+def _sqlite_table_exists(conn,table):
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE name = ?",(table,)).fetchone() is not None
+
+_gpkg_field_type_re = re.compile("^(?P<type>[a-zA-Z0-9]+)\s*(\(\s*(?P<width>[0-9]+)\s*\))?")
+#map the gpkg column type to the ogr field type
+_gpkg_field_types = {
+    "INTEGER":"Integer64",
+    "INT":"Integer64",
+    "MEDIUMINT":"Integer",
+    "SMALLINT":"Integer(Int16)",
+    "TINYINT":"Integer(Int16)",
+    "BOOLEAN":"Integer(Boolean)",
+    "DOUBLE":"Real",
+    "REAL":"Real",
+    "FLOAT":"Real(Float32)",
+    "TEXT":"String",
+    "BLOB":"Binary",
+    "DATE":"Date",
+    "DATETIME":"DateTime"
+}
+
+def _get_gpkg_layers(datasource,layer=None):
+    """
+    Get layers' meta data from the gpkg sqlite tables directly
+    """
+    conn = sqlite3.connect("file:{}?mode=ro".format(pathname2url(os.path.abspath(datasource))),uri=True)
+    try:
+        geometry_columns = dict((row[0],(row[1],row[2])) for row in conn.execute(gpkg_geometry_columns_sql))
+        layers = []
+        for table,minx,miny,maxx,maxy in conn.execute(gpkg_contents_sql).fetchall():
+            if layer and table != layer:
+                continue
+            info = {"fields":[],"layer":table}
+            geometry_column,geometry_type = geometry_columns.get(table,(None,None))
+            if geometry_column:
+                info["geometry_column"] = geometry_column
+                info["geometry"] = geometry_type.replace(" ","").upper()
+                #the extent in gpkg_contents is maintained by gdal, scan the rtree index only if it is missing
+                rtree = "rtree_{}_{}".format(table,geometry_column)
+                if minx is None and _sqlite_table_exists(conn,rtree):
+                    row = conn.execute("SELECT min(minx),min(miny),max(maxx),max(maxy) FROM {}".format(_quote(rtree))).fetchone()
+                    if row[0] is not None:
+                        minx,miny,maxx,maxy = row
+            if minx is not None:
+                info["extent"] = [float(minx),float(miny),float(maxx),float(maxy)]
+
+            #the feature count maintained by gdal
+            features = None
+            if _sqlite_table_exists(conn,"gpkg_ogr_contents"):
+                row = conn.execute("SELECT feature_count FROM gpkg_ogr_contents WHERE lower(table_name) = lower(?)",(table,)).fetchone()
+                features = row[0] if row else None
+            if features is None:
+                features = conn.execute("SELECT count(*) FROM {}".format(_quote(table))).fetchone()[0]
+            info["features"] = features
+
+            for cid,name,column_type,notnull,default,pk in conn.execute("PRAGMA table_info({})".format(_quote(table))):
+                if pk:
+                    info["fid_column"] = name
+                    continue
+                if name == geometry_column:
+                    continue
+                m = _gpkg_field_type_re.search(column_type or "")
+                ftype = m.group("type").upper() if m else "TEXT"
+                info["fields"].append([name.lower(),_gpkg_field_types.get(ftype,"String"),m.group("width") if m else None,None])
+            layers.append(info)
+        return layers
+    finally:
+        conn.close()
+
+def _get_ogr_layers(datasource,layer=None):
+    """
+    Get layers' meta data with gdal python bindings
+    """
+    ds = ogr.Open(datasource)
+    if ds is None:
+        raise Exception("Failed to open the datasource({})".format(datasource))
+    layers = []
+    for i in range(ds.GetLayerCount()):
+        lyr = ds.GetLayerByIndex(i)
+        if layer and lyr.GetName() != layer:
+            continue
+        info = {"fields":[],"layer":lyr.GetName()}
+        info["features"] = lyr.GetFeatureCount()
+        if lyr.GetGeomType() != ogr.wkbNone:
+            info["geometry"] = ogr.GeometryTypeToName(lyr.GetGeomType()).replace(" ","").upper()
+            try:
+                minx,maxx,miny,maxy = lyr.GetExtent()
+                info["extent"] = [minx,miny,maxx,maxy]
+            except:
+                pass
+        if lyr.GetFIDColumn():
+            info["fid_column"] = lyr.GetFIDColumn()
+        if lyr.GetGeometryColumn():
+            info["geometry_column"] = lyr.GetGeometryColumn()
+        defn = lyr.GetLayerDefn()
+        for j in range(defn.GetFieldCount()):
+            field = defn.GetFieldDefn(j)
+            info["fields"].append([
+                field.GetName().lower(),
+                field.GetFieldTypeName(field.GetType()),
+                str(field.GetWidth()) if field.GetWidth() else None,
+                str(field.GetPrecision()) if field.GetWidth() else None
+            ])
+        layers.append(info)
+    return layers
+
+def create_gpkg_indexes(datasource,layer,columns):
+    """
+    Create the b-tree indexes on the columns of the gpkg layer, and analyze the gpkg file to let sqlite choose the indexes
+    Return a dict of the indexes in the layer
+        spatial: the rtree index of the geometry column; None if not have
+        btree: the list of the indexed columns
+    """
+    conn = sqlite3.connect(datasource)
+    try:
+        btree = []
+        for column in columns:
+            conn.execute("CREATE INDEX IF NOT EXISTS {} ON {} ({})".format(_quote("idx_{}_{}".format(layer,column)),_quote(layer),_quote(column)))
+            btree.append(column)
+        conn.execute("ANALYZE")
+        conn.commit()
+        row = conn.execute("SELECT column_name FROM gpkg_geometry_columns WHERE table_name = ?",(layer,)).fetchone()
+        spatial = "rtree_{}_{}".format(layer,row[0]) if row else None
+        if spatial and not _sqlite_table_exists(conn,spatial):
+            spatial = None
+        return {"spatial":spatial,"btree":btree}
+    finally:
+        conn.close()
+
+#the size of the envelope in the gpkg geometry header, indexed by the envelope indicator
+_gpkg_envelope_sizes = (0,32,48,48,64)
+
+def gpkg_geometry_to_wkb(data):
+    """
+    Strip the gpkg geometry header and return the standard wkb of the gpkg geometry blob
+    """
+    if data is None:
+        return None
+    data = bytes(data)
+    if data[:2] != b"GP":
+        raise Exception("Not a gpkg geometry blob")
+    envelope = (data[3] >> 1) & 0x07
+    if envelope >= len(_gpkg_envelope_sizes):
+        raise Exception("Invalid envelope indicator({}) in the gpkg geometry blob".format(envelope))
+    return data[8 + _gpkg_envelope_sizes[envelope]:]
+
+def wkb_linestring_coordinates(wkb):
+    """
+    Return the coordinates of the 2D wkb linestring as a list of [x,y]
+    """
+    byteorder = "<" if wkb[0] == 1 else ">"
+    geometry_type,npoints = struct.unpack_from("{}II".format(byteorder),wkb,1)
+    if geometry_type != 2:
+        raise Exception("Only support 2D linestring, but the wkb geometry type is {}".format(geometry_type))
+    values = struct.unpack_from("{}{}d".format(byteorder,npoints * 2),wkb,9)
+    return [[values[i],values[i + 1]] for i in range(0,len(values),2)]
+
+def query_gpkg(datasource,layer,columns,where=None,params=None):
+    """
+    Return a generator which yields the features of the gpkg layer as (the list of column values,wkb geometry) with sqlite directly
+    columns: the list of the non geometry columns
+    where: the optional sqlite where clause with '?' placeholders
+    """
+    conn = sqlite3.connect("file:{}?mode=ro".format(pathname2url(os.path.abspath(datasource))),uri=True)
+    try:
+        row = conn.execute("SELECT column_name FROM gpkg_geometry_columns WHERE table_name = ?",(layer,)).fetchone()
+        if not row:
+            raise Exception("Layer({}) is not found in datasource({})".format(layer,datasource))
+        sql = "SELECT {},{} FROM {}".format(",".join(_quote(c) for c in columns),_quote(row[0]),_quote(layer))
+        if where:
+            sql = "{} WHERE {}".format(sql,where)
+        for row in conn.execute(sql,params or ()):
+            yield (list(row[:-1]),gpkg_geometry_to_wkb(row[-1]))
+    finally:
+        conn.close()
+
+def convert(datasource,target,layer=None,target_layer=None,driver="GPKG",where=None,layer_options=None):
+    """
+    Convert the layer of the datasource into the target file with ogr2ogr, the feature ids are preserved
+    layer: the source layer; the first layer if None
+    target_layer: the layer name in the target file; same as the source layer if None
+    where: the optional attribute filter
+    """
+    cmd = ["ogr2ogr","-overwrite","-preserve_fid","-f",driver]
+    if target_layer:
+        cmd.extend(["-nln",target_layer])
+    if where:
+        cmd.extend(["-where",where])
+    for o in layer_options or []:
+        cmd.extend(["-lco",o])
+    cmd.extend([target,datasource])
+    if layer:
+        cmd.append(layer)
+    subprocess.check_call(cmd)
+
+def create_gpkg_spatial_index(datasource,layer):
+    """
+    Create the rtree index of the gpkg layer with ogrinfo, the rtree triggers rely on the spatial functions of gdal
+    """
+    row = None
+    conn = sqlite3.connect(datasource)
+    try:
+        row = conn.execute("SELECT column_name FROM gpkg_geometry_columns WHERE table_name = ?",(layer,)).fetchone()
+    finally:
+        conn.close()
+    if not row:
+        return None
+    subprocess.check_call(["ogrinfo","-q",datasource,"-sql","SELECT CreateSpatialIndex('{}','{}')".format(layer,row[0])])
+    return "rtree_{}_{}".format(layer,row[0])
+
+def merge_gpkg_layers(sources,target,layer):
+    """
+    Append the features of the gpkg source layers into the existing empty gpkg layer with sqlite directly, the feature ids are preserved
+    The gpkg table is clustered by the feature id, so the merged features are stored in feature id order
+    The target layer should not have the spatial index, which can be created after merging
+    sources: the list of (gpkg file,layer)
+    Return the number of merged features
+    """
+    conn = sqlite3.connect(target)
+    try:
+        table_info = conn.execute("PRAGMA table_info({})".format(_quote(layer))).fetchall()
+        columns = [row[1] for row in table_info]
+        fid_column = next((row[1] for row in table_info if row[5]),columns[0])
+        staging = "{}_merging".format(layer)
+        conn.execute("DROP TABLE IF EXISTS {}".format(_quote(staging)))
+        conn.execute("CREATE TABLE {} AS SELECT * FROM {} WHERE 0".format(_quote(staging),_quote(layer)))
+        extent = None
+        for datasource,source_layer in sources:
+            conn.execute("ATTACH DATABASE ? AS source",(datasource,))
+            try:
+                source_columns = set(row[1] for row in conn.execute("PRAGMA source.table_info({})".format(_quote(source_layer))))
+                missing = source_columns - set(columns)
+                if missing:
+                    raise Exception("The columns({}) of the layer({}) in {} are not in the target layer({})".format(",".join(sorted(missing)),source_layer,datasource,layer))
+                select_columns = ",".join(_quote(c) if c in source_columns else "NULL" for c in columns)
+                conn.execute("INSERT INTO {0} ({1}) SELECT {2} FROM source.{3}".format(_quote(staging),",".join(_quote(c) for c in columns),select_columns,_quote(source_layer)))
+                row = conn.execute("SELECT min_x,min_y,max_x,max_y FROM source.gpkg_contents WHERE table_name = ?",(source_layer,)).fetchone()
+                if row and row[0] is not None:
+                    extent = list(row) if extent is None else [min(extent[0],row[0]),min(extent[1],row[1]),max(extent[2],row[2]),max(extent[3],row[3])]
+                conn.commit()
+            finally:
+                conn.execute("DETACH DATABASE source")
+        conn.execute("INSERT INTO {0} ({1}) SELECT {1} FROM {2} ORDER BY {3}".format(_quote(layer),",".join(_quote(c) for c in columns),_quote(staging),_quote(fid_column)))
+        conn.execute("DROP TABLE {}".format(_quote(staging)))
+        features = conn.execute("SELECT count(*) FROM {}".format(_quote(layer))).fetchone()[0]
+        if extent:
+            conn.execute("UPDATE gpkg_contents SET min_x = ?,min_y = ?,max_x = ?,max_y = ? WHERE table_name = ?",(extent[0],extent[1],extent[2],extent[3],layer))
+        if _sqlite_table_exists(conn,"gpkg_ogr_contents"):
+            conn.execute("UPDATE gpkg_ogr_contents SET feature_count = ? WHERE lower(table_name) = lower(?)",(features,layer))
+        conn.commit()
+        conn.execute("VACUUM")
+        return features
+    finally:
+        conn.close()
+
+#the memoized layers' meta data, key is (path,size,mtime,layer)
+_layers_cache = collections.OrderedDict()
+_layers_cache_lock = threading.Lock()
+_layers_cache_size = 256
+
+def get_layers(datasource,layer=None):
+    """
+    Get layers' meta data from spatial data file
+    gpkg file is read with sqlite directly, other formats are read with gdal python bindings if installed; otherwise parse the output of ogrinfo
+    The result is memoized by the file's path, size and modify time
+    layer: only get the specified layer from spatial data file; if none, get all layers 
+    Return a list of layer's metadata
+       fields: a list of fields
+       features: the number of features
+       extent: the extent of the layer
+       fid_column: the feature id column
+       geometry_column: the geometry column
+    """
+    datasource = os.path.abspath(datasource)
+    stat = os.stat(datasource)
+    key = (datasource,stat.st_size,stat.st_mtime_ns,layer)
+    with _layers_cache_lock:
+        layers = _layers_cache.get(key)
+        if layers is not None:
+            _layers_cache.move_to_end(key)
+            return [dict(l) for l in layers]
+
+    layers = None
+    if os.path.splitext(datasource)[1].lower() == ".gpkg":
+        try:
+            layers = _get_gpkg_layers(datasource,layer=layer)
+        except sqlite3.Error:
+            layers = None
+    if layers is None:
+        layers = _get_ogr_layers(datasource,layer=layer) if ogr else _get_layers_by_ogrinfo(datasource,layer=layer)
+
+    with _layers_cache_lock:
+        _layers_cache[key] = layers
+        while len(_layers_cache) > _layers_cache_size:
+            _layers_cache.popitem(last=False)
+    return [dict(l) for l in layers]
+
 def get_feature_count(datasource,layer=None):
     """
     Return the feature count of the specified layer or the first layer
     """
-    layers = getLayers(datasource,layer)
+    layers = get_layers(datasource,layer)
     if len(layers) == 0:
         raise Exception("Layer({}) is not found in datasource({})".format(layer or "",datasource))
     elif len(layers) > 1: